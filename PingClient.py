@@ -1,12 +1,21 @@
 import socket
 import time
 import random
+import argparse
+import selectors
+from array import array
+
+from metrics import LatencyHistogram
 
 # Configuration
 PING_COUNT = 15
 TIMEOUT = 0.6  # Timeout in seconds (600 ms)
 PORT = 12000   # Default port
 BUFFER_SIZE = 1024
+MIN_RING_SIZE = 1 << 16  # Sequence numbers remembered in high-rate mode, to spot late and duplicate replies
+
+# States of a sequence number in high-rate mode
+UNSENT, OUTSTANDING, ANSWERED, LOST, LATE = range(5)
 
 def ping_client(host, port):
     # Create UDP socket
@@ -69,15 +78,209 @@ def ping_client(host, port):
     # Close the socket
     client_socket.close()
 
+class ProbeStats:
+    # Counts and RTTs for one period of a high-rate run.  The histogram keeps
+    # its memory fixed however long the run, and jitter is the mean
+    # difference between consecutive RTTs, as in the summary above.
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.late = 0
+        self.duplicates = 0
+        self.strays = 0
+        self.rtts = LatencyHistogram()
+        self.last_rtt = None
+        self.jitter_total = 0.0
+        self.jitter_count = 0
+
+    def record_rtt(self, rtt):
+        self.received += 1
+        self.rtts.record(rtt)
+        if self.last_rtt is not None:
+            self.jitter_total += abs(rtt - self.last_rtt)
+            self.jitter_count += 1
+        self.last_rtt = rtt
+
+    def summary(self):
+        # The probes sent in a period aren't the ones resolved in it, since
+        # replies and timeouts lag the sends, so the loss is over the probes
+        # resolved in the period: answered in time, or timed out
+        rtts = self.rtts
+        jitter = self.jitter_total / self.jitter_count if self.jitter_count else 0.0
+        resolved = self.received + self.lost
+        loss = f"{100 * self.lost / resolved:.2f}%" if resolved else "n/a"
+        text = (f"sent {self.sent} received {self.received} "
+                f"lost {self.lost} of {resolved} resolved ({loss} loss) "
+                f"late {self.late} duplicate {self.duplicates}"
+                + (f" stray {self.strays}" if self.strays else ""))
+        if not rtts.count:
+            return text + " | rtt ms n/a"
+        return (text + f" | rtt ms min {rtts.min * 1000:.3f} avg {rtts.mean * 1000:.3f} "
+                f"p50 {rtts.percentile(50) * 1000:.3f} p99 {rtts.percentile(99) * 1000:.3f} "
+                f"max {rtts.max * 1000:.3f} jitter {jitter * 1000:.3f}")
+
+
+def rate_ping_client(host, port, rate, window, count=0, timeout=TIMEOUT, interval=1.0):
+    # Send probes at a fixed rate without waiting for replies, keeping up to
+    # `window` outstanding, and match replies to probes by sequence number.
+    # A probe unanswered after `timeout` seconds counts as lost; if its reply
+    # turns up later it is counted as late, and a second reply to a probe as
+    # a duplicate.  Runs until `count` probes have been sent (forever if 0)
+    # or Ctrl+C, printing a summary every `interval` seconds and at the end.
+    #
+    # The state of each sequence number lives in rings indexed by sequence
+    # number, big enough to cover every probe that can still be outstanding,
+    # so memory stays constant however long the run.
+    ring_size = MIN_RING_SIZE
+    while ring_size < 2 * (window + rate * timeout):
+        ring_size *= 2
+    send_times = array('d', bytes(8 * ring_size))
+    ring_seqs = array('q', [-1]) * ring_size
+    states = bytearray(ring_size)
+
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+    client_socket.connect((host, port))
+    client_socket.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(client_socket, selectors.EVENT_READ)
+
+    first_seq = random.randint(10000, 20000)
+    next_seq = first_seq     # next sequence number to send
+    next_expiry = first_seq  # oldest probe that may still be outstanding
+    outstanding = 0
+    stalls = 0               # sends held back because the window was full
+    total = ProbeStats()
+    period = ProbeStats()
+    start = time.monotonic()
+    next_send = start
+    next_summary = start + interval
+
+    print(f"Pinging {host}:{port} at {rate:g}/s, window {window}, timeout {timeout * 1000:.0f} ms"
+          + (f", {count} probes" if count else ", until interrupted"))
+
+    try:
+        while not count or next_seq < first_seq + count or outstanding:
+            now = time.monotonic()
+
+            # Send every probe that is due, as far as the window allows
+            while (not count or next_seq < first_seq + count) and next_send <= now:
+                if outstanding >= window:
+                    stalls += 1
+                    next_send = now + 1 / rate
+                    break
+                i = next_seq % ring_size
+                try:
+                    client_socket.send(f"PING {next_seq} {int(time.time() * 1000)}\r\n".encode())
+                except (BlockingIOError, ConnectionRefusedError):
+                    pass  # counted as lost when it times out
+                send_times[i] = time.monotonic()
+                ring_seqs[i] = next_seq
+                states[i] = OUTSTANDING
+                outstanding += 1
+                next_seq += 1
+                total.sent += 1
+                period.sent += 1
+                next_send += 1 / rate
+
+            # Expire probes that have waited too long, oldest first
+            while next_expiry < next_seq:
+                i = next_expiry % ring_size
+                if states[i] == OUTSTANDING:
+                    if now - send_times[i] < timeout:
+                        break
+                    states[i] = LOST
+                    outstanding -= 1
+                    total.lost += 1
+                    period.lost += 1
+                next_expiry += 1
+
+            if now >= next_summary:
+                print(f"[{now - start:7.1f}s] {period.summary()}")
+                period = ProbeStats()
+                next_summary += interval
+
+            # Wait for replies until something else is due
+            deadline = next_summary
+            if not count or next_seq < first_seq + count:
+                deadline = min(deadline, next_send)
+            if next_expiry < next_seq:
+                deadline = min(deadline, send_times[next_expiry % ring_size] + timeout)
+            if selector.select(max(0.0, deadline - time.monotonic())):
+                outstanding -= receive_replies(client_socket, ring_size, send_times, ring_seqs, states, total, period)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        selector.close()
+        client_socket.close()
+
+    if period.sent or period.received:
+        print(f"[{time.monotonic() - start:7.1f}s] {period.summary()}")
+    print("\n--- Ping statistics ---")
+    print(total.summary())
+    if stalls:
+        print(f"Sending stalled {stalls} times on a full window of {window}")
+
+
+def receive_replies(client_socket, ring_size, send_times, ring_seqs, states, total, period):
+    # Read every reply waiting on the socket and match it to its probe.
+    # Returns how many outstanding probes were answered.
+    answered = 0
+    while True:
+        try:
+            response = client_socket.recv(BUFFER_SIZE)
+        except BlockingIOError:
+            return answered
+        except ConnectionRefusedError:
+            continue  # an ICMP error for an earlier probe; keep reading
+        receive_time = time.monotonic()
+
+        fields = response.split()
+        if len(fields) < 2 or not fields[1].isdigit():
+            total.strays += 1
+            period.strays += 1
+            continue
+        seq = int(fields[1])
+        i = seq % ring_size
+
+        if ring_seqs[i] != seq:
+            # Not one of ours, or too old to remember
+            total.strays += 1
+            period.strays += 1
+        elif states[i] == OUTSTANDING:
+            states[i] = ANSWERED
+            answered += 1
+            rtt = receive_time - send_times[i]
+            total.record_rtt(rtt)
+            period.record_rtt(rtt)
+        elif states[i] == LOST:
+            # Already counted as lost; note it arrived after all
+            states[i] = LATE
+            total.late += 1
+            period.late += 1
+        else:
+            total.duplicates += 1
+            period.duplicates += 1
+
+
 if __name__ == "__main__":
     # Example usage: python3 PingClient.py <host> <port>
-    import sys
-    if len(sys.argv) != 3:
-        print("Usage: python3 PingClient.py <host> <port>")
-        sys.exit(1)
-    
-    host = sys.argv[1]
-    port = int(sys.argv[2])
-
-    ping_client(host, port)
+    #           or:  python3 PingClient.py <host> <port> --rate 1000 --window 256
+    parser = argparse.ArgumentParser(description="Ping a UDP echo server.  Without --rate, sends "
+                                     f"{PING_COUNT} probes one at a time, as the exercise asks.")
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--rate", type=float, help="probes per second, sent without waiting for replies (enables high-rate mode)")
+    parser.add_argument("--window", type=int, default=1024, help="most probes outstanding at once in high-rate mode (default: 1024)")
+    parser.add_argument("--count", type=int, default=0, help="probes to send in high-rate mode (default: 0, until Ctrl+C)")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT, help=f"seconds before a probe counts as lost in high-rate mode (default: {TIMEOUT})")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between summaries in high-rate mode (default: 1)")
+    args = parser.parse_args()
 
+    if args.rate is None:
+        ping_client(args.host, args.port)
+    else:
+        if args.rate <= 0 or args.window <= 0:
+            parser.error("--rate and --window must be positive")
+        rate_ping_client(args.host, args.port, args.rate, args.window, args.count, args.timeout, args.interval)
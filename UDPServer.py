@@ -1,6 +1,135 @@
 #coding: utf-8
 from socket import *
 #using the socket module
+import argparse
+import multiprocessing
+import select
+import signal
+import sys
+import time
+
+from udp_impairment import COUNTERS as IMPAIRMENT_COUNTERS, DISTRIBUTIONS, Impairment
+
+RECEIVED, SENT, SEND_FAILED = range(3)  # the counters each worker keeps, followed by the impairment's
+NUM_COUNTERS = 3 + len(IMPAIRMENT_COUNTERS)
+
+
+def udp_drops(port):
+    #The kernel's count of datagrams dropped because a socket's receive buffer was full, summed over every socket on the port since it was opened (Linux only; None elsewhere)
+    try:
+        with open('/proc/net/udp') as f:
+            lines = f.readlines()[1:]
+    except OSError:
+        return None
+    drops = 0
+    for line in lines:
+        fields = line.split()
+        if int(fields[1].split(':')[1], 16) == port:
+            drops += int(fields[-1])
+    return drops
+
+
+def worker_main(port, rcvbuf, batch, counters, impairment):
+    #One of several processes with a socket on the same port: with SO_REUSEPORT the kernel spreads the clients' datagrams across them, so each core runs its own copy of the loop below
+    #If impairment is given, every reply goes through it, to be dropped, duplicated or held back until it is due
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  #Ctrl+C reaches the supervisor, which reports the totals before stopping us
+    workerSocket = socket(AF_INET, SOCK_DGRAM)
+    workerSocket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+    #Bigger buffers ride out bursts that would otherwise overflow them and be dropped (the kernel caps these at net.core.rmem_max / wmem_max)
+    workerSocket.setsockopt(SOL_SOCKET, SO_RCVBUF, rcvbuf)
+    workerSocket.setsockopt(SOL_SOCKET, SO_SNDBUF, rcvbuf)
+    workerSocket.bind(('localhost', port))
+    workerSocket.setblocking(False)
+    recvfrom, sendto = workerSocket.recvfrom, workerSocket.sendto
+
+    while 1:
+        #Wait until something arrives (or a held reply is due), then take up to a batch of datagrams in one go and answer them all, so a burst costs one wake up and one counter update rather than one per datagram
+        timeout = None
+        if impairment is not None and impairment.next_time() is not None:
+            timeout = max(0.0, impairment.next_time() - time.monotonic())
+        select.select([workerSocket], [], [], timeout)
+        received = 0
+        replies = []
+        while received < batch:
+            try:
+                message, clientAddress = recvfrom(2048)
+            except BlockingIOError:
+                break
+            received += 1
+            if impairment is None:
+                replies.append((message.upper(), clientAddress))
+            else:
+                for reply in impairment.submit(message.upper(), clientAddress):
+                    replies.append((reply, clientAddress))
+        if impairment is not None:
+            replies += impairment.due()
+        sent = 0
+        for reply, clientAddress in replies:
+            try:
+                sendto(reply, clientAddress)
+                sent += 1
+            except OSError:
+                pass  #send buffer full, or the client has gone: counted as a failed send
+        counters[RECEIVED] += received
+        counters[SENT] += sent
+        counters[SEND_FAILED] += len(replies) - sent
+        if impairment is not None:
+            for i, name in enumerate(IMPAIRMENT_COUNTERS):
+                counters[3 + i] = impairment.counts[name]
+
+
+def run_workers(port, num_workers, rcvbuf, batch, stats_interval, impairment_options=None):
+    #Start the workers, forked so they can share their counters with this process, and report the totals every stats_interval seconds
+    #Each worker gets its own Impairment from impairment_options, if given, seeded differently so they don't all make the same choices
+    context = multiprocessing.get_context('fork')
+    workers = []
+    for i in range(num_workers):
+        counters = multiprocessing.RawArray('q', NUM_COUNTERS)
+        impairment = None
+        if impairment_options is not None:
+            options = dict(impairment_options)
+            if options.get('seed') is not None:
+                options['seed'] += i
+            impairment = Impairment(**options)
+        worker = context.Process(target=worker_main, args=(port, rcvbuf, batch, counters, impairment), daemon=True)
+        worker.start()
+        workers.append((worker, counters))
+
+    def totals():
+        return [sum(counters[i] for _, counters in workers) for i in range(NUM_COUNTERS)]
+
+    def impaired(current):
+        if impairment_options is None:
+            return ''
+        return ' | impaired: ' + ', '.join(f'{name} {current[3 + i]}' for i, name in enumerate(IMPAIRMENT_COUNTERS))
+
+    print(f'The server is ready to receive with {num_workers} workers on port {port}')
+    start = last_time = time.monotonic()
+    last = totals()
+    try:
+        while all(worker.is_alive() for worker, _ in workers):
+            time.sleep(stats_interval)
+            now = time.monotonic()
+            current = totals()
+            rates = [(current[i] - last[i]) / (now - last_time) for i in range(3)]
+            drops = udp_drops(port)
+            print(f'[{now - start:7.1f}s] received {current[RECEIVED]} ({rates[RECEIVED]:.0f}/s) '
+                  f'sent {current[SENT]} ({rates[SENT]:.0f}/s) '
+                  f'dropped {"?" if drops is None else drops} receiving, {current[SEND_FAILED]} sending'
+                  + impaired(current), flush=True)
+            last, last_time = current, now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        #Read the drops while the workers' sockets are still open
+        drops = udp_drops(port)
+        for worker, _ in workers:
+            worker.terminate()
+            worker.join()
+    current = totals()
+    print(f'Totals: received {current[RECEIVED]} sent {current[SENT]} '
+          f'dropped {"?" if drops is None else drops} receiving, {current[SEND_FAILED]} sending'
+          + impaired(current))
 
 #Define connection (socket) parameters
 #Address + Port no
@@ -8,6 +137,41 @@ from socket import *
 # change this port number if required
 serverPort = 12000 
 
+parser = argparse.ArgumentParser(description='UDP server that echoes every message back in upper case.')
+parser.add_argument('--port', type=int, default=serverPort, help=f'port to listen on (default: {serverPort})')
+parser.add_argument('--workers', type=int, default=0, help='high-throughput mode: worker processes sharing the port (default: 0, the simple loop below)')
+parser.add_argument('--rcvbuf', type=int, default=8 << 20, help='socket buffer size in bytes for each worker (default: 8 MiB)')
+parser.add_argument('--batch', type=int, default=64, help='most datagrams a worker handles per wake up (default: 64)')
+parser.add_argument('--stats-interval', type=float, default=1.0, help='seconds between reports of the counters (default: 1)')
+#Impairment mode: any of these runs the server as if over a bad network (see udp_impairment.py), with one worker unless --workers says otherwise
+impairments = parser.add_argument_group('impairment mode')
+impairments.add_argument('--loss', type=float, default=0.0, help='probability of dropping each reply')
+impairments.add_argument('--delay', type=float, default=0.0, help='seconds to delay each reply by')
+impairments.add_argument('--jitter', type=float, default=0.0, help='scale of the random variation in the delay, in seconds')
+impairments.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform', help='distribution of the jitter (default: uniform)')
+impairments.add_argument('--reorder', type=float, default=0.0, help='probability of holding a reply back so that later ones overtake it')
+impairments.add_argument('--reorder-delay', type=float, help='seconds to hold a reordered reply back (default: twice delay plus jitter, at least 0.01)')
+impairments.add_argument('--duplicate', type=float, default=0.0, help='probability of sending a reply twice')
+impairments.add_argument('--rate', type=float, help='most replies sent per second; the rest are dropped')
+impairments.add_argument('--burst', type=float, help='most replies sent at once regardless of --rate (default: a tenth of a second\'s worth)')
+impairments.add_argument('--queue-limit', type=int, default=100000, help='most delayed replies held at once (default: 100000)')
+impairments.add_argument('--seed', type=int, help='seed for the random choices, for reproducible runs (use with one worker)')
+args = parser.parse_args()
+serverPort = args.port
+
+impairment_options = dict(loss=args.loss, delay=args.delay, jitter=args.jitter, distribution=args.distribution,
+                          reorder=args.reorder, reorder_delay=args.reorder_delay, duplicate=args.duplicate,
+                          rate=args.rate, burst=args.burst, queue_limit=args.queue_limit, seed=args.seed)
+try:
+    impaired_mode = Impairment(**impairment_options).active
+except ValueError as e:
+    parser.error(str(e))
+
+if args.workers > 0 or impaired_mode:
+    run_workers(serverPort, max(1, args.workers), args.rcvbuf, args.batch, args.stats_interval,
+                impairment_options if impaired_mode else None)
+    sys.exit()
+
 serverSocket = socket(AF_INET, SOCK_DGRAM)
 #This line creates the server’s socket, called serverSocket. The first parameter indicates the address family; in particular,AF_INET indicates that the underlying network is using IPv4.The second parameter indicates that the socket is of type SOCK_DGRAM,which means it is a UDP socket (rather than a TCP socket, where we use SOCK_STREAM).
 
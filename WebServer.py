@@ -1,71 +1,239 @@
 import socket
-import os
 import argparse
+import selectors
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+from file_cache import FileCache, send_response
+from http_parser import RequestParser
 
-def handle_request(client_socket):
-    while True:
-        request = client_socket.recv(1024).decode()
-        print(f"Request: {request}")
+BACKLOG = 1024  # connections the OS queues until we accept them
+SWEEP_INTERVAL = 1.0  # how often idle connections are checked for expiry, in seconds
 
-        if not request:  
-            client_socket.close()
-            return
 
-        lines = request.splitlines()
-        if len(lines) > 0:
-            file_path = lines[0].split()[1][1:] 
+def handle_requests(client_socket, parser, keep_alive_timeout, file_cache):
+    # Answer every request completed by the data waiting on the socket, in
+    # the order they were sent, and return whether the connection should be
+    # kept open for more.  A request may arrive over several reads, so one
+    # that isn't complete yet stays buffered in the connection's parser.
+    data = client_socket.recv(65536)
 
-            if os.path.exists(file_path) and os.path.isfile(file_path):
-                if file_path.endswith('.png'):
-                    content_type = 'image/png'
-                elif file_path.endswith('.html'):
-                    content_type = 'text/html'
-                    
-                else:
-                    content_type = 'application/octet-stream'  
+    if not data:
+        return False
 
+    for request in parser.feed(data):
+        print(f"Request: {request.method} {request.target}")
+        if not handle_request(client_socket, request, keep_alive_timeout, file_cache):
+            return False
 
+    return not parser.done
+
+
+def handle_request(client_socket, request, keep_alive_timeout, file_cache):
+    # Answer one request, and return whether the connection should be kept
+    # open for another one.
+    error = request.error
+    if not error and request.method != "GET":
+        # Only GET is served, as in web_server.py.  Anything else gets an
+        # error and the connection is closed, so a client that isn't
+        # expecting a body (after a HEAD, say) can't lose track of the framing.
+        error = "501 Not Implemented"
+
+    if error:
+        body = f"<html><body><h1>{error}</h1></body></html>".encode()
+        client_socket.sendall(f"HTTP/1.1 {error}\r\nContent-Type: text/html\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        return False
+
+    keep_alive = request.keep_alive
+    if keep_alive:
+        connection = f"Connection: keep-alive\r\nKeep-Alive: timeout={keep_alive_timeout}"
+        if request.remaining is not None:
+            connection += f", max={request.remaining}"
+        connection += "\r\n"
+    else:
+        connection = "Connection: close\r\n"
+
+    # Found or not, the response comes prebuilt from the cache, which only
+    # stats the file to check it hasn't changed.  Large files are streamed
+    # from disk rather than read into memory, and a client whose copy is
+    # still current (by ETag or date) just gets a 304.  Text is sent gzipped
+    # to clients that accept it.
+    try:
+        cached = file_cache.get(request.path, request.headers)
+    except Exception as e:
+        body = b"<html><body><h1>500 Internal Server Error</h1></body></html>"
+        client_socket.sendall(b"HTTP/1.1 500 Internal Server Error\r\nContent-Type: text/html\r\nContent-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+        return False
+
+    # If a streamed file shrank, the client got less than we promised, so
+    # the connection can't be reused.
+    return send_response(client_socket, cached, connection.encode(), request.headers) and keep_alive
+
+
+class WebServer:
+    # Idle keep-alive connections wait in a selector, costing no thread, and
+    # only a connection with a request waiting is handed to one of a fixed
+    # number of worker threads.  Once answered, the worker hands it back.
+    # Connections idle for longer than the keep-alive timeout are closed, and
+    # connections beyond the maximum are turned away with a 503, as are
+    # requests beyond the maximum per connection.
+
+    def __init__(self, port, workers=16, max_connections=256, keep_alive_timeout=15, file_cache=None, max_requests=100):
+        self.port = port
+        self.file_cache = file_cache or FileCache()
+        self.workers = workers
+        self.max_connections = max_connections
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_requests = max_requests
+        self.parsers = {}  # connection -> its RequestParser, holding any partial request
+        self.selector = selectors.DefaultSelector()
+        self.pool = ThreadPoolExecutor(workers)
+        self.num_connections = 0
+        self.idle = {}  # idle connection -> time it went idle, oldest first
+        self.returned = deque()  # (connection, keep alive) handed back by the workers
+        self.wake_socket, self.wake_writer = socket.socketpair()
+        self.wake_writer.setblocking(False)
+
+    def run(self):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        print ('Socket created')
+        server_socket.bind(('127.0.0.1', self.port))
+        server_socket.listen(BACKLOG)
+        server_socket.setblocking(False)
+        self.wake_socket.setblocking(False)
+        self.selector.register(server_socket, selectors.EVENT_READ)
+        self.selector.register(self.wake_socket, selectors.EVENT_READ)
+
+        print(f"Server is listening on port {self.port} with {self.workers} workers...")
+
+        try:
+            while True:
+                for key, _ in self.selector.select(SWEEP_INTERVAL):
+                    if key.fileobj is server_socket:
+                        self.accept(server_socket)
+                    elif key.fileobj is self.wake_socket:
+                        self.take_back()
+                    else:
+                        # A request has arrived, so stop watching the
+                        # connection while a worker answers it.
+                        self.selector.unregister(key.fileobj)
+                        del self.idle[key.fileobj]
+                        self.pool.submit(self.serve, key.fileobj)
+
+                self.close_expired()
+        except KeyboardInterrupt:
+            print("Shutting down...")
+            print(self.file_cache.compression_report())
+        finally:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            for conn in list(self.idle):
+                conn.close()
+            self.selector.close()
+            server_socket.close()
+
+    def accept(self, server_socket):
+        while True:
+            try:
+                conn, addr = server_socket.accept()
+            except BlockingIOError:
+                return
+
+            if self.num_connections >= self.max_connections:
                 try:
-                    with open(file_path, 'rb') as f:
-                        content = f.read()
-                    response = (f"HTTP/1.1 200 OK\r\n"
-                                f"Content-Type: {content_type}\r\n"
-                                f"Connection: keep-alive\r\n" 
-                                f"Content-Length: {len(content)}\r\n"  
-                                f"\r\n").encode() + content
-                except Exception as e:
-                    response = b"HTTP/1.1 500 Internal Server Error\r\nContent-Type: text/html\r\n\r\n<html><body><h1>500 Internal Server Error</h1></body></html>"
+                    conn.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Type: text/html\r\nContent-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n")
+                except OSError:
+                    pass
+                conn.close()
+                continue
+
+            print(f"Connection from {addr}")
+            self.num_connections += 1
+            self.parsers[conn] = RequestParser(self.max_requests)
+            conn.settimeout(self.keep_alive_timeout)
+            self.wait_for_request(conn)
+
+    def wait_for_request(self, conn):
+        self.idle[conn] = time.monotonic()
+        self.selector.register(conn, selectors.EVENT_READ)
+
+    def serve(self, conn):
+        # Runs on a worker thread.  The timeout set on accept stops a client
+        # that won't read its response from holding the worker forever.
+        try:
+            keep_alive = handle_requests(conn, self.parsers[conn], self.keep_alive_timeout, self.file_cache)
+        except OSError:
+            keep_alive = False
+        except Exception:
+            # Whatever went wrong, the connection must go back to the reactor
+            # to be closed, or it is never closed at all
+            print("Error serving a connection:")
+            traceback.print_exc()
+            keep_alive = False
+
+        self.returned.append((conn, keep_alive))
+
+        try:
+            self.wake_writer.send(b"\0")
+        except BlockingIOError:
+            pass  # the reactor already has a wake up pending
+
+    def take_back(self):
+        try:
+            while self.wake_socket.recv(1024):
+                pass
+        except BlockingIOError:
+            pass
+
+        while self.returned:
+            conn, keep_alive = self.returned.popleft()
+            if keep_alive:
+                self.wait_for_request(conn)
             else:
-                error_message = "<html><body><h1>404 Not Found</h1><p>The requested resource could not be found on this server.</p></body></html>"
-                response = (f"HTTP/1.1 404 Not Found\r\n"
-                            f"Content-Type: text/html\r\n"
-                            f"Content-Length: {len(error_message)}\r\n"
-                            f"Connection: keep-alive\r\n"  
-                            f"\r\n").encode() + error_message.encode()
-        else:
-            response = b"HTTP/1.1 400 Bad Request\r\nContent-Type: text/html\r\n\r\n<html><body><h1>400 Bad Request</h1></body></html>"
-
-        client_socket.sendall(response)  
-        
-        # 不关闭 socket!!
-
-def run_server(port):
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    print ('Socket created')
-    server_socket.bind(('127.0.0.1', port))
-    server_socket.listen(5)
-
-    print(f"Server is listening on port {port}...")
-
-    while True:
-        conn, addr = server_socket.accept()
-        print(f"Connection from {addr}")
-        handle_request(conn)  
+                self.close(conn)
+
+    def close_expired(self):
+        deadline = time.monotonic() - self.keep_alive_timeout
+        while self.idle:
+            conn, since = next(iter(self.idle.items()))
+            if since > deadline:
+                break
+            self.selector.unregister(conn)
+            del self.idle[conn]
+            self.close(conn)
+
+    def close(self, conn):
+        del self.parsers[conn]
+        conn.close()
+        self.num_connections -= 1
+
+
+def run_server(port, workers=16, max_connections=256, keep_alive_timeout=15, file_cache=None, max_requests=100):
+    WebServer(port, workers, max_connections, keep_alive_timeout, file_cache, max_requests).run()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('port', type=int)
+    parser.add_argument('--workers', type=int, default=16, help='threads answering requests (default: 16)')
+    parser.add_argument('--max-connections', type=int, default=256, help='open connections allowed before answering 503 (default: 256)')
+    parser.add_argument('--keep-alive-timeout', type=int, default=15, help='seconds an idle connection is kept open (default: 15)')
+    parser.add_argument('--max-requests', type=int, default=100, help='requests answered on a connection before closing it (default: 100)')
+    parser.add_argument('--cache-size', type=int, default=64, help='MiB of file responses to keep in memory (default: 64)')
+    parser.add_argument('--stream-threshold', type=int, default=1 << 20, help='size in bytes above which files are streamed from disk rather than cached (default: 1 MiB)')
+    parser.add_argument('--revalidate-interval', type=float, default=0.0, help='seconds to serve a cached file without checking it on disk (default: 0)')
+    parser.add_argument('--gzip-cache-size', type=int, default=16, help='MiB of gzipped responses to keep in memory (default: 16)')
+    parser.add_argument('--cache-control', action='append', default=[], metavar='TYPE=VALUE', help="Cache-Control header for a content type, or '*' for all others, e.g. 'image/png=public, max-age=600' (repeatable)")
     args = parser.parse_args()
 
-    run_server(args.port)
+    cache_control = {}
+    for setting in args.cache_control:
+        mime_type, sep, value = setting.partition("=")
+        if not sep:
+            parser.error(f"--cache-control expects TYPE=VALUE, not {setting!r}")
+        cache_control[mime_type.strip()] = value.strip()
+
+    file_cache = FileCache(max_bytes=args.cache_size << 20, stream_threshold=args.stream_threshold,
+                           revalidate_interval=args.revalidate_interval, cache_control=cache_control,
+                           max_compressed_bytes=args.gzip_cache_size << 20)
+    run_server(args.port, args.workers, args.max_connections, args.keep_alive_timeout, file_cache, args.max_requests)
@@ -0,0 +1,338 @@
+#! /usr/bin/env python3
+
+'''
+COMP3331/9331 Computer Networks and Applications
+Programming Tutorial
+
+Usage:      python3 accounts_index.py <accounts_file> [index_file]
+Example:    python3 accounts_index.py accounts.tsv
+
+A compact, memory-mapped index of the accounts file, for servers with far more
+accounts than comfortably fit in a Python dict.
+
+The index is built once from the tab-separated accounts file and written next
+to it (accounts.tsv.idx by default).  Servers then map it into memory rather
+than parsing it, so startup takes milliseconds however many accounts there are,
+only the pages actually looked up are ever read, and every process mapping the
+same index shares one copy of it in the page cache.
+
+The index file consists of a header, an open addressing hash table of
+(key hash, record offset) slots, and the records themselves:
+
+    header:  magic, count, slots, source size, source mtime (ns), data size,
+             offset + 1 of the first record with a slow password hash, or 0
+    slots:   <key hash: u64> <record offset + 1: u64>, 0 offset means empty
+    records: <username length: u16> <value length: u16> <username> <value>
+
+As with the dict loader, lines that don't have exactly two fields are skipped,
+and a username appearing more than once takes its last value.  The size and
+modification time of the accounts file are stored in the header, so a stale
+index is detected and rebuilt.  Running this module builds the index ahead of
+time, which is worthwhile for very large accounts files.
+'''
+
+import argparse
+from array import array
+import hashlib
+import mmap
+import os
+from pathlib import Path
+import struct
+import sys
+import threading
+import time
+
+from password_hashing import is_slow_hash
+
+MAGIC = b'ACCTIDX3'
+HEADER = struct.Struct('<8sQQQQQQ')
+SLOT = struct.Struct('<QQ')
+RECORD = struct.Struct('<HH')
+LOAD_FACTOR = 0.7 # Highest fraction of slots in use.
+
+def main():
+    '''Build the index for an accounts file from the command line.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('accounts_file', help='tab separated file containing account information')
+    parser.add_argument('index_file', nargs='?', help='index file to write (default: <accounts_file>.idx)')
+    args = parser.parse_args()
+
+    index_file = args.index_file or default_index_path(args.accounts_file)
+    start = time.perf_counter()
+    count = build_index(args.accounts_file, index_file)
+    print(f'Indexed {count} accounts in {time.perf_counter() - start:.1f}s: {index_file}')
+
+def default_index_path(accounts_file) -> Path:
+    '''Return where the index for an accounts file is kept by default.'''
+    return Path(f'{accounts_file}.idx')
+
+def key_hash(username: bytes) -> int:
+    '''Return the 64-bit hash of a username, which is stable across processes.'''
+    return int.from_bytes(hashlib.blake2b(username, digest_size=8).digest(), 'little')
+
+def build_index(accounts_file, index_file) -> int:
+    '''Build the index for an accounts file, replacing any existing index
+    atomically so that processes already using it are not disturbed.
+
+    Args:
+        accounts_file (Union[str, Path]): Path to tab-separated file of
+          username-hashed password pairs.
+        index_file (Union[str, Path]): Path of the index file to write.
+
+    Returns:
+        int: The number of accounts in the index.
+    '''
+    accounts_file = Path(accounts_file)
+    index_file = Path(index_file)
+
+    # Stat before reading, so that a change made while we read shows up as a
+    # stale index and triggers another build.
+    source_stat = accounts_file.stat()
+
+    data = bytearray()
+    hashes = array('Q')
+    offsets = array('Q')
+    slow_record = 0
+
+    with accounts_file.open(encoding='utf-8') as f:
+        for line in f:
+            split_line = line.split()
+
+            if len(split_line) != 2:
+                continue
+
+            username, value = (field.encode() for field in split_line)
+
+            if len(username) > 0xFFFF or len(value) > 0xFFFF:
+                continue
+
+            if not slow_record and is_slow_hash(split_line[1]):
+                slow_record = len(data) + 1
+
+            hashes.append(key_hash(username))
+            offsets.append(len(data))
+            data += RECORD.pack(len(username), len(value)) + username + value
+
+    num_slots = int(len(offsets) / LOAD_FACTOR) + 1
+    slots = array('Q', bytes(SLOT.size * num_slots))
+    count = 0
+
+    for h, offset in zip(hashes, offsets):
+        i = h % num_slots
+
+        while slots[2 * i + 1]:
+            if slots[2 * i] == h and record_username(data, slots[2 * i + 1] - 1) \
+                    == record_username(data, offset):
+                # A repeated username replaces the earlier account.
+                count -= 1
+                break
+
+            i = (i + 1) % num_slots
+
+        slots[2 * i] = h
+        slots[2 * i + 1] = offset + 1
+        count += 1
+
+    tmp_file = index_file.with_name(f'{index_file.name}.{os.getpid()}.tmp')
+
+    with tmp_file.open('wb') as f:
+        f.write(HEADER.pack(MAGIC, count, num_slots, source_stat.st_size,
+                            source_stat.st_mtime_ns, len(data), slow_record))
+        slots.tofile(f)
+        f.write(data)
+
+    os.replace(tmp_file, index_file)
+
+    return count
+
+def record_username(data, offset: int) -> bytes:
+    '''Return the username of the record at the given offset.'''
+    username_length, _ = RECORD.unpack_from(data, offset)
+    start = offset + RECORD.size
+    return bytes(data[start:start + username_length])
+
+class AccountsIndex:
+    '''A read-only, memory-mapped accounts index.'''
+
+    def __init__(self, index_file):
+        '''Map an index file into memory.
+
+        Args:
+            index_file (Union[str, Path]): Path of the index file.
+
+        Raises:
+            ValueError: If the file is not a valid index.
+        '''
+        with open(index_file, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mm) < HEADER.size:
+            raise ValueError(f'{index_file} is not an accounts index')
+
+        magic, self.count, self.num_slots, self.source_size, self.source_mtime_ns, \
+            data_size, slow_record = HEADER.unpack_from(self.mm, 0)
+        self.data_start = HEADER.size + SLOT.size * self.num_slots
+
+        if magic != MAGIC or self.num_slots <= self.count \
+                or len(self.mm) != self.data_start + data_size or slow_record > data_size:
+            raise ValueError(f'{index_file} is not an accounts index')
+
+        # A stored slow hash of one of the accounts, or None if none has one.
+        self.slow_hash = None
+
+        if slow_record:
+            position = self.data_start + slow_record - 1
+            username_length, value_length = RECORD.unpack_from(self.mm, position)
+            start = position + RECORD.size + username_length
+            self.slow_hash = self.mm[start:start + value_length].decode()
+
+    def matches(self, source_stat: os.stat_result) -> bool:
+        '''Whether the index was built from the accounts file as it is now.'''
+        return (self.source_size, self.source_mtime_ns) \
+            == (source_stat.st_size, source_stat.st_mtime_ns)
+
+    def get(self, username: str, default=None):
+        '''Look up the stored password hash of an account.
+
+        Args:
+            username (str): The username of the account.
+            default (Optional[str]): The value to return for an unknown username.
+
+        Returns:
+            Optional[str]: The stored password hash, or default.
+        '''
+        key = username.encode()
+        h = key_hash(key)
+        i = h % self.num_slots
+
+        while True:
+            slot_hash, offset = SLOT.unpack_from(self.mm, HEADER.size + SLOT.size * i)
+
+            if not offset:
+                return default
+
+            if slot_hash == h:
+                position = self.data_start + offset - 1
+                username_length, value_length = RECORD.unpack_from(self.mm, position)
+                start = position + RECORD.size
+
+                if self.mm[start:start + username_length] == key:
+                    start += username_length
+                    return self.mm[start:start + value_length].decode()
+
+            i = (i + 1) % self.num_slots
+
+    def __contains__(self, username: str) -> bool:
+        return self.get(username) is not None
+
+    def __len__(self) -> int:
+        return self.count
+
+class AccountsStore:
+    '''
+    The accounts of a server, served from an index of the accounts file that is
+    rebuilt and swapped in whenever the accounts file changes.
+    '''
+
+    def __init__(self, accounts_file, index_file=None, reload_interval: float = 2.0,
+                 rebuild: bool = True):
+        '''Open the index for an accounts file, building it if necessary.
+
+        Args:
+            accounts_file (Union[str, Path]): Path to tab-separated file of
+              username-hashed password pairs.
+            index_file (Union[str, Path]): Path of the index file (default:
+              <accounts_file>.idx).
+            reload_interval (float): How often to check the accounts file for
+              changes, in seconds.
+            rebuild (bool): Whether this process rebuilds the index when the
+              accounts file changes.  When several processes share an index,
+              only one should, and the rest just map each new index once it
+              has been built.
+        '''
+        self.accounts_file = Path(accounts_file)
+        self.index_file = Path(index_file) if index_file else default_index_path(accounts_file)
+        self.reload_interval = reload_interval
+        self.rebuild = rebuild
+        self.index = self.open_index()
+        self.watcher = None
+
+    def open_index(self) -> AccountsIndex:
+        '''Open the index, first rebuilding it if it is missing or stale.'''
+        source_stat = self.accounts_file.stat()
+
+        try:
+            index = AccountsIndex(self.index_file)
+
+            if index.matches(source_stat):
+                return index
+        except (OSError, ValueError):
+            pass
+
+        build_index(self.accounts_file, self.index_file)
+
+        return AccountsIndex(self.index_file)
+
+    def get(self, username: str, default=None):
+        '''Look up the stored password hash of an account.
+
+        Args:
+            username (str): The username of the account.
+            default (Optional[str]): The value to return for an unknown username.
+
+        Returns:
+            Optional[str]: The stored password hash, or default.
+        '''
+        return self.index.get(username, default)
+
+    def __contains__(self, username: str) -> bool:
+        return self.get(username) is not None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def slow_hash(self):
+        '''A stored slow hash of one of the accounts, or None if none has one.'''
+        return self.index.slow_hash
+
+    def start_watching(self) -> None:
+        '''Start a background thread that reloads the accounts when the
+        accounts file changes.  Call this in the process that will use it.'''
+        if self.watcher is None:
+            self.watcher = threading.Thread(target=self.watch, daemon=True)
+            self.watcher.start()
+
+    def watch(self) -> None:
+        '''Poll the accounts file, and swap in a new index when it changes,
+        either rebuilding it or, if another process rebuilds it, waiting for
+        an index that matches the accounts file to appear.
+
+        Lookups already under way keep using the index they started with, which
+        stays mapped until the last of them finishes.
+        '''
+        while True:
+            time.sleep(self.reload_interval)
+
+            try:
+                source_stat = self.accounts_file.stat()
+
+                if self.index.matches(source_stat):
+                    continue
+
+                if self.rebuild:
+                    self.index = self.open_index()
+                else:
+                    index = AccountsIndex(self.index_file)
+
+                    if not index.matches(source_stat):
+                        continue # Not rebuilt yet.
+
+                    self.index = index
+
+                print(f'Reloaded {len(self.index)} accounts from {self.accounts_file}')
+            except (OSError, ValueError) as e:
+                print(f'Error reloading {self.accounts_file}: {e}', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+'''
+COMP3331/9331 Computer Networks and Applications
+Programming Tutorial
+
+A buffered logger that writes from a background thread, so that logging costs
+the server's connection handling code an append to a buffer rather than a
+write to stdout.
+
+Records are filtered by level, and per-request records can be sampled so that
+only a fraction of requests are logged under heavy load.  Accepted records go
+into a bounded buffer, which the writer thread empties in bulk, with a single
+write per batch.  If the buffer is full, the record is dropped and counted
+rather than making the caller wait, and the writer reports how many records
+were dropped.  Records are written exactly as given, one per line.
+'''
+
+from collections import deque
+import random
+import sys
+import threading
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR, 'off': OFF}
+
+class AsyncLogger:
+    '''A thread-safe logger with a bounded buffer and a background writer.'''
+
+    def __init__(self, stream=None, level: int = INFO, sample_rate: float = 1.0,
+                 capacity: int = 65536, flush_interval: float = 0.1):
+        '''Initialise the logger.  Nothing is written until start() is called.
+
+        Args:
+            stream (TextIO): Where to write the records (default: sys.stdout).
+            level (int): The lowest level of record to keep.
+            sample_rate (float): The fraction of requests to log, see sample().
+            capacity (int): The most records to buffer before dropping them.
+            flush_interval (float): The longest a record waits in the buffer,
+              in seconds.
+        '''
+        self.stream = stream
+        self.level = level
+        self.sample_rate = sample_rate
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.buffer = deque()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.dropped = 0
+        self.dropped_reported = 0
+        self.writer = None
+        self.closing = False
+
+    def start(self) -> None:
+        '''Start the writer thread.  Call this in the process that will log.'''
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.write_loop, daemon=True)
+            self.writer.start()
+
+    def sample(self) -> bool:
+        '''Decide whether to log a request at INFO level.
+
+        Returns:
+            bool: True for a random sample_rate fraction of calls, if INFO
+                records are being kept.
+        '''
+        if self.level > INFO:
+            return False
+
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def log(self, level: int, message: str) -> None:
+        '''Buffer a record, or drop it if the buffer is full.
+
+        Args:
+            level (int): The level of the record.
+            message (str): The record, without a trailing newline.
+        '''
+        if level < self.level:
+            return
+
+        with self.lock:
+            if len(self.buffer) >= self.capacity:
+                self.dropped += 1
+                return
+
+            self.buffer.append(message)
+
+            if len(self.buffer) >= self.capacity // 2:
+                # Flush early rather than let the buffer fill up.
+                self.wake.set()
+
+    def debug(self, message: str) -> None:
+        '''Buffer a DEBUG record.'''
+        self.log(DEBUG, message)
+
+    def info(self, message: str) -> None:
+        '''Buffer an INFO record.'''
+        self.log(INFO, message)
+
+    def warning(self, message: str) -> None:
+        '''Buffer a WARNING record.'''
+        self.log(WARNING, message)
+
+    def error(self, message: str) -> None:
+        '''Buffer an ERROR record.'''
+        self.log(ERROR, message)
+
+    def write_loop(self) -> None:
+        '''The writer thread, which flushes the buffer every flush_interval,
+        or sooner once it is half full.'''
+        while not self.closing:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        '''Write every buffered record in one go.'''
+        with self.lock:
+            records = self.buffer
+            self.buffer = deque()
+            dropped = self.dropped - self.dropped_reported
+            self.dropped_reported = self.dropped
+
+        if dropped:
+            records.append(f'log: dropped {dropped} records')
+
+        if not records:
+            return
+
+        stream = self.stream or sys.stdout
+        records.append('')
+        stream.write('\n'.join(records))
+        stream.flush()
+
+    def close(self) -> None:
+        '''Stop the writer thread and write any remaining records.'''
+        self.closing = True
+        self.wake.set()
+
+        if self.writer is not None:
+            self.writer.join()
+
+        self.flush()
@@ -0,0 +1,315 @@
+'''
+COMP3331/9331 Computer Networks and Applications
+Programming Tutorial
+
+Message framing for the authentication protocol, shared by the server and the
+client.
+
+Every message is a sequence of newline terminated lines, so any number of
+requests can be sent back to back on one connection, and a request may arrive
+split across any number of reads.  Blank lines are ignored, and surrounding
+whitespace is stripped from every line.
+
+A single request is a username line followed by a password hash line:
+
+    <username>\\n<password_hash>\\n
+
+and is answered with one of:
+
+    authorised\\n
+    not authorised\\n
+    bad request\\n
+    rate limited\\n
+
+A batch request carries many password hashes for one username:
+
+    batch <username> <count>\\n<password_hash>\\n ... (count lines)
+
+and is answered with a single line holding one character per hash, in order,
+'1' if that hash is authorised and '0' otherwise:
+
+    results <0s and 1s>\\n
+
+A batch request may also be answered with "rate limited", in which case none
+of its password hashes were checked and it should be retried later.  A batch
+with an unreadable line among its hashes is answered with a single "bad
+request", once all of its lines have arrived, and so is a batch of more than
+MAX_BATCH_SIZE hashes, whose hash lines are then skipped.
+
+Usernames never contain whitespace, so a line with a space in it can only be a
+batch header.  Responses are always sent in the order the requests arrived.
+'''
+
+import time
+
+MAX_LINE_LENGTH = 1024 # Longest line accepted, excluding the newline.
+MAX_BATCH_SIZE = 100000 # Most password hashes accepted in one batch request.
+
+AUTHORISED = 'authorised'
+NOT_AUTHORISED = 'not authorised'
+BAD_REQUEST = 'bad request'
+RATE_LIMITED = 'rate limited'
+
+class AuthRequest:
+    '''A single or batch authentication request, or a bad request.'''
+
+    def __init__(self, username, password_hashes, is_batch=False, raw=''):
+        '''Initialise the request.
+
+        Args:
+            username (str): The username of the account, or None for a bad
+              request.
+            password_hashes (List[str]): The password hashes to check.
+            is_batch (bool): Whether this was sent as a batch request.
+            raw (str): The offending input, for a bad request.
+        '''
+        self.username = username
+        self.password_hashes = password_hashes
+        self.is_batch = is_batch
+        self.raw = raw
+        self.received_time = time.monotonic() # For measuring the server's latency.
+
+    @property
+    def is_bad(self) -> bool:
+        '''Whether the request could not be parsed.'''
+        return self.username is None
+
+class RequestParser:
+    '''
+    Incrementally parses the requests on one connection.  Feed it whatever
+    recv() returns, and it returns every request completed so far, keeping any
+    partial request buffered until the rest of it arrives.
+    '''
+
+    def __init__(self):
+        '''Initialise an empty parser.'''
+        self.buffer = bytearray()
+        self.discarding = False # Skipping the rest of an overlong line.
+        self.username = None # Username of a single request awaiting its hash.
+        self.batch = None # Partial batch request awaiting more hashes.
+        self.batch_size = 0
+        self.batch_error = None # First bad line of the partial batch, if any.
+        self.skip_lines = 0 # Lines left of a rejected batch that was too big.
+
+    def feed(self, data: bytes) -> list:
+        '''Add received bytes to the buffer and parse any complete requests.
+
+        Args:
+            data (bytes): The bytes received from the client.
+
+        Returns:
+            List[AuthRequest]: The requests completed by this data, in order.
+        '''
+        self.buffer += data
+        requests = []
+        start = 0
+
+        while True:
+            end = self.buffer.find(b'\n', start)
+
+            if end < 0:
+                break
+
+            line = self.buffer[start:end]
+            start = end + 1
+
+            if self.discarding:
+                self.discarding = False
+                continue
+
+            self.parse_line(line, requests)
+
+        del self.buffer[:start]
+
+        if len(self.buffer) > MAX_LINE_LENGTH:
+            # Don't let a client fill our memory with a line that never ends.
+            # Reject it now and skip everything up to its eventual newline.
+            if self.skip_lines:
+                self.skip_lines -= 1
+            elif self.batch is not None:
+                self.add_batch_line(None, requests, error=self.buffer[:MAX_LINE_LENGTH])
+            else:
+                requests.append(self.bad_request(self.buffer[:MAX_LINE_LENGTH]))
+
+            self.buffer.clear()
+            self.discarding = True
+
+        return requests
+
+    def parse_line(self, line: bytes, requests: list) -> None:
+        '''Parse one complete line, appending any completed request.
+
+        Args:
+            line (bytes): The line, without its newline.
+            requests (List[AuthRequest]): The list of completed requests.
+        '''
+        try:
+            if len(line) > MAX_LINE_LENGTH:
+                raise ValueError('line too long')
+
+            text = line.decode().strip()
+        except ValueError:
+            # A bad line inside a batch still takes the place of one of its
+            # hashes, so that the rest of the batch isn't read as new requests.
+            if self.skip_lines:
+                self.skip_lines -= 1
+            elif self.batch is not None:
+                self.add_batch_line(None, requests, error=line)
+            else:
+                requests.append(self.bad_request(line))
+            return
+
+        line = text
+
+        if not line:
+            return
+
+        if self.skip_lines:
+            self.skip_lines -= 1
+        elif self.batch is not None:
+            self.add_batch_line(line, requests)
+        elif self.username is not None:
+            requests.append(AuthRequest(self.username, [line]))
+            self.username = None
+        elif ' ' in line or '\t' in line:
+            self.parse_batch_header(line, requests)
+        else:
+            self.username = line
+
+    def parse_batch_header(self, line: str, requests: list) -> None:
+        '''Parse the header line of a batch request.
+
+        Args:
+            line (str): The stripped header line.
+            requests (List[AuthRequest]): The list of completed requests.
+        '''
+        fields = line.split()
+
+        if len(fields) != 3 or fields[0] != 'batch' or not fields[2].isdigit() \
+                or not 0 < int(fields[2]) <= MAX_BATCH_SIZE:
+            requests.append(self.bad_request(line))
+
+            # The hashes of a batch that is only too big still follow, so skip
+            # them rather than reading them as new requests.
+            if len(fields) == 3 and fields[0] == 'batch' and fields[2].isdigit():
+                self.skip_lines = int(fields[2])
+
+            return
+
+        self.batch = AuthRequest(fields[1], [], is_batch=True)
+        self.batch_size = int(fields[2])
+
+    def add_batch_line(self, line, requests: list, error=None) -> None:
+        '''Add one line to the partial batch, appending the batch once it has
+        all its lines.  A batch with any bad line in it is rejected as a whole,
+        with a single bad request.
+
+        Args:
+            line (str): The password hash, or None for a bad line.
+            requests (List[AuthRequest]): The list of completed requests.
+            error (Union[str, bytes]): The bad line, if it was one.
+        '''
+        if error is not None and self.batch_error is None:
+            self.batch_error = error
+
+        self.batch.password_hashes.append(line)
+
+        if len(self.batch.password_hashes) < self.batch_size:
+            return
+
+        if self.batch_error is not None:
+            requests.append(self.bad_request(self.batch_error))
+        else:
+            requests.append(self.batch)
+            self.batch = None
+
+    def bad_request(self, raw) -> AuthRequest:
+        '''Build a bad request, abandoning any partial request.
+
+        Args:
+            raw (Union[str, bytes]): The offending input.
+
+        Returns:
+            AuthRequest: The bad request.
+        '''
+        self.username = None
+        self.batch = None
+        self.batch_error = None
+        self.skip_lines = 0
+
+        if isinstance(raw, (bytes, bytearray)):
+            raw = bytes(raw).decode(errors='replace')
+
+        return AuthRequest(None, [], raw=raw)
+
+def encode_request(username: str, password_hash: str) -> bytes:
+    '''Encode a single authentication request.'''
+    return f'{username}\n{password_hash}\n'.encode()
+
+def encode_batch_request(username: str, password_hashes: list) -> bytes:
+    '''Encode a batch authentication request.'''
+    lines = [f'batch {username} {len(password_hashes)}', *password_hashes, '']
+    return '\n'.join(lines).encode()
+
+def encode_response(response: str) -> bytes:
+    '''Encode the response to a single request.'''
+    return f'{response}\n'.encode()
+
+def encode_batch_response(results: list) -> bytes:
+    '''Encode the response to a batch request.
+
+    Args:
+        results (List[bool]): Whether each password hash was authorised.
+    '''
+    return ('results ' + ''.join('1' if result else '0' for result in results) + '\n').encode()
+
+def parse_batch_response(response: str) -> list:
+    '''Decode the response to a batch request.
+
+    Args:
+        response (str): The response line, without its newline.
+
+    Returns:
+        List[bool]: Whether each password hash was authorised, or None if the
+            server did not send a batch response.
+    '''
+    if not response.startswith('results '):
+        return None
+
+    return [c == '1' for c in response[len('results '):]]
+
+class ResponseReader:
+    '''Reads newline terminated responses from a blocking socket.'''
+
+    def __init__(self, sock, buffer_size: int = 65536):
+        '''Initialise the reader.
+
+        Args:
+            sock (socket.socket): The connected socket to read from.
+            buffer_size (int): The most bytes to read from the socket at once.
+        '''
+        self.sock = sock
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+
+    def read_response(self) -> str:
+        '''Read the next response line.
+
+        Returns:
+            str: The response without its newline, or None if the server
+                closed the connection.
+        '''
+        while True:
+            end = self.buffer.find(b'\n')
+
+            if end >= 0:
+                line = self.buffer[:end].decode()
+                del self.buffer[:end + 1]
+                return line
+
+            data = self.sock.recv(self.buffer_size)
+
+            if not data:
+                return None
+
+            self.buffer += data
@@ -0,0 +1,139 @@
+#! /usr/bin/env python3
+
+'''
+Startup time and memory benchmark for the accounts index.
+
+Usage:      python3 benchmarks/accounts_index_bench.py [--sizes ...] [--lookups N]
+Example:    python3 benchmarks/accounts_index_bench.py --sizes 1000000 10000000
+
+For each size, an accounts file of that many accounts is generated, and then
+each way of loading it is measured in a fresh process: the server's dict
+loader, building the index, and opening the already built index.  The time
+taken, the resident memory afterwards, and the time per lookup of random
+usernames are reported.  Resident memory is split into private (anonymous)
+memory and pages of mapped files, which live in the page cache and are shared
+by every process mapping the same index.  Memory is read from /proc, so this
+only runs on Linux.
+'''
+
+import argparse
+import hashlib
+import importlib.util
+import json
+from pathlib import Path
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from accounts_index import AccountsIndex, build_index
+
+def main():
+    '''Parse the command line arguments and run the benchmark.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000000, 10000000],
+                        help='numbers of accounts to benchmark')
+    parser.add_argument('--lookups', type=int, default=100000,
+                        help='number of random lookups to time')
+    parser.add_argument('--measure', nargs=3, metavar=('METHOD', 'ACCOUNTS_FILE', 'SIZE'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        method, accounts_file, size = args.measure
+        print(json.dumps(measure(method, Path(accounts_file), int(size), args.lookups)))
+        return
+
+    print(f'{"accounts":>10} {"method":>8} {"seconds":>9} {"anon MiB":>9} {"file MiB":>9} '
+          f'{"lookup us":>10}')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            accounts_file = Path(tmp_dir) / f'accounts-{size}.tsv'
+            generate_accounts(accounts_file, size)
+
+            for method in ('dict', 'build', 'index'):
+                output = subprocess.run([sys.executable, __file__, '--lookups', str(args.lookups),
+                                         '--measure', method, str(accounts_file), str(size)],
+                                        check=True, capture_output=True, text=True).stdout
+                result = json.loads(output)
+                print(f'{size:>10} {method:>8} {result["seconds"]:>9.2f} {result["anon"]:>9.1f} '
+                      f'{result["file"]:>9.1f} {result["lookup_us"]:>10.2f}', flush=True)
+
+            accounts_file.unlink()
+            Path(f'{accounts_file}.idx').unlink()
+
+def generate_accounts(accounts_file: Path, size: int) -> None:
+    '''Write an accounts file of the given number of accounts.'''
+    with accounts_file.open('w', encoding='utf-8') as f:
+        for i in range(size):
+            password_hash = hashlib.sha1(str(i).encode()).hexdigest()
+            f.write(f'user{i:08d}\t{password_hash}\n')
+
+def measure(method: str, accounts_file: Path, size: int, lookups: int) -> dict:
+    '''Load the accounts with one method and measure it.
+
+    Args:
+        method (str): 'dict' for the server's dict loader, 'build' to build
+          the index, or 'index' to open the built index.
+        accounts_file (Path): The accounts file.
+        size (int): The number of accounts in the file.
+        lookups (int): The number of random lookups to time.
+
+    Returns:
+        dict: The seconds taken, anonymous and file-backed resident memory in
+            MiB, and microseconds per lookup.
+    '''
+    start = time.perf_counter()
+
+    if method == 'dict':
+        server_module = load_server_module()
+        server = server_module.Server.__new__(server_module.Server)
+        server.accounts = {}
+        server.load_accounts(str(accounts_file))
+        accounts = server.accounts
+    elif method == 'build':
+        build_index(accounts_file, f'{accounts_file}.idx')
+        accounts = AccountsIndex(f'{accounts_file}.idx')
+    else:
+        accounts = AccountsIndex(f'{accounts_file}.idx')
+
+    seconds = time.perf_counter() - start
+
+    usernames = [f'user{random.randrange(size):08d}' for _ in range(lookups)]
+    start = time.perf_counter()
+
+    for username in usernames:
+        accounts.get(username)
+
+    lookup_us = (time.perf_counter() - start) / lookups * 1e6
+
+    anon, file = rss_mib()
+
+    return {'seconds': seconds, 'anon': anon, 'file': file, 'lookup_us': lookup_us}
+
+def load_server_module():
+    '''Import server-2.py, whose name is not a valid module name.'''
+    spec = importlib.util.spec_from_file_location('auth_server', ROOT / 'server-2.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def rss_mib() -> tuple:
+    '''Return the anonymous and file-backed resident memory of this process in MiB.'''
+    anon = file = 0.0
+
+    for line in Path('/proc/self/status').read_text().splitlines():
+        if line.startswith('RssAnon:'):
+            anon = int(line.split()[1]) / 1024
+        elif line.startswith('RssFile:'):
+            file = int(line.split()[1]) / 1024
+
+    return anon, file
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#! /usr/bin/env python3
+
+'''
+Connection scaling benchmark for the authentication server.
+
+Usage:      python3 benchmarks/auth_server_bench.py [--modes ...] [--idle ...]
+Example:    python3 benchmarks/auth_server_bench.py --modes threaded event --idle 0 500 2000
+
+For each server mode and idle connection count, the server is started on a free
+port, the given number of idle clients are connected to it, and then a single
+active client measures the request latency.  The server's CPU usage (while only
+the idle clients are connected), resident memory and thread count are read from
+/proc, so this benchmark only runs on Linux.
+'''
+
+import argparse
+import hashlib
+import os
+from pathlib import Path
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER = Path(__file__).resolve().parent.parent / 'server-2.py'
+USERNAME = 'comp3331'
+PASSWORD = 'password'
+REQUEST_INTERVAL = 0.15 # Keeps the latency samples under the server's default rate limit.
+
+def main():
+    '''Parse the command line arguments and run the benchmark.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', nargs='+', default=['threaded', 'event'],
+                        help='server modes to benchmark')
+    parser.add_argument('--idle', nargs='+', type=int, default=[0, 500, 2000],
+                        help='numbers of idle connections to hold open')
+    parser.add_argument('--samples', type=int, default=50,
+                        help='number of latency samples per run')
+    parser.add_argument('--cpu-window', type=float, default=3.0,
+                        help='seconds over which to measure idle CPU usage')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        accounts_file = Path(tmp_dir) / 'accounts.tsv'
+        password_hash = hashlib.sha1(PASSWORD.encode()).hexdigest()
+        accounts_file.write_text(f'{USERNAME}\t{password_hash}\n', encoding='utf-8')
+
+        print(f'{"mode":>9} {"idle":>6} {"cpu %":>7} {"rss MiB":>8} {"threads":>8} '
+              f'{"p50 ms":>8} {"p99 ms":>8}')
+
+        for mode in args.modes:
+            for num_idle in args.idle:
+                result = run_once(mode, num_idle, accounts_file, args.samples, args.cpu_window)
+                print(f'{mode:>9} {num_idle:>6} {result["cpu"]:>7.1f} {result["rss"]:>8.1f} '
+                      f'{result["threads"]:>8} {result["p50"]:>8.2f} {result["p99"]:>8.2f}',
+                      flush=True)
+
+def run_once(mode: str, num_idle: int, accounts_file: Path, samples: int,
+             cpu_window: float) -> dict:
+    '''Start a server and measure it with the given number of idle clients.
+
+    Args:
+        mode (str): The server mode to pass on the command line.
+        num_idle (int): The number of idle connections to hold open.
+        accounts_file (Path): The accounts file to start the server with.
+        samples (int): The number of latency samples to take.
+        cpu_window (float): Seconds over which to measure idle CPU usage.
+
+    Returns:
+        dict: The measured cpu, rss, threads, p50 and p99 values.
+    '''
+    port = free_port()
+    server = subprocess.Popen([sys.executable, str(SERVER), '--mode', mode,
+                               str(port), str(accounts_file)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    idle_sockets = []
+
+    try:
+        wait_for_port(port)
+
+        for _ in range(num_idle):
+            idle_sockets.append(socket.create_connection(('localhost', port)))
+
+        # Give the server time to accept everything before measuring.
+        time.sleep(1.0)
+        cpu_start = cpu_seconds(server.pid)
+        time.sleep(cpu_window)
+        cpu = (cpu_seconds(server.pid) - cpu_start) / cpu_window * 100
+        rss, threads = memory_and_threads(server.pid)
+
+        latencies = measure_latency(port, samples)
+    finally:
+        for idle_socket in idle_sockets:
+            idle_socket.close()
+
+        server.send_signal(signal.SIGINT)
+
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+    return {
+        'cpu': cpu,
+        'rss': rss,
+        'threads': threads,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+    }
+
+def measure_latency(port: int, samples: int) -> list:
+    '''Time a series of authentication requests on one connection.
+
+    Requests are spaced out to stay within the server's rate limit, so the
+    measured latency is the time taken to notice and serve the request.
+
+    Args:
+        port (int): The TCP port of the server.
+        samples (int): The number of requests to time.
+
+    Returns:
+        list: The request latencies in milliseconds.
+    '''
+    password_hash = hashlib.sha1(PASSWORD.encode()).hexdigest()
+    request = f'{USERNAME}\n{password_hash}\n'.encode()
+    latencies = []
+
+    with socket.create_connection(('localhost', port)) as client_socket:
+        for _ in range(samples):
+            start = time.perf_counter()
+            client_socket.sendall(request)
+            client_socket.recv(1024)
+            latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(REQUEST_INTERVAL)
+
+    return latencies
+
+def percentile(values: list, pct: float) -> float:
+    '''Return the nearest-rank percentile of a list of values.'''
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def free_port() -> int:
+    '''Ask the OS for a TCP port that is currently free.'''
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(('localhost', 0))
+        return probe.getsockname()[1]
+
+def wait_for_port(port: int, timeout: float = 10.0) -> None:
+    '''Block until something is accepting connections on the given port.'''
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('localhost', port)).close()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+
+    sys.exit(f'Error: server did not start listening on port {port}.')
+
+def cpu_seconds(pid: int) -> float:
+    '''Return the user plus system CPU time consumed by a process.'''
+    fields = Path(f'/proc/{pid}/stat').read_text().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def memory_and_threads(pid: int) -> tuple:
+    '''Return the resident memory in MiB and the thread count of a process.'''
+    rss = threads = 0
+
+    for line in Path(f'/proc/{pid}/status').read_text().splitlines():
+        if line.startswith('VmRSS:'):
+            rss = int(line.split()[1]) / 1024
+        elif line.startswith('Threads:'):
+            threads = int(line.split()[1])
+
+    return rss, threads
+
+if __name__ == '__main__':
+    main()
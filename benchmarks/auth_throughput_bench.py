@@ -0,0 +1,132 @@
+#! /usr/bin/env python3
+
+'''
+Throughput benchmark for the authentication server's worker processes.
+
+Usage:      python3 benchmarks/auth_throughput_bench.py [--workers ...] [--connections N]
+Example:    python3 benchmarks/auth_throughput_bench.py --workers 1 2 4 --connections 1000
+
+For each worker count, the server is started with --workers, and a set of load
+generator processes keep every connection busy with back-to-back requests for a
+fixed duration.  All of the connections come from the same IP address, so the
+server's rate limit is raised with --rate to keep it out of the way.
+'''
+
+import argparse
+import hashlib
+import multiprocessing
+from pathlib import Path
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from auth_server_bench import SERVER, USERNAME, PASSWORD, free_port, wait_for_port
+
+def main():
+    '''Parse the command line arguments and run the benchmark.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4],
+                        help='worker counts to benchmark')
+    parser.add_argument('--mode', choices=('threaded', 'event'), default='event',
+                        help='server mode each worker runs')
+    parser.add_argument('--connections', type=int, default=1000,
+                        help='number of concurrent client connections')
+    parser.add_argument('--clients', type=int, default=multiprocessing.cpu_count(),
+                        help='number of load generator processes')
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='seconds to run each load test for')
+    parser.add_argument('--rate', type=float, default=1e9,
+                        help='per-IP rate limit to start the server with')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        accounts_file = Path(tmp_dir) / 'accounts.tsv'
+        password_hash = hashlib.sha1(PASSWORD.encode()).hexdigest()
+        accounts_file.write_text(f'{USERNAME}\t{password_hash}\n', encoding='utf-8')
+
+        print(f'{"workers":>8} {"requests":>10} {"req/s":>10}')
+
+        for num_workers in args.workers:
+            requests = run_once(num_workers, args.mode, accounts_file, args.connections,
+                                args.clients, args.duration, args.rate)
+            print(f'{num_workers:>8} {requests:>10} {requests / args.duration:>10.0f}',
+                  flush=True)
+
+def run_once(num_workers: int, mode: str, accounts_file: Path, connections: int,
+             clients: int, duration: float, rate: float) -> int:
+    '''Start a server with the given number of workers and load it.
+
+    Returns:
+        int: The number of requests answered within the duration.
+    '''
+    port = free_port()
+    server = subprocess.Popen([sys.executable, str(SERVER), '--mode', mode,
+                               '--workers', str(num_workers), '--rate', str(rate),
+                               '--burst', str(rate), str(port), str(accounts_file)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        wait_for_port(port)
+
+        per_client = [connections // clients + (i < connections % clients)
+                      for i in range(clients)]
+
+        with multiprocessing.Pool(clients) as pool:
+            counts = pool.starmap(generate_load, [(port, n, duration) for n in per_client])
+    finally:
+        server.send_signal(signal.SIGINT)
+
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+    return sum(counts)
+
+def generate_load(port: int, num_connections: int, duration: float) -> int:
+    '''Keep a number of connections busy with requests for a fixed time.
+
+    Args:
+        port (int): The TCP port of the server.
+        num_connections (int): The number of connections to open.
+        duration (float): Seconds to keep sending requests for.
+
+    Returns:
+        int: The number of responses received.
+    '''
+    password_hash = hashlib.sha1(b'wrong password').hexdigest()
+    request = f'{USERNAME}\n{password_hash}\n'.encode()
+    selector = selectors.DefaultSelector()
+    responses = 0
+
+    for _ in range(num_connections):
+        client_socket = socket.create_connection(('localhost', port))
+        client_socket.sendall(request)
+        selector.register(client_socket, selectors.EVENT_READ)
+
+    deadline = time.monotonic() + duration
+
+    while time.monotonic() < deadline:
+        for key, _ in selector.select(max(0, deadline - time.monotonic())):
+            if not key.fileobj.recv(1024):
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                continue
+
+            responses += 1
+            key.fileobj.sendall(request)
+
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+
+    selector.close()
+
+    return responses
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+
+'''
+Cold and warm run benchmark for the client's hash cache.
+
+Usage:      python3 benchmarks/hash_cache_bench.py [--sizes ...] [--append FRACTION]
+Example:    python3 benchmarks/hash_cache_bench.py --sizes 1000000 10000000
+
+For each size, a wordlist of that many passwords is generated, and the time the
+client takes to produce the hash of every password is measured:
+
+- none:    hashing each password as it is read, as with --no-hash-cache.
+- cold:    building the cache from scratch, then reading the hashes from it.
+- warm:    reading the hashes from an up to date cache.
+- append:  after appending --append more passwords to the wordlist, hashing
+           only the new ones into the cache, then reading every hash from it.
+
+No server is involved, so this is the time saved on every run of the client.
+'''
+
+import argparse
+import importlib.util
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from hash_cache import HashCache
+
+def main():
+    '''Parse the command line arguments and run the benchmark.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000000, 10000000],
+                        help='numbers of passwords to benchmark')
+    parser.add_argument('--append', type=float, default=0.1,
+                        help='fraction of the wordlist to append for the append run')
+    args = parser.parse_args()
+
+    print(f'{"passwords":>10} {"run":>7} {"hashed":>10} {"seconds":>9} {"per second":>12}')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            wordlist = Path(tmp_dir) / f'wordlist-{size}.txt'
+            cache_dir = Path(tmp_dir) / 'cache'
+            generate_wordlist(wordlist, 0, size)
+
+            for run in ('none', 'cold', 'warm', 'append'):
+                if run == 'append':
+                    generate_wordlist(wordlist, size, int(size * (1 + args.append)))
+
+                hashed, total, seconds = measure(run, wordlist, cache_dir)
+                print(f'{size:>10} {run:>7} {hashed:>10} {seconds:>9.2f} {total / seconds:>12.0f}',
+                      flush=True)
+
+            wordlist.unlink()
+
+def generate_wordlist(wordlist: Path, start: int, end: int) -> None:
+    '''Write passwords start to end of a generated wordlist, appending them
+    if start is not 0.'''
+    with wordlist.open('a' if start else 'w', encoding='utf-8') as f:
+        for i in range(start, end):
+            f.write(f'password{i}\n')
+
+def measure(run: str, wordlist: Path, cache_dir: Path) -> tuple:
+    '''Produce the hash of every password in the wordlist one way, as the
+    client does.
+
+    Args:
+        run (str): 'none' to hash every password, or 'cold', 'warm' or
+          'append' to use the cache in its current state.
+        wordlist (Path): The wordlist.
+        cache_dir (Path): The cache directory.
+
+    Returns:
+        tuple: The number of passwords hashed, the number of hashes produced,
+            and the seconds taken.
+    '''
+    start = time.perf_counter()
+    total = 0
+
+    if run == 'none':
+        client = load_client_module()
+
+        with wordlist.open(encoding='utf-8') as f:
+            for _ in client.hash_wordlist(f):
+                total += 1
+
+        return total, total, time.perf_counter() - start
+
+    cache = HashCache(wordlist, cache_dir)
+    hashed = cache.update()
+
+    for _ in cache.pairs():
+        total += 1
+
+    cache.close()
+
+    return hashed, total, time.perf_counter() - start
+
+def load_client_module():
+    '''Import client-2.py, whose name is not a valid module name.'''
+    spec = importlib.util.spec_from_file_location('auth_client', ROOT / 'client-2.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+if __name__ == '__main__':
+    main()
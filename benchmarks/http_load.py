@@ -0,0 +1,349 @@
+#! /usr/bin/env python3
+
+'''
+HTTP load generator for the web servers, for use on localhost.
+
+Usage:      python3 benchmarks/http_load.py PORT [--connections N] [--close] [--pipeline N]
+                                                 [--mix PATH[:WEIGHT] ...] [--duration S] [--json]
+Example:    python3 benchmarks/http_load.py 8080 --connections 32 --pipeline 4 \\
+                --mix index.html:90 missing.html:10
+
+Opens a number of connections to a running server and keeps each busy with GET
+requests for a fixed duration.  By default connections are kept alive, with up
+to --pipeline requests in flight on each, and a connection the server closes
+is reopened.  With --close, every request is sent on a new connection with
+"Connection: close".  Each request is for a path drawn from the --mix at
+random by weight, so a mix can weigh small files against large ones, and
+against paths that don't exist to exercise 404s.
+
+A connection that fails to open is retried after a short delay, doubling with
+each failure in a row, so a server that refuses connections while it is
+overloaded isn't left with fewer clients for the rest of the test.  Every
+failure is counted.
+
+Reports the requests answered per second, the throughput of the responses,
+their latency percentiles, from sending a request to receiving the last byte
+of its response, and a count of their status codes.  With --json, these are
+printed as a JSON object instead.  Response content is counted as it arrives
+and never kept, so large files can be downloaded at full speed.
+
+Everything runs in one thread, which at high request rates may become the
+bottleneck rather than the server.  --processes splits the connections across
+that many processes to avoid this.
+'''
+
+import argparse
+from collections import Counter, deque
+import heapq
+import json
+import multiprocessing
+import random
+import selectors
+import socket
+import time
+
+from auth_server_bench import percentile
+
+CONNECT_RETRY_DELAY = 0.01 # Seconds before reopening a connection that failed to open.
+MAX_CONNECT_RETRY_DELAY = 1.0 # Longest wait, which doubles with each failure in a row.
+
+def main():
+    '''Parse the command line arguments and run the load test.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('port', type=int, help='the port the server is listening on')
+    parser.add_argument('--host', default='localhost', help='the host the server is on')
+    parser.add_argument('--connections', type=int, default=16,
+                        help='number of simultaneous connections')
+    parser.add_argument('--close', action='store_true',
+                        help='send each request on a new connection')
+    parser.add_argument('--pipeline', type=int, default=1,
+                        help='requests each kept-alive connection keeps in flight')
+    parser.add_argument('--mix', nargs='+', default=['index.html'], metavar='PATH[:WEIGHT]',
+                        help='paths to request, each with a relative weight (default: 1)')
+    parser.add_argument('--header', action='append', default=[], metavar='NAME: VALUE',
+                        help='an extra header to send with every request (repeatable)')
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='seconds to run the load test for')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='processes to generate the load from')
+    parser.add_argument('--seed', type=int, default=0, help='seed for choosing paths')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    summary = run_load(args.port, args.connections, args.duration, parse_mix(args.mix),
+                       keep_alive=not args.close, pipeline=args.pipeline, headers=args.header,
+                       processes=args.processes, seed=args.seed, host=args.host)
+
+    if args.json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    else:
+        print(format_summary(summary))
+
+def parse_mix(specs: list) -> list:
+    '''Parse PATH[:WEIGHT] specifications into (path, weight) pairs.'''
+    mix = []
+
+    for spec in specs:
+        path, colon, weight = spec.rpartition(':')
+
+        if not colon or not weight.replace('.', '', 1).isdigit():
+            path, weight = spec, '1'
+
+        mix.append((path.lstrip('/'), float(weight)))
+
+    return mix
+
+def run_load(port: int, connections: int, duration: float, mix: list, keep_alive: bool = True,
+             pipeline: int = 1, headers: list = (), processes: int = 1, seed: int = 0,
+             host: str = 'localhost') -> dict:
+    '''Load a server with requests and summarise how it coped.
+
+    Args:
+        port (int): The TCP port of the server.
+        connections (int): The number of connections to keep busy.
+        duration (float): Seconds to keep sending requests for.
+        mix (List[Tuple[str, float]]): The paths to request, with their
+          relative weights.
+        keep_alive (bool): Whether to reuse connections, rather than opening
+          one per request.
+        pipeline (int): The requests to keep in flight on each kept-alive
+          connection.
+        headers (List[str]): Extra "Name: value" headers to send.
+        processes (int): The processes to split the connections across.
+        seed (int): The seed for choosing paths.
+        host (str): The host the server is on.
+
+    Returns:
+        Dict[str, Any]: The summary, as from summarise().
+    '''
+    processes = max(1, min(processes, connections))
+    jobs = [(host, port, connections // processes + (i < connections % processes), duration,
+             mix, keep_alive, pipeline, list(headers), seed + i) for i in range(processes)]
+
+    if processes == 1:
+        results = [generate_load(*jobs[0])]
+    else:
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            results = pool.starmap(generate_load, jobs)
+
+    merged = {'latencies': [], 'statuses': Counter(), 'bytes': 0, 'connects': 0, 'errors': 0,
+              'elapsed': 0.0}
+
+    for result in results:
+        merged['elapsed'] = max(merged['elapsed'], result['elapsed'])
+        merged['latencies'] += result['latencies']
+        merged['statuses'].update(result['statuses'])
+        merged['bytes'] += result['bytes']
+        merged['connects'] += result['connects']
+        merged['errors'] += result['errors']
+
+    return summarise(merged, duration, connections, keep_alive, pipeline)
+
+def generate_load(host: str, port: int, connections: int, duration: float, mix: list,
+                  keep_alive: bool, pipeline: int, headers: list, seed: int) -> dict:
+    '''Keep a number of connections busy with requests, from one thread.
+
+    Returns:
+        Dict[str, Any]: The latency of every request answered in ms, a Counter
+            of their status codes, the bytes received, the connections opened,
+            the number of attempts to open or use one that failed, and the
+            seconds the load ran for.
+    '''
+    rng = random.Random(seed)
+    paths = [path for path, _ in mix]
+    weights = [weight for _, weight in mix]
+    connection = b'keep-alive' if keep_alive else b'close'
+    extra = b''.join(header.encode() + b'\r\n' for header in headers)
+    requests = {path: (f'GET /{path} HTTP/1.1\r\nHost: {host}\r\n'.encode()
+                       + b'Connection: ' + connection + b'\r\n' + extra + b'\r\n')
+                for path in paths}
+    depth = max(1, pipeline) if keep_alive else 1
+    selector = selectors.DefaultSelector()
+    result = {'latencies': [], 'statuses': Counter(), 'bytes': 0, 'connects': 0, 'errors': 0}
+    retries = [] # Heap of (retry time, failures in a row) of connections to reopen.
+
+    def send(client_socket, state, count):
+        chosen = rng.choices(paths, weights, k=count)
+        now = time.perf_counter()
+        state['sent'].extend([now] * count)
+        client_socket.sendall(b''.join(requests[path] for path in chosen))
+
+    def connect(failures=0):
+        client_socket = None
+
+        try:
+            client_socket = socket.create_connection((host, port))
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            state = {'reader': ResponseReader(), 'sent': deque()}
+            send(client_socket, state, depth)
+        except OSError:
+            if client_socket is not None:
+                client_socket.close()
+
+            result['errors'] += 1
+            delay = min(CONNECT_RETRY_DELAY * 2 ** failures, MAX_CONNECT_RETRY_DELAY)
+            heapq.heappush(retries, (time.monotonic() + delay, failures + 1))
+            return
+
+        selector.register(client_socket, selectors.EVENT_READ, state)
+        result['connects'] += 1
+
+    def reconnect(client_socket):
+        selector.unregister(client_socket)
+        client_socket.close()
+        connect()
+
+    start = time.monotonic()
+    deadline = start + duration
+
+    for _ in range(connections):
+        connect()
+
+    while time.monotonic() < deadline:
+        while retries and retries[0][0] <= time.monotonic():
+            connect(heapq.heappop(retries)[1])
+
+        wake = min(deadline, retries[0][0]) if retries else deadline
+
+        for key, _ in selector.select(max(0, wake - time.monotonic())):
+            client_socket, state = key.fileobj, key.data
+
+            try:
+                data = client_socket.recv(1 << 20)
+            except OSError:
+                data = b''
+
+            if not data:
+                # Requests still in flight when the server closes the
+                # connection are lost, and not counted.
+                reconnect(client_socket)
+                continue
+
+            result['bytes'] += len(data)
+            now = time.perf_counter()
+            statuses = state['reader'].feed(data)
+
+            for status in statuses:
+                result['latencies'].append((now - state['sent'].popleft()) * 1000)
+                result['statuses'][status] += 1
+
+            if statuses and not keep_alive:
+                reconnect(client_socket)
+            elif statuses:
+                try:
+                    send(client_socket, state, len(statuses))
+                except OSError:
+                    pass # The server closed the connection, which the next read will find.
+
+    result['elapsed'] = time.monotonic() - start
+
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+
+    selector.close()
+
+    return result
+
+class ResponseReader:
+    '''Incrementally splits the responses on one connection, counting their
+    content rather than keeping it.'''
+
+    def __init__(self):
+        '''Initialise an empty reader.'''
+        self.buffer = bytearray()
+        self.status = None # Status code of the response whose content is arriving.
+        self.content_left = 0
+
+    def feed(self, data: bytes) -> list:
+        '''Add received bytes and return the status codes of the responses
+        they completed.'''
+        completed = []
+        data = memoryview(data)
+
+        while data:
+            if self.status is not None:
+                taken = min(self.content_left, len(data))
+                self.content_left -= taken
+                data = data[taken:]
+
+                if self.content_left:
+                    break
+
+                completed.append(self.status)
+                self.status = None
+                continue
+
+            self.buffer += data
+            data = memoryview(b'')
+            end = self.buffer.find(b'\r\n\r\n')
+
+            if end < 0:
+                break
+
+            head = bytes(self.buffer[:end])
+            data = memoryview(bytes(self.buffer[end + 4:]))
+            self.buffer.clear()
+            lines = head.split(b'\r\n')
+            self.status = int(lines[0].split()[1])
+            self.content_left = 0
+
+            for line in lines[1:]:
+                name, _, value = line.partition(b':')
+
+                if name.strip().lower() == b'content-length':
+                    self.content_left = int(value)
+
+            if not self.content_left:
+                completed.append(self.status)
+                self.status = None
+
+        return completed
+
+def summarise(result: dict, duration: float, connections: int, keep_alive: bool,
+              pipeline: int) -> dict:
+    '''Summarise the results of a load test.
+
+    The rates are over the time the load actually ran for, which can be a
+    little longer than the duration asked for.
+
+    Returns:
+        Dict[str, Any]: The settings, requests answered, requests and MiB per
+            second, latency percentiles in ms, status code counts, and counts
+            of connections opened and failed.
+    '''
+    latencies = result['latencies']
+    elapsed = max(result['elapsed'], 1e-9)
+
+    return {
+        'connections': connections,
+        'keep_alive': keep_alive,
+        'pipeline': pipeline if keep_alive else 1,
+        'duration': duration,
+        'elapsed': round(elapsed, 3),
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'mib_per_second': round(result['bytes'] / elapsed / (1 << 20), 2),
+        'latency_ms': {name: round(percentile(latencies, pct), 3) if latencies else None
+                       for name, pct in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100))},
+        'statuses': {str(status): count for status, count in sorted(result['statuses'].items())},
+        'connects': result['connects'],
+        'connect_errors': result['errors'],
+    }
+
+def format_summary(summary: dict) -> str:
+    '''Format a summary for people to read.'''
+    latency = summary['latency_ms']
+    mode = (f'keep-alive, pipeline {summary["pipeline"]}' if summary['keep_alive']
+            else 'connection per request')
+    statuses = ', '.join(f'{status}: {count}' for status, count in summary['statuses'].items())
+
+    return (f'{summary["connections"]} connections ({mode}) for {summary["elapsed"]:g} s\n'
+            f'requests:    {summary["requests"]} ({summary["requests_per_second"]:.0f}/s)\n'
+            f'throughput:  {summary["mib_per_second"]:.2f} MiB/s\n'
+            f'latency ms:  p50 {latency["p50"]}  p90 {latency["p90"]}  p99 {latency["p99"]}  '
+            f'max {latency["max"]}\n'
+            f'statuses:    {statuses or "none"}\n'
+            f'connections: {summary["connects"]} opened, {summary["connect_errors"]} failed')
+
+if __name__ == '__main__':
+    main()
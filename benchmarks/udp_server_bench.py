@@ -0,0 +1,157 @@
+#! /usr/bin/env python3
+
+'''
+Packets per second benchmark for UDPServer.py.
+
+Usage:      python3 benchmarks/udp_server_bench.py [--workers ...] [--rates ...] [--senders N]
+Example:    python3 benchmarks/udp_server_bench.py --workers 0 1 4 --rates 20000 100000 400000
+
+For each worker count and offered load, the server is started on a free port,
+with --workers set to that count (0 runs its original single loop), and
+--senders client processes each send their share of the offered load in
+datagrams per second for a fixed duration, reading the replies as they go.
+The rate at which datagrams were actually sent and replies received is
+reported, along with the fraction of datagrams that got no reply.
+
+The clients pace themselves in bursts every millisecond, and a single
+process can only send so fast, so a "sent/s" well below the offered load means
+the clients, not the server, were the limit.  Run the senders on spare cores
+for a fair measurement of the server.
+'''
+
+import argparse
+import multiprocessing
+from pathlib import Path
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+SERVER = Path(__file__).resolve().parent.parent / 'UDPServer.py'
+MESSAGE = b'ping 0123456789abcdef'
+BURST_INTERVAL = 0.001 # Seconds between the bursts the clients send.
+DRAIN_TIME = 0.5 # Seconds to wait for replies after sending stops.
+
+def main():
+    '''Parse the command line arguments and run the benchmark.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', nargs='+', type=int, default=[0, 1, 2, 4],
+                        help='server worker counts to benchmark (0 for the simple loop)')
+    parser.add_argument('--rates', nargs='+', type=int, default=[20000, 50000, 100000, 200000],
+                        help='offered loads, in datagrams per second')
+    parser.add_argument('--senders', type=int, default=2,
+                        help='client processes sending the load')
+    parser.add_argument('--duration', type=float, default=3.0,
+                        help='seconds to send for')
+    args = parser.parse_args()
+
+    print(f'{"workers":>8} {"offered/s":>10} {"sent/s":>10} {"replies/s":>10} {"dropped":>8}')
+
+    for workers in args.workers:
+        for rate in args.rates:
+            sent, received = run_once(workers, rate, args.senders, args.duration)
+            dropped = 1 - received / sent if sent else 0
+            print(f'{workers:>8} {rate:>10} {sent / args.duration:>10.0f} '
+                  f'{received / args.duration:>10.0f} {dropped:>8.2%}', flush=True)
+
+def run_once(workers: int, rate: int, senders: int, duration: float) -> tuple:
+    '''Start a server and offer it a load.
+
+    Returns:
+        tuple: The number of datagrams sent, and the number of replies received.
+    '''
+    port = free_udp_port()
+    server = subprocess.Popen([sys.executable, str(SERVER), '--port', str(port),
+                               '--workers', str(workers)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        wait_for_echo(port)
+
+        with multiprocessing.get_context('spawn').Pool(senders) as pool:
+            results = pool.starmap(send_load, [(port, rate / senders, duration)] * senders)
+
+        return sum(sent for sent, _ in results), sum(received for _, received in results)
+    finally:
+        server.send_signal(signal.SIGINT)
+
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+def send_load(port: int, rate: float, duration: float) -> tuple:
+    '''Send datagrams at a rate, counting the replies.
+
+    Returns:
+        tuple: The number of datagrams sent, and the number of replies received.
+    '''
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+    client_socket.connect(('localhost', port))
+    client_socket.setblocking(False)
+    sent = received = 0
+    start = time.monotonic()
+    end = start + duration
+
+    while True:
+        now = time.monotonic()
+
+        if now >= end + DRAIN_TIME:
+            break
+
+        if now < end:
+            due = int((now - start) * rate) - sent
+
+            for _ in range(due):
+                try:
+                    client_socket.send(MESSAGE)
+                except (BlockingIOError, ConnectionRefusedError):
+                    break
+
+                sent += 1
+
+        while True:
+            try:
+                client_socket.recv(2048)
+            except BlockingIOError:
+                break
+            except ConnectionRefusedError:
+                continue
+
+            received += 1
+
+        time.sleep(BURST_INTERVAL)
+
+    client_socket.close()
+
+    return sent, received
+
+def free_udp_port() -> int:
+    '''Ask the OS for a UDP port that is currently free.'''
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(('localhost', 0))
+        return probe.getsockname()[1]
+
+def wait_for_echo(port: int, timeout: float = 10.0) -> None:
+    '''Wait until the server echoes a datagram.'''
+    deadline = time.monotonic() + timeout
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.settimeout(0.1)
+        probe.connect(('localhost', port))
+
+        while time.monotonic() < deadline:
+            try:
+                probe.send(MESSAGE)
+                probe.recv(2048)
+                return
+            except (socket.timeout, ConnectionRefusedError):
+                pass
+
+    raise TimeoutError(f'UDP server on port {port} did not answer')
+
+if __name__ == '__main__':
+    main()
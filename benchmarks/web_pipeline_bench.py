@@ -0,0 +1,167 @@
+#! /usr/bin/env python3
+
+'''
+Pipelining throughput benchmark for the web servers.
+
+Usage:      python3 benchmarks/web_pipeline_bench.py [--server FILE] [--depths ...] [--clients N]
+Example:    python3 benchmarks/web_pipeline_bench.py --server web_server.py --depths 1 8 32
+
+For each pipelining depth, the server is started on a free port, serving a
+small HTML file from a temporary directory.  Each client connection keeps
+that many requests in flight, sending another as each response arrives, so a
+depth of 1 is plain keep-alive.  When the server closes a connection, having
+answered as many requests as it allows on one, the client reconnects and
+carries on.  The number of requests answered per second and their latency
+percentiles are reported, along with the number of reconnections.
+'''
+
+import argparse
+from collections import deque
+from pathlib import Path
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from auth_server_bench import free_port, percentile, wait_for_port
+from web_server_bench import response_length
+
+ROOT = Path(__file__).resolve().parent.parent
+REQUEST = b'GET /index.html HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+def main():
+    '''Parse the command line arguments and run the benchmark.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--server', default='WebServer.py', choices=['WebServer.py', 'web_server.py'],
+                        help='the server to benchmark')
+    parser.add_argument('--depths', nargs='+', type=int, default=[1, 4, 16, 64],
+                        help='numbers of requests each connection keeps in flight')
+    parser.add_argument('--clients', type=int, default=1,
+                        help='number of simultaneous connections (web_server.py only '
+                             'serves one at a time)')
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='seconds to run each load test for')
+    parser.add_argument('--file-size', type=int, default=1024,
+                        help='size of the file requested, in bytes')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        (Path(tmp_dir) / 'index.html').write_bytes(b'x' * args.file_size)
+
+        print(f'{"depth":>6} {"requests":>10} {"req/s":>10} {"p50 ms":>8} {"p99 ms":>8} '
+              f'{"reconnects":>11}')
+
+        for depth in args.depths:
+            latencies, reconnects = run_once(args.server, tmp_dir, args.clients, depth,
+                                             args.duration)
+            print(f'{depth:>6} {len(latencies):>10} {len(latencies) / args.duration:>10.0f} '
+                  f'{percentile(latencies, 50):>8.2f} {percentile(latencies, 99):>8.2f} '
+                  f'{reconnects:>11}', flush=True)
+
+def run_once(server_file: str, doc_root: str, num_clients: int, depth: int,
+             duration: float) -> tuple:
+    '''Start a server and load it with pipelining clients.
+
+    Returns:
+        tuple: The latency of every request answered in ms, and the number of
+            times a client had to reconnect.
+    '''
+    port = free_port()
+    server = subprocess.Popen([sys.executable, str(ROOT / server_file), str(port)],
+                              cwd=doc_root, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+
+    try:
+        wait_for_port(port)
+        return generate_load(port, num_clients, depth, duration)
+    finally:
+        server.send_signal(signal.SIGINT)
+
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+def generate_load(port: int, num_clients: int, depth: int, duration: float) -> tuple:
+    '''Keep a number of connections busy with pipelined requests.
+
+    Args:
+        port (int): The TCP port of the server.
+        num_clients (int): The number of connections to keep open.
+        depth (int): The number of requests each keeps in flight.
+        duration (float): Seconds to keep sending requests for.
+
+    Returns:
+        tuple: The latency of every request answered in ms, and the number of
+            times a client had to reconnect.
+    '''
+    selector = selectors.DefaultSelector()
+    latencies = []
+    reconnects = -num_clients
+
+    def connect():
+        nonlocal reconnects
+        client_socket = socket.create_connection(('localhost', port))
+        now = time.perf_counter()
+        client_socket.sendall(REQUEST * depth)
+        selector.register(client_socket, selectors.EVENT_READ,
+                          {'buffer': b'', 'sent': deque([now] * depth)})
+        reconnects += 1
+
+    for _ in range(num_clients):
+        connect()
+
+    deadline = time.monotonic() + duration
+
+    while time.monotonic() < deadline:
+        for key, _ in selector.select(max(0, deadline - time.monotonic())):
+            client_socket, state = key.fileobj, key.data
+
+            try:
+                data = client_socket.recv(65536)
+            except ConnectionResetError:
+                data = b''
+
+            if not data:
+                # The server has answered all it will on this connection, and
+                # any requests still in flight are lost.
+                selector.unregister(client_socket)
+                client_socket.close()
+                connect()
+                continue
+
+            state['buffer'] += data
+            answered = 0
+
+            while True:
+                length = response_length(state['buffer'])
+
+                if length is None or len(state['buffer']) < length:
+                    break
+
+                latencies.append((time.perf_counter() - state['sent'].popleft()) * 1000)
+                state['buffer'] = state['buffer'][length:]
+                answered += 1
+
+            if answered:
+                now = time.perf_counter()
+                state['sent'].extend([now] * answered)
+
+                try:
+                    client_socket.sendall(REQUEST * answered)
+                except OSError:
+                    pass # The server closed the connection, which the next read will find.
+
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+
+    selector.close()
+
+    return latencies, reconnects
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#! /usr/bin/env python3
+
+'''
+Keep-alive throughput and latency benchmark for WebServer.py.
+
+Usage:      python3 benchmarks/web_server_bench.py [--clients ...] [--workers N] [--duration S]
+Example:    python3 benchmarks/web_server_bench.py --clients 1 100 200 --workers 16
+
+For each client count, the server is started on a free port, serving a small
+HTML file from a temporary directory.  That many keep-alive connections are
+opened at once, and each sends GET requests back to back for a fixed duration,
+waiting for each response before sending the next.  The number of requests
+answered per second and the latency percentiles are reported, along with the
+number of connections turned away with 503 Service Unavailable.
+'''
+
+import argparse
+from pathlib import Path
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from auth_server_bench import free_port, percentile, wait_for_port
+
+SERVER = Path(__file__).resolve().parent.parent / 'WebServer.py'
+REQUEST = b'GET /index.html HTTP/1.1\r\nHost: localhost\r\nConnection: keep-alive\r\n\r\n'
+
+def main():
+    '''Parse the command line arguments and run the benchmark.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', nargs='+', type=int, default=[1, 100, 200],
+                        help='numbers of simultaneous keep-alive clients')
+    parser.add_argument('--workers', type=int, default=16,
+                        help='worker threads to start the server with')
+    parser.add_argument('--max-connections', type=int, default=256,
+                        help='connection limit to start the server with')
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='seconds to run each load test for')
+    parser.add_argument('--file-size', type=int, default=4096,
+                        help='size of the file requested, in bytes')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        (Path(tmp_dir) / 'index.html').write_bytes(b'x' * args.file_size)
+
+        print(f'{"clients":>8} {"requests":>10} {"req/s":>10} {"p50 ms":>8} {"p99 ms":>8} '
+              f'{"max ms":>8} {"503s":>6}')
+
+        for num_clients in args.clients:
+            latencies, rejected = run_once(tmp_dir, num_clients, args.workers,
+                                           args.max_connections, args.duration)
+            print(f'{num_clients:>8} {len(latencies):>10} {len(latencies) / args.duration:>10.0f} '
+                  f'{percentile(latencies, 50):>8.2f} {percentile(latencies, 99):>8.2f} '
+                  f'{max(latencies, default=0):>8.2f} {rejected:>6}', flush=True)
+
+def run_once(doc_root: str, num_clients: int, workers: int, max_connections: int,
+             duration: float) -> tuple:
+    '''Start a server and load it with keep-alive clients.
+
+    Returns:
+        tuple: The latency of every request answered in ms, and the number of
+            connections rejected with 503.
+    '''
+    port = free_port()
+    server = subprocess.Popen([sys.executable, str(SERVER), '--workers', str(workers),
+                               '--max-connections', str(max_connections), str(port)],
+                              cwd=doc_root, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+
+    try:
+        wait_for_port(port)
+        return generate_load(port, num_clients, duration)
+    finally:
+        server.send_signal(signal.SIGINT)
+
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+def generate_load(port: int, num_clients: int, duration: float) -> tuple:
+    '''Keep a number of keep-alive connections busy with requests.
+
+    Args:
+        port (int): The TCP port of the server.
+        num_clients (int): The number of connections to open.
+        duration (float): Seconds to keep sending requests for.
+
+    Returns:
+        tuple: The latency of every request answered in ms, and the number of
+            connections rejected with 503.
+    '''
+    selector = selectors.DefaultSelector()
+    latencies = []
+    rejected = 0
+
+    for _ in range(num_clients):
+        client_socket = socket.create_connection(('localhost', port))
+        client_socket.sendall(REQUEST)
+        selector.register(client_socket, selectors.EVENT_READ,
+                          {'buffer': b'', 'sent': time.perf_counter()})
+
+    deadline = time.monotonic() + duration
+
+    while selector.get_map() and time.monotonic() < deadline:
+        for key, _ in selector.select(max(0, deadline - time.monotonic())):
+            client_socket, state = key.fileobj, key.data
+            data = client_socket.recv(65536)
+
+            if not data:
+                selector.unregister(client_socket)
+                client_socket.close()
+                continue
+
+            state['buffer'] += data
+            length = response_length(state['buffer'])
+
+            if length is None or len(state['buffer']) < length:
+                continue
+
+            if state['buffer'].startswith(b'HTTP/1.1 503'):
+                rejected += 1
+                selector.unregister(client_socket)
+                client_socket.close()
+                continue
+
+            latencies.append((time.perf_counter() - state['sent']) * 1000)
+            state['buffer'] = state['buffer'][length:]
+            state['sent'] = time.perf_counter()
+            client_socket.sendall(REQUEST)
+
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+
+    selector.close()
+
+    return latencies, rejected
+
+def response_length(buffer: bytes):
+    '''Return the length of the complete response at the start of the
+    buffer, or None if its headers haven't all arrived.'''
+    header_end = buffer.find(b'\r\n\r\n')
+
+    if header_end < 0:
+        return None
+
+    for line in buffer[:header_end].split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+
+        if name.strip().lower() == b'content-length':
+            return header_end + 4 + int(value)
+
+    return header_end + 4
+
+if __name__ == '__main__':
+    main()
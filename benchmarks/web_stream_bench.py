@@ -0,0 +1,121 @@
+#! /usr/bin/env python3
+
+'''
+Peak memory benchmark for large downloads from WebServer.py.
+
+Usage:      python3 benchmarks/web_stream_bench.py [--sizes ...] [--concurrent N]
+Example:    python3 benchmarks/web_stream_bench.py --sizes 1 64 512 --concurrent 4
+
+For each file size (in MiB), a file of that size is created, and the server is
+started twice on it: once streaming large files from disk (the default), and
+once with --stream-threshold raised above the file size, so that the file is
+read into memory as it used to be.  Each time, --concurrent clients download
+the file at once, and the server's peak resident memory is read from /proc, so
+this benchmark only runs on Linux.
+'''
+
+import argparse
+from pathlib import Path
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from auth_server_bench import free_port, wait_for_port
+
+SERVER = Path(__file__).resolve().parent.parent / 'WebServer.py'
+
+def main():
+    '''Parse the command line arguments and run the benchmark.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1, 64, 512],
+                        help='file sizes to benchmark, in MiB')
+    parser.add_argument('--concurrent', type=int, default=4,
+                        help='number of simultaneous downloads')
+    args = parser.parse_args()
+
+    print(f'{"MiB":>6} {"path":>9} {"seconds":>8} {"MiB/s":>8} {"peak RSS MiB":>13}')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            with (Path(tmp_dir) / 'large.bin').open('wb') as f:
+                chunk = bytes(range(256)) * 4096
+
+                for _ in range(size):
+                    f.write(chunk)
+
+            for path, threshold in (('stream', None), ('in-memory', (size << 20) + 1)):
+                seconds, peak = run_once(tmp_dir, size << 20, args.concurrent, threshold)
+                print(f'{size:>6} {path:>9} {seconds:>8.2f} '
+                      f'{size * args.concurrent / seconds:>8.0f} {peak:>13.1f}', flush=True)
+
+def run_once(doc_root: str, size: int, concurrent: int, threshold) -> tuple:
+    '''Start a server and download the file from it several times at once.
+
+    Returns:
+        tuple: The seconds taken, and the server's peak resident memory in MiB.
+    '''
+    port = free_port()
+    command = [sys.executable, str(SERVER), str(port)]
+
+    if threshold is not None:
+        command += ['--stream-threshold', str(threshold), '--cache-size', str((threshold >> 20) + 1)]
+
+    server = subprocess.Popen(command, cwd=doc_root, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+
+    try:
+        wait_for_port(port)
+        start = time.perf_counter()
+        threads = [threading.Thread(target=download, args=(port, size))
+                   for _ in range(concurrent)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        seconds = time.perf_counter() - start
+
+        return seconds, peak_rss_mib(server.pid)
+    finally:
+        server.send_signal(signal.SIGINT)
+
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+def download(port: int, size: int) -> None:
+    '''Download the file, discarding it, and check its length.'''
+    with socket.create_connection(('localhost', port)) as client_socket:
+        client_socket.sendall(b'GET /large.bin HTTP/1.1\r\nHost: localhost\r\n'
+                              b'Connection: close\r\n\r\n')
+        received = 0
+
+        while True:
+            data = client_socket.recv(1 << 20)
+
+            if not data:
+                break
+
+            received += len(data)
+
+    if received < size:
+        raise RuntimeError(f'Only received {received} of {size} bytes')
+
+def peak_rss_mib(pid: int) -> float:
+    '''Return the peak resident memory of a process in MiB.'''
+    for line in Path(f'/proc/{pid}/status').read_text().splitlines():
+        if line.startswith('VmHWM:'):
+            return int(line.split()[1]) / 1024
+
+    return 0.0
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#! /usr/bin/env python3
+
+'''
+Scripted load test suite for both web servers.
+
+Usage:      python3 benchmarks/web_suite.py [--servers ...] [--duration S] [--output FILE]
+                                            [--compare OLD_FILE]
+Example:    python3 benchmarks/web_suite.py --output before.json
+            git checkout my-branch
+            python3 benchmarks/web_suite.py --output after.json --compare before.json
+
+Builds a document root of files of several sizes, then for each server starts
+it on a free port and runs each of the SCENARIOS against it with http_load.py,
+one after the other.  web_server.py only serves one connection at a time, so
+its scenarios are run with a single connection.
+
+The results are written as JSON, keyed by server and scenario, along with the
+commit they were measured at, so that the results of two commits can be
+diffed.  --compare prints the change in requests per second and p99 latency of
+every scenario against an earlier results file.
+'''
+
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import platform
+import signal
+import subprocess
+import sys
+import tempfile
+
+from auth_server_bench import free_port, wait_for_port
+from http_load import run_load
+
+ROOT = Path(__file__).resolve().parent.parent
+SERVERS = {
+    # Server file -> the most connections it serves at once.
+    'WebServer.py': None,
+    'web_server.py': 1,
+}
+FILES = {
+    'index.html': 1 << 10,
+    'page.html': 64 << 10,
+    'image.png': 256 << 10,
+    'large.bin': 4 << 20,
+}
+
+# name -> (connections, keep-alive, pipeline depth, path mix, extra headers)
+SCENARIOS = {
+    'keep-alive small': (16, True, 1, [('index.html', 1)], []),
+    'close small': (16, False, 1, [('index.html', 1)], []),
+    'pipelined small': (4, True, 16, [('index.html', 1)], []),
+    'mixed sizes': (32, True, 1, [('index.html', 60), ('page.html', 20), ('image.png', 10),
+                                  ('large.bin', 2), ('missing.html', 8)], []),
+    'gzip text': (16, True, 1, [('page.html', 1)], ['Accept-Encoding: gzip']),
+    'large downloads': (4, True, 1, [('large.bin', 1)], []),
+}
+
+def main():
+    '''Parse the command line arguments and run the suite.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS), choices=list(SERVERS),
+                        help='servers to test')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS),
+                        choices=list(SCENARIOS), metavar='SCENARIO',
+                        help='scenarios to run (default: all)')
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='seconds to run each scenario for')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='processes to generate the load from')
+    parser.add_argument('--output', default='web_suite_results.json',
+                        help='file to write the results to')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    results = {
+        'commit': current_commit(),
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'duration': args.duration,
+        'servers': {},
+    }
+
+    print(f'{"server":>14} {"scenario":>18} {"req/s":>9} {"MiB/s":>8} {"p50 ms":>8} '
+          f'{"p99 ms":>8} {"errors":>7}')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, size in FILES.items():
+            (Path(tmp_dir) / name).write_bytes(document(name, size))
+
+        for server in args.servers:
+            results['servers'][server] = {}
+
+            for scenario in args.scenarios:
+                summary = run_scenario(server, scenario, tmp_dir, args.duration, args.processes)
+                results['servers'][server][scenario] = summary
+                latency = summary['latency_ms']
+                errors = summary['connect_errors'] + sum(
+                    count for status, count in summary['statuses'].items()
+                    if status.startswith('5'))
+                print(f'{server:>14} {scenario:>18} {summary["requests_per_second"]:>9.0f} '
+                      f'{summary["mib_per_second"]:>8.2f} {latency["p50"] or 0:>8.2f} '
+                      f'{latency["p99"] or 0:>8.2f} {errors:>7}', flush=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), results)
+
+def document(name: str, size: int) -> bytes:
+    '''Make the content of a test file: HTML text for .html files, so that
+    it compresses as real pages do, and random bytes for everything else.'''
+    if name.endswith('.html'):
+        line = b'<p>The quick brown fox jumps over the lazy dog.</p>\n'
+        return (line * (size // len(line) + 1))[:size]
+
+    return os.urandom(size)
+
+def run_scenario(server: str, scenario: str, doc_root: str, duration: float,
+                 processes: int) -> dict:
+    '''Start a server and run one scenario against it.
+
+    Returns:
+        Dict[str, Any]: The summary of the load test, from http_load.
+    '''
+    connections, keep_alive, pipeline, mix, headers = SCENARIOS[scenario]
+
+    if SERVERS[server] is not None:
+        connections = min(connections, SERVERS[server])
+
+    port = free_port()
+    process = subprocess.Popen([sys.executable, str(ROOT / server), str(port)], cwd=doc_root,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        wait_for_port(port)
+        return run_load(port, connections, duration, mix, keep_alive=keep_alive,
+                        pipeline=pipeline, headers=headers, processes=processes)
+    finally:
+        process.send_signal(signal.SIGINT)
+
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def current_commit() -> str:
+    '''Return the commit the repository is at, marked if it has changes, or
+    None if it isn't a git repository.'''
+    try:
+        commit = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return commit or None
+
+def compare(old: dict, new: dict) -> None:
+    '''Print the change in each scenario's throughput and p99 latency.'''
+    print(f'\nCompared with {old.get("commit")} ({old.get("date")}):')
+    print(f'{"server":>14} {"scenario":>18} {"req/s":>17} {"p99 ms":>17}')
+
+    for server, scenarios in new['servers'].items():
+        for scenario, summary in scenarios.items():
+            before = old.get('servers', {}).get(server, {}).get(scenario)
+
+            if before is None:
+                continue
+
+            rate = change(before['requests_per_second'], summary['requests_per_second'])
+            p99 = change(before['latency_ms']['p99'], summary['latency_ms']['p99'])
+            print(f'{server:>14} {scenario:>18} {rate:>17} {p99:>17}')
+
+def change(before, after) -> str:
+    '''Format a value's change as "after (+n%)".'''
+    if before is None or after is None:
+        return 'n/a'
+
+    if not before:
+        return f'{after:g}'
+
+    return f'{after:g} ({(after - before) / before:+.0%})'
+
+if __name__ == '__main__':
+    main()
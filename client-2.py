@@ -4,21 +4,54 @@
 COMP3331/9331 Computer Networks and Applications
 Programming Tutorial
 
-Usage:      python3 client.py <server_port> <username> <wordlist>
+Usage:      python3 client.py [--batch-size N] [--connections N] [--pipeline N]
+                              [--hash-processes N] [--no-hash-cache] [--hash-cache-dir DIR]
+                              <server_port> <username> <wordlist>
 Example:    python3 client.py 54321 comp3331 rockyou10k-1.txt
+            python3 client.py --batch-size 1000 54321 comp3331 rockyou10k-1.txt
+            python3 client.py --batch-size 1000 --connections 8 --pipeline 4 \
+                              54321 comp3331 rockyou.txt
 
 The server is expected to be running on the same machine as the client, and the
 server should be started before the client is run.
 
+By default the client sends one request per password and waits for each
+response.  With --batch-size N, it instead sends the password hashes N at a time
+in batch requests (see auth_protocol.py), so a single round trip tries N
+passwords.
+
+For large wordlists, --connections, --pipeline and --hash-processes switch to
+a parallel engine (see wordlist_search.py), which hashes the wordlist in a pool
+of processes and spreads the requests over several connections, each with
+several requests in flight at once.  Every connection stops as soon as one of
+them finds the password.
+
+The hashes of the wordlist's passwords are cached on disk (see hash_cache.py),
+so later runs against the same wordlist, for any username, read them rather
+than hashing every password again.  Only the new passwords are hashed when the
+wordlist has been appended to.  --no-hash-cache hashes every password as it is
+read instead.
+
 Standard libraries included below that you may find helpful to complete the task:
 [socket]: https://docs.python.org/3/library/socket.html
 '''
 
 import argparse
 import hashlib
+from itertools import islice
 import socket
+import sys
+import time
 
-BUFFER_SIZE = 1024
+from auth_protocol import (AUTHORISED, NOT_AUTHORISED, RATE_LIMITED, ResponseReader,
+                           encode_batch_request, encode_request, parse_batch_response)
+from hash_cache import HashCache
+from wordlist_search import WordlistSearch
+
+BUFFER_SIZE = 65536
+RETRY_DELAY = 0.5 # Seconds to wait before first retrying a rate limited request.
+MAX_RETRY_DELAY = 8.0 # Longest wait between retries, which double each time.
+MAX_RETRIES = 10 # Retries of a rate limited request before giving up.
 
 def main():
     """The main function that parses the command line arguments and starts the client."""
@@ -26,11 +59,78 @@ def main():
     parser.add_argument('server_port', type=int, help='TCP port of the server')
     parser.add_argument('username', help='username of the account to authenticate')
     parser.add_argument('wordlist', help='wordlist file')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='number of passwords to try per request (default: 1)')
+    parser.add_argument('--connections', type=int, default=1,
+                        help='number of concurrent connections to the server (default: 1)')
+    parser.add_argument('--pipeline', type=int, default=1,
+                        help='most requests in flight on each connection (default: 1)')
+    parser.add_argument('--hash-processes', type=int,
+                        help='processes hashing the wordlist, 0 for none (default: one per '
+                             'core, with --connections or --pipeline and --no-hash-cache)')
+    parser.add_argument('--no-hash-cache', action='store_true',
+                        help='hash every password rather than caching the hashes on disk')
+    parser.add_argument('--hash-cache-dir', help='directory to cache the hashes of wordlists in')
     args = parser.parse_args()
 
-    authentication_client(args.server_port, args.username, args.wordlist)
+    if args.batch_size < 1:
+        parser.error('--batch-size must be at least 1')
+
+    if args.connections < 1 or args.pipeline < 1:
+        parser.error('--connections and --pipeline must be at least 1')
+
+    if args.hash_processes is not None and args.hash_processes < 0:
+        parser.error('--hash-processes must not be negative')
+
+    hash_cache = None if args.no_hash_cache else open_hash_cache(args.wordlist,
+                                                                  args.hash_cache_dir)
+
+    if args.connections > 1 or args.pipeline > 1 or args.hash_processes is not None:
+        parallel_authentication_client(args.server_port, args.username, args.wordlist,
+                                       args.batch_size, args.connections, args.pipeline,
+                                       args.hash_processes, hash_cache)
+    else:
+        authentication_client(args.server_port, args.username, args.wordlist, args.batch_size,
+                              hash_cache)
+
+def open_hash_cache(wordlist: str, cache_dir: str = None):
+    '''Bring the hash cache of a wordlist up to date.
+
+    Args:
+        wordlist (str): The path to the wordlist file.
+        cache_dir (str): The cache directory (default: see hash_cache.py).
+
+    Returns:
+        Optional[HashCache]: The cache, or None if it could not be written.
+    '''
+    hash_cache = HashCache(wordlist, cache_dir)
+
+    try:
+        hashed = hash_cache.update()
+    except OSError as e:
+        print(f'Not caching password hashes: {e}', file=sys.stderr)
+        return None
+
+    if hashed:
+        print(f'Cached the hashes of {hashed} new passwords: {hash_cache.cache_file}')
+
+    return hash_cache
 
-def authentication_client(server_port: int, username: str, wordlist: str) -> None:
+def hash_wordlist(file):
+    '''Read the passwords in the wordlist file, hashing each in turn.
+
+    Args:
+        file (TextIO): The open wordlist file.
+
+    Yields:
+        Tuple[str, str]: Each password and its SHA-1 hex digest.
+    '''
+    for line in file:
+        password = line.strip()
+        yield password, hashlib.sha1(password.encode()).hexdigest()
+
+def authentication_client(server_port: int, username: str, wordlist: str,
+                          batch_size: int = 1, hash_cache: HashCache = None) -> None:
     '''Connects to the server and sends authentication requests for the given 
        username, trialling each of the passwords in the wordlist file.
     
@@ -38,37 +138,181 @@ def authentication_client(server_port: int, username: str, wordlist: str) -> Non
         server_port (int): The TCP port of the server.
         username (str): The username of the account to authenticate.
         wordlist (str): The path to the wordlist file.
+        batch_size (int): The number of passwords to try in each request.
+        hash_cache (HashCache): The up to date hash cache of the wordlist, or
+          None to hash each password as it is read.
     '''
     print(f'Username: {username}')
     authenticated = False
 
     with open(wordlist, 'r', encoding='utf-8') as file:
+        passwords = hash_cache.pairs() if hash_cache is not None else hash_wordlist(file)
+
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_socket:
             client_socket.connect(('localhost', server_port))
+            reader = ResponseReader(client_socket, BUFFER_SIZE)
 
-            for line in file:
-                password = line.strip()
-                password_hash = hashlib.sha1(password.encode()).hexdigest()
+            if batch_size > 1:
+                authenticated = batch_authentication(client_socket, reader, username,
+                                                     passwords, batch_size)
+            else:
+                authenticated = single_authentication(client_socket, reader, username,
+                                                      passwords)
 
-                # We use carriage return to overwrite the previous password
-                # attempt on the terminal.
-                display = f'Password: {password}'
-                print(display, end='\r')
+    # None means the search stopped on an error, which has been reported.
+    if authenticated is False:
+        print(f'Password not found in wordlist: {wordlist}')
 
-                request = f'{username}\n{password_hash}\n'
-                client_socket.send(request.encode())
-                response = client_socket.recv(BUFFER_SIZE).decode()
+def parallel_authentication_client(server_port: int, username: str, wordlist: str,
+                                   batch_size: int, connections: int, pipeline: int,
+                                   hash_processes: int = None,
+                                   hash_cache: HashCache = None) -> None:
+    '''Trial the passwords in the wordlist file with the parallel engine.
 
-                if response == 'authorised':
-                    print(f'\n{response}')
-                    authenticated = True
-                    break
+    Args:
+        server_port (int): The TCP port of the server.
+        username (str): The username of the account to authenticate.
+        wordlist (str): The path to the wordlist file.
+        batch_size (int): The number of passwords to try in each request.
+        connections (int): The number of concurrent connections to the server.
+        pipeline (int): The most requests in flight on each connection.
+        hash_processes (int): The number of processes hashing the wordlist,
+          or 0 to hash in this process (default: one per core).
+        hash_cache (HashCache): The up to date hash cache of the wordlist, or
+          None to hash the wordlist in hash_processes.
+    '''
+    print(f'Username: {username}')
+    search = WordlistSearch(server_port, username, connections, pipeline, batch_size,
+                            hash_processes, hash_cache)
 
-                # Clear the previous password attempt from the terminal.
-                print(' ' * len(display), end='\r', flush=True)
+    try:
+        password = search.run(wordlist)
+    except ConnectionError as e:
+        print(e)
+        return
 
-    if not authenticated:
+    if password is None:
         print(f'Password not found in wordlist: {wordlist}')
+    else:
+        print(f'Password: {password}')
+        print(AUTHORISED)
+
+def single_authentication(client_socket, reader: ResponseReader, username: str,
+                          passwords) -> bool:
+    '''Trial the passwords in the wordlist file one request at a time.
+
+    Args:
+        client_socket (socket.socket): The socket connected to the server.
+        reader (ResponseReader): The reader for the server's responses.
+        username (str): The username of the account to authenticate.
+        passwords (Iterable[Tuple[str, str]]): Each password in the wordlist
+          and its hash.
+
+    Returns:
+        Optional[bool]: True if one of the passwords was authorised, False if
+            none was, or None if the server closed the connection or sent an
+            unexpected response.
+    '''
+    for password, password_hash in passwords:
+        # We use carriage return to overwrite the previous password
+        # attempt on the terminal.
+        display = f'Password: {password}'
+        print(display, end='\r')
+
+        response = send_request(client_socket, reader, encode_request(username, password_hash))
+
+        if response is None:
+            print('\nServer closed the connection.')
+            return None
+
+        if response == RATE_LIMITED:
+            print(f'\nStill rate limited after {MAX_RETRIES} retries.')
+            return None
+
+        if response == AUTHORISED:
+            print(f'\n{response}')
+            return True
+
+        if response != NOT_AUTHORISED:
+            print(f'\nUnexpected response: {response}')
+            return None
+
+        # Clear the previous password attempt from the terminal.
+        print(' ' * len(display), end='\r', flush=True)
+
+    return False
+
+def send_request(client_socket, reader: ResponseReader, request: bytes) -> str:
+    '''Send a request and read its response, retrying while the server
+    reports that we are over its rate limit.
+
+    Args:
+        client_socket (socket.socket): The socket connected to the server.
+        reader (ResponseReader): The reader for the server's responses.
+        request (bytes): The encoded request.
+
+    Returns:
+        str: The response, or None if the server closed the connection.  This
+            is still RATE_LIMITED if the server rejected every retry.
+    '''
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(min(RETRY_DELAY * 2 ** (attempt - 1), MAX_RETRY_DELAY))
+
+        client_socket.sendall(request)
+        response = reader.read_response()
+
+        if response != RATE_LIMITED:
+            break
+
+    return response
+
+def batch_authentication(client_socket, reader: ResponseReader, username: str, passwords,
+                         batch_size: int) -> bool:
+    '''Trial the passwords in the wordlist file using batch requests.
+
+    Args:
+        client_socket (socket.socket): The socket connected to the server.
+        reader (ResponseReader): The reader for the server's responses.
+        username (str): The username of the account to authenticate.
+        passwords (Iterable[Tuple[str, str]]): Each password in the wordlist
+          and its hash.
+        batch_size (int): The number of passwords to try in each request.
+
+    Returns:
+        Optional[bool]: True if one of the passwords was authorised, False if
+            none was, or None if the server closed the connection or sent an
+            unexpected response.
+    '''
+    while True:
+        batch = list(islice(passwords, batch_size))
+
+        if not batch:
+            return False
+
+        password_hashes = [password_hash for _, password_hash in batch]
+
+        display = f'Passwords: {batch[0][0]} ... {batch[-1][0]}'
+        print(display, end='\r')
+
+        response = send_request(client_socket, reader,
+                                encode_batch_request(username, password_hashes))
+        results = parse_batch_response(response) if response is not None else None
+
+        if response == RATE_LIMITED:
+            print(f'\nStill rate limited after {MAX_RETRIES} retries.')
+            return None
+
+        if results is None:
+            print(f'\nUnexpected response: {response}')
+            return None
+
+        if True in results:
+            print(f'\nPassword: {batch[results.index(True)][0]}')
+            print(AUTHORISED)
+            return True
+
+        print(' ' * len(display), end='\r', flush=True)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,722 @@
+'''
+COMP3331/9331 Computer Networks and Applications
+Programming Tutorial
+
+An in-memory cache of static file responses, shared by the web servers.
+
+Each entry holds the prebuilt status line and content headers of a response,
+and its content, so that serving a cached file costs neither a disk read nor
+any header formatting.  The servers send entries with send_response(), which
+adds their own connection headers and the blank line that ends the headers.
+
+Entries are revalidated with a single stat() of the file, comparing its size
+and modification time, at most once every revalidate_interval seconds (with
+the default of 0, on every request).  Paths that are not regular files are
+cached too, as 404 responses, so repeated requests for a missing file don't
+touch the disk either.  Entries are evicted least recently used first once
+their total size exceeds max_bytes.
+
+Files larger than stream_threshold are never read into memory.  Only their
+headers are cached, and send_response() streams their content from disk with
+socket.sendfile(), which has the kernel copy the file straight to the socket.
+Where sendfile isn't available, the file is copied in CHUNK_SIZE pieces.
+Either way, a large download costs the server a fixed amount of memory however
+big the file is.  Streaming needs a blocking socket, though it may have a
+timeout.
+
+send_response() also answers Range requests, which every 200 response
+advertises with "Accept-Ranges: bytes".  One satisfiable range is sent as a
+206 Partial Content response, several as a multipart/byteranges response, and
+a Range header with none is answered 416 Range Not Satisfiable.  A malformed
+Range header, or one asking for more than MAX_RANGES ranges, is ignored and
+the whole file is sent.  The ranges of a streamed file are sent straight from
+disk at their offsets, and those of a file in memory are sliced from it
+without copying.
+
+Every 200 response carries a strong ETag and a Last-Modified date, both made
+from the file's size and modification time when its entry is built, so they
+cost nothing per request.  Requests with a matching If-None-Match, or failing
+that an If-Modified-Since no earlier than the file's modification time, are
+answered with a bodyless 304 Not Modified.  If-Range is honoured too.  Each
+response's Cache-Control header is chosen by its content type, from the
+cache_control table given to FileCache, whose '*' entry covers every other
+type.
+
+Responses are gzipped for clients whose Accept-Encoding allows it.  A file
+with a "<name>.gz" sidecar at least as new as itself is sent as that sidecar.
+Otherwise a file of a compressible type (see COMPRESSIBLE_TYPES) that is held
+in memory is compressed once per version, and the result kept in a second LRU
+cache bounded by max_compressed_bytes.  Already compressed types such as PNG,
+files too small to gain from it, and streamed files without a sidecar are
+always sent as they are.  Every response for a file that can be sent gzipped
+carries "Vary: Accept-Encoding", and Range requests are answered from the
+uncompressed file.  FileCache counts the bytes that compression saved, for the
+servers to report.
+'''
+
+from collections import OrderedDict
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+import gzip
+import mimetypes
+import os
+import stat
+import threading
+import time
+
+CHUNK_SIZE = 65536 # Size of the pieces large files are copied in without sendfile.
+USE_SENDFILE = hasattr(os, 'sendfile')
+MAX_RANGES = 16 # Most ranges answered in one request.
+BOUNDARY = f'byteranges_{os.urandom(12).hex()}' # Separates the parts of multipart responses.
+
+NOT_FOUND_BODY = (b'<html><body><h1>404 Not Found</h1><p>The requested resource could not '
+                  b'be found on this server.</p></body></html>')
+
+CACHE_CONTROL = {
+    'text/html': 'no-cache',
+    'image/png': 'public, max-age=86400',
+    '*': 'public, max-age=3600',
+}
+
+CONTENT_TYPES = {
+    '.html': 'text/html',
+    '.htm': 'text/html',
+    '.css': 'text/css',
+    '.js': 'text/javascript',
+    '.mjs': 'text/javascript',
+    '.json': 'application/json',
+    '.map': 'application/json',
+    '.xml': 'application/xml',
+    '.txt': 'text/plain',
+    '.md': 'text/markdown',
+    '.csv': 'text/csv',
+    '.svg': 'image/svg+xml',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.ico': 'image/x-icon',
+    '.pdf': 'application/pdf',
+    '.wasm': 'application/wasm',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+    '.mp3': 'audio/mpeg',
+    '.mp4': 'video/mp4',
+    '.zip': 'application/zip',
+    '.gz': 'application/gzip',
+}
+
+# Types worth gzipping.  Images other than SVG, fonts, audio, video and
+# archives are compressed already.
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/xml',
+    'application/wasm',
+    'image/svg+xml',
+    'image/x-icon',
+}
+
+MIN_COMPRESS_SIZE = 256 # Smallest file compressed, as gzip's overhead outweighs any gain below it.
+GZIP_LEVEL = 6
+
+def content_type(path: str) -> str:
+    '''Return the Content-Type to serve a file with, from its extension.'''
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension in CONTENT_TYPES:
+        return CONTENT_TYPES[extension]
+
+    return mimetypes.guess_type(path, strict=False)[0] or 'application/octet-stream'
+
+def is_compressible(mime_type: str) -> bool:
+    '''Return whether content of a type is worth gzipping.'''
+    return mime_type.startswith('text/') or mime_type in COMPRESSIBLE_TYPES
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    '''Return whether the value of an Accept-Encoding header allows gzip.'''
+    if not accept_encoding:
+        return False
+
+    qualities = {}
+
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        quality = 1.0
+
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        qualities[name.strip().lower()] = quality
+
+    for name in ('gzip', 'x-gzip', '*'):
+        if name in qualities:
+            return qualities[name] > 0
+
+    return False
+
+def parse_range(range_header: str, length: int):
+    '''Parse the value of a Range header against the length of a file.
+
+    Args:
+        range_header (str): The value of the Range header.
+        length (int): The length of the file.
+
+    Returns:
+        Optional[List[Tuple[int, int]]]: The first and last byte of each
+            satisfiable range, in the order requested, an empty list if no
+            range is satisfiable, or None if the header is to be ignored.
+    '''
+    unit, _, specs = range_header.partition('=')
+    specs = specs.split(',')
+
+    if unit.strip().lower() != 'bytes' or len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+
+    for spec in specs:
+        first, dash, last = spec.strip().partition('-')
+
+        try:
+            if not dash or not (first or last):
+                return None
+
+            if not first:
+                # The last N bytes of the file.
+                suffix = int(last)
+
+                if suffix > 0 and length > 0:
+                    ranges.append((max(0, length - suffix), length - 1))
+
+                continue
+
+            start = int(first)
+            end = int(last) if last else None
+        except ValueError:
+            return None
+
+        if start < 0 or (end is not None and end < start):
+            return None
+
+        end = length - 1 if end is None else end
+
+        if start < length:
+            ranges.append((start, min(end, length - 1)))
+
+    return ranges
+
+def parse_http_date(value: str):
+    '''Parse an HTTP date into seconds since the epoch, or None if it is not
+    a valid date.'''
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    return int(date.timestamp())
+
+def send_response(client_socket, response: 'CachedResponse', headers: bytes = b'',
+                  request_headers: dict = None) -> bool:
+    '''Send a response, a 304 if the client's copy is still valid, or the
+    ranges of it asked for, streaming its content from disk if it is not held
+    in memory.
+
+    Args:
+        client_socket (socket.socket): The blocking socket for the client
+          connection.
+        response (CachedResponse): The response, from FileCache.get().
+        headers (bytes): The server's own headers, each ending in CRLF.
+        request_headers (Dict[str, str]): The request's headers, with
+          lowercase names.
+
+    Returns:
+        bool: False if a streamed file shrank after its headers were built,
+            so that less content was sent than promised and the connection
+            must be closed.
+
+    Raises:
+        OSError: If the socket fails, or a streamed file can no longer be read.
+    '''
+    request_headers = request_headers or {}
+    length = response.length
+    ranges = None
+
+    if response.status == 200:
+        if response.is_not_modified(request_headers):
+            client_socket.sendall(response.not_modified_head + headers + b'\r\n')
+            return True
+
+        range_header = request_headers.get('range')
+
+        if range_header is not None and response.if_range_matches(request_headers.get('if-range')):
+            ranges = parse_range(range_header, length)
+
+    # The response is made up of pieces, each either bytes to send as they
+    # are or the (offset, count) of some of the content.
+    if ranges is None:
+        head = response.head
+        pieces = [(0, length)]
+    elif not ranges:
+        client_socket.sendall(b'HTTP/1.1 416 Range Not Satisfiable\r\n'
+                              + f'Content-Range: bytes */{length}\r\n'.encode()
+                              + b'Content-Length: 0\r\n' + headers + b'\r\n')
+        return True
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        head = (f'HTTP/1.1 206 Partial Content\r\n'
+                f'Content-Type: {response.content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{length}\r\n'
+                f'Content-Length: {end - start + 1}\r\n').encode() + response.validators
+        pieces = [(start, end - start + 1)]
+    else:
+        pieces = []
+
+        for start, end in ranges:
+            pieces.append((f'\r\n--{BOUNDARY}\r\n'
+                           f'Content-Type: {response.content_type}\r\n'
+                           f'Content-Range: bytes {start}-{end}/{length}\r\n\r\n').encode())
+            pieces.append((start, end - start + 1))
+
+        pieces.append(f'\r\n--{BOUNDARY}--\r\n'.encode())
+        content_length = sum(len(piece) if isinstance(piece, bytes) else piece[1]
+                             for piece in pieces)
+        head = (f'HTTP/1.1 206 Partial Content\r\n'
+                f'Content-Type: multipart/byteranges; boundary={BOUNDARY}\r\n'
+                f'Content-Length: {content_length}\r\n').encode() + response.validators
+
+    if response.body is not None:
+        # Send a response from memory in one go, to save a round of small
+        # writes.
+        body = memoryview(response.body)
+        client_socket.sendall(b''.join([head, headers, b'\r\n']
+                                       + [piece if isinstance(piece, bytes)
+                                          else body[piece[0]:piece[0] + piece[1]]
+                                          for piece in pieces]))
+        return True
+
+    with open(response.path, 'rb') as f:
+        client_socket.sendall(head + headers + b'\r\n')
+
+        for piece in pieces:
+            if isinstance(piece, bytes):
+                client_socket.sendall(piece)
+            elif not send_file_range(client_socket, f, *piece):
+                return False
+
+    return True
+
+def send_file_range(client_socket, f, offset: int, count: int) -> bool:
+    '''Send part of a file to a socket, with sendfile if possible.
+
+    Args:
+        client_socket (socket.socket): The blocking socket to send to.
+        f (BinaryIO): The file, open for reading.
+        offset (int): Where in the file to start.
+        count (int): The number of bytes to send.
+
+    Returns:
+        bool: False if the file ended before count bytes were sent.
+    '''
+    if USE_SENDFILE:
+        return client_socket.sendfile(f, offset, count) == count
+
+    f.seek(offset)
+    sent = 0
+
+    while sent < count:
+        chunk = f.read(min(CHUNK_SIZE, count - sent))
+
+        if not chunk:
+            return False
+
+        client_socket.sendall(chunk)
+        sent += len(chunk)
+
+    return True
+
+class CachedResponse:
+    '''The response for one path, and the version of the file it was built from.'''
+    __slots__ = ('status', 'head', 'body', 'version', 'checked_time', 'path', 'content_type',
+                 'etag', 'last_modified', 'validators', 'negotiable', 'encoding', 'saved',
+                 'length')
+
+    def __init__(self, status: int, head: bytes, body: bytes, version, checked_time: float,
+                 path: str = None, content_type: str = 'text/html', etag: str = None,
+                 last_modified: int = None, validators: bytes = b'', negotiable: bool = False,
+                 encoding: str = None, saved: int = 0, length: int = None):
+        '''Initialise the entry.
+
+        Args:
+            status (int): The status code, 200 or 404.
+            head (bytes): The status line and content headers, each ending in
+              CRLF, without the blank line that ends the headers.
+            body (Optional[bytes]): The content, or None if it is to be
+              streamed from disk.
+            version (Any): What the entry was built from, compared to tell
+              whether it is still valid: the (size, mtime in ns) of the file,
+              or None if it is not a regular file.  A gzipped entry's version
+              is the file's version paired with its sidecar's.
+            checked_time (float): When the file was last stat()ed, in
+              monotonic seconds.
+            path (str): The path of the file, for streaming it.
+            content_type (str): The Content-Type of the content.
+            etag (str): The ETag of this version of the file, quoted.
+            last_modified (int): The modification time of the file, in whole
+              seconds since the epoch.
+            validators (bytes): The ETag, Last-Modified, Cache-Control and
+              Vary headers, which every response for the file repeats.
+            negotiable (bool): Whether the file may also be sent gzipped, so
+              that the encoding sent depends on the request.
+            encoding (str): The Content-Encoding of the content, if any.
+            saved (int): How much shorter the content is than the file, for
+              an encoded response.
+            length (int): The length of the content, which must be given if
+              it is to be streamed.
+        '''
+        self.status = status
+        self.head = head
+        self.body = body
+        self.version = version
+        self.checked_time = checked_time
+        self.path = path
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.validators = validators
+        self.negotiable = negotiable
+        self.encoding = encoding
+        self.saved = saved
+        self.length = len(body) if body is not None else length
+
+    @property
+    def not_modified_head(self) -> bytes:
+        '''The status line and headers of a 304 response for the file.'''
+        return b'HTTP/1.1 304 Not Modified\r\n' + self.validators
+
+    def is_not_modified(self, request_headers: dict) -> bool:
+        '''Whether the client's copy of the file, as described by the
+        If-None-Match or If-Modified-Since headers of its request, is current.'''
+        if_none_match = request_headers.get('if-none-match')
+
+        if if_none_match is not None:
+            # A weak comparison, as If-None-Match calls for.
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or any(tag.removeprefix('W/') == self.etag for tag in tags)
+
+        if_modified_since = request_headers.get('if-modified-since')
+
+        if if_modified_since is not None:
+            since = parse_http_date(if_modified_since)
+            return since is not None and self.last_modified <= since
+
+        return False
+
+    def if_range_matches(self, if_range: str) -> bool:
+        '''Whether a request's Range header applies, given its If-Range header.'''
+        if if_range is None:
+            return True
+
+        if_range = if_range.strip()
+
+        if if_range.startswith(('"', 'W/')):
+            # A strong comparison, so a weak tag never matches.
+            return if_range == self.etag
+
+        return parse_http_date(if_range) == self.last_modified
+
+    @property
+    def size(self) -> int:
+        '''The memory the entry counts against the cache's max_bytes.'''
+        return len(self.head) + (len(self.body) if self.body is not None else 0)
+
+class ResponseTable:
+    '''An LRU table of responses, bounded by the bytes they hold.  Not
+    thread-safe on its own.'''
+
+    def __init__(self, max_bytes: int):
+        '''Initialise an empty table.
+
+        Args:
+            max_bytes (int): The most bytes of responses to keep.
+        '''
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # path -> CachedResponse, least recently used first.
+        self.total_bytes = 0
+
+    def get(self, path: str):
+        '''Return the entry for a path, marking it most recently used, or None.'''
+        entry = self.entries.get(path)
+
+        if entry is not None:
+            self.entries.move_to_end(path)
+
+        return entry
+
+    def store(self, path: str, entry: CachedResponse) -> None:
+        '''Add an entry, evicting the least recently used entries to make room.'''
+        old = self.entries.pop(path, None)
+
+        if old is not None:
+            self.total_bytes -= old.size
+
+        self.entries[path] = entry
+        self.total_bytes += entry.size
+
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+
+class FileCache:
+    '''A thread-safe LRU cache of static file responses.'''
+
+    def __init__(self, max_bytes: int = 64 << 20, stream_threshold: int = 1 << 20,
+                 revalidate_interval: float = 0.0, not_found_body: bytes = NOT_FOUND_BODY,
+                 cache_control: dict = None, max_compressed_bytes: int = 16 << 20):
+        '''Initialise an empty cache.
+
+        Args:
+            max_bytes (int): The most bytes of responses to keep.
+            stream_threshold (int): The largest file to keep in memory.
+              Larger files are streamed from disk.
+            revalidate_interval (float): Seconds for which an entry is served
+              without checking the file.
+            not_found_body (bytes): The HTML content of 404 responses.
+            cache_control (Dict[str, str]): Cache-Control values by content
+              type, overriding those in CACHE_CONTROL.  The '*' entry is used
+              for every type not listed.
+            max_compressed_bytes (int): The most bytes of gzipped responses
+              to keep.
+        '''
+        self.stream_threshold = stream_threshold
+        self.revalidate_interval = revalidate_interval
+        self.not_found_body = not_found_body
+        self.cache_control = {**CACHE_CONTROL, **(cache_control or {})}
+        self.responses = ResponseTable(max_bytes)
+        self.compressed = ResponseTable(max_compressed_bytes) # The gzipped responses, by path.
+        self.hits = 0
+        self.misses = 0
+        self.compressed_responses = 0
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+
+    def get(self, path: str, request_headers: dict = None) -> CachedResponse:
+        '''Return the response for a path, from the cache if it is still valid.
+
+        Args:
+            path (str): The path of the file, as requested.
+            request_headers (Dict[str, str]): The request's headers, with
+              lowercase names, to choose the Content-Encoding by.
+
+        Returns:
+            CachedResponse: The 200 response for the file, gzipped if the
+                request allows it and that is worthwhile, or a 404 response
+                if it is not a regular file.
+
+        Raises:
+            OSError: If the file exists but could not be read.
+        '''
+        request_headers = request_headers or {}
+        entry = self.lookup(self.responses, path, lambda: self.file_version(path),
+                            lambda version, now: self.load(path, version, now))
+
+        if (not entry.negotiable or 'range' in request_headers
+                or not accepts_gzip(request_headers.get('accept-encoding'))):
+            return entry
+
+        sidecar = path + '.gz'
+        compressed = self.lookup(self.compressed, path,
+                                 lambda: (entry.version, self.file_version(sidecar)),
+                                 lambda version, now: self.load_compressed(entry, sidecar,
+                                                                           version[1], now))
+
+        if compressed.encoding is None:
+            return entry
+
+        if not compressed.is_not_modified(request_headers):
+            with self.lock:
+                self.compressed_responses += 1
+                self.bytes_saved += compressed.saved
+
+        return compressed
+
+    def lookup(self, table: ResponseTable, path: str, current_version, load) -> CachedResponse:
+        '''Return the entry for a path from a table if it is still valid, or
+        load it afresh.
+
+        Args:
+            table (ResponseTable): The table to look in.
+            path (str): The path of the file, as requested.
+            current_version (Callable[[], Any]): Checks the file on disk,
+              returning the version that a valid entry would have.
+            load (Callable[[Any, float], CachedResponse]): Builds the entry for
+              a version, given the monotonic time.
+
+        Returns:
+            CachedResponse: The entry.
+        '''
+        now = time.monotonic()
+
+        with self.lock:
+            entry = table.get(path)
+
+            if entry is not None and now - entry.checked_time < self.revalidate_interval:
+                self.hits += 1
+                return entry
+
+        version = current_version()
+
+        if entry is not None and entry.version == version:
+            with self.lock:
+                entry.checked_time = now
+                table.get(path)
+                self.hits += 1
+
+            return entry
+
+        entry = load(version, now)
+
+        with self.lock:
+            self.misses += 1
+            table.store(path, entry)
+
+        return entry
+
+    @staticmethod
+    def file_version(path: str):
+        '''Return the (size, mtime in ns) of a regular file, or None if the
+        path is not a regular file.'''
+        try:
+            st = os.stat(path)
+        except (OSError, ValueError):
+            return None
+
+        if not stat.S_ISREG(st.st_mode):
+            return None
+
+        return st.st_size, st.st_mtime_ns
+
+    def load(self, path: str, version, now: float) -> CachedResponse:
+        '''Build the response for a path from the file on disk.'''
+        if version is None:
+            return CachedResponse(404, self.build_head('404 Not Found', 'text/html',
+                                                       len(self.not_found_body)),
+                                  self.not_found_body, None, now)
+
+        mime_type = content_type(path)
+
+        if version[0] > self.stream_threshold:
+            body = None
+            length = version[0]
+        else:
+            with open(path, 'rb') as f:
+                body = f.read()
+
+            length = len(body)
+
+        # Whether the file can be gzipped is settled here, once per version,
+        # so that files that can't cost nothing more per request.
+        negotiable = ((body is not None and is_compressible(mime_type)
+                       and length >= MIN_COMPRESS_SIZE)
+                      or self.file_version(path + '.gz') is not None)
+
+        # The validators are made once per version of the file, from its
+        # metadata alone, rather than by hashing its content.
+        size, mtime_ns = version
+        etag = f'"{mtime_ns:x}-{size:x}"'
+        last_modified = mtime_ns // 1000000000
+        validators = self.build_validators(etag, last_modified, mime_type, negotiable)
+        head = self.build_head('200 OK', mime_type, length) + b'Accept-Ranges: bytes\r\n' + validators
+
+        return CachedResponse(200, head, body, version, now, path, mime_type, etag, last_modified,
+                              validators, negotiable, length=length)
+
+    def load_compressed(self, entry: CachedResponse, sidecar: str, sidecar_version,
+                        now: float) -> CachedResponse:
+        '''Build the gzipped response for a file, from its sidecar if that is
+        up to date, or else by compressing the file's content.
+
+        Args:
+            entry (CachedResponse): The uncompressed response for the file.
+            sidecar (str): The path of the file's sidecar.
+            sidecar_version (Optional[Tuple[int, int]]): The (size, mtime in
+              ns) of the sidecar, or None if there is none.
+            now (float): The monotonic time.
+
+        Returns:
+            CachedResponse: The gzipped response, or an empty entry with no
+                encoding if the file is better sent as it is.
+        '''
+        version = (entry.version, sidecar_version)
+        size, mtime_ns = entry.version
+
+        if sidecar_version is not None and sidecar_version[1] >= mtime_ns:
+            length = sidecar_version[0]
+            body = None
+            path = sidecar
+
+            if length <= self.stream_threshold:
+                with open(sidecar, 'rb') as f:
+                    body = f.read()
+
+                length = len(body)
+
+            etag = f'"{mtime_ns:x}-{size:x}-gz-{sidecar_version[1]:x}-{sidecar_version[0]:x}"'
+        elif entry.body is not None and is_compressible(entry.content_type):
+            # mtime=0 keeps the output, and so the ETag's meaning, the same
+            # every time the file is compressed.
+            body = gzip.compress(entry.body, GZIP_LEVEL, mtime=0)
+            length = len(body)
+            path = None
+            etag = f'"{mtime_ns:x}-{size:x}-gzip"'
+        else:
+            length = size
+
+        if length >= size:
+            return CachedResponse(200, b'', None, version, now)
+
+        validators = self.build_validators(etag, entry.last_modified, entry.content_type, True)
+        head = (self.build_head('200 OK', entry.content_type, length)
+                + b'Content-Encoding: gzip\r\n' + validators)
+
+        return CachedResponse(200, head, body, version, now, path, entry.content_type, etag,
+                              entry.last_modified, validators, True, 'gzip', size - length, length)
+
+    def build_validators(self, etag: str, last_modified: int, mime_type: str,
+                         negotiable: bool) -> bytes:
+        '''Format the headers that every response for a version of a file
+        repeats, 304s included.'''
+        cache_control = self.cache_control.get(mime_type, self.cache_control.get('*'))
+        validators = (f'ETag: {etag}\r\n'
+                      f'Last-Modified: {formatdate(last_modified, usegmt=True)}\r\n').encode()
+
+        if cache_control:
+            validators += f'Cache-Control: {cache_control}\r\n'.encode()
+
+        if negotiable:
+            validators += b'Vary: Accept-Encoding\r\n'
+
+        return validators
+
+    def compression_report(self) -> str:
+        '''Describe the bandwidth that gzip has saved so far.'''
+        with self.lock:
+            return (f'gzip saved {self.bytes_saved} bytes over {self.compressed_responses} '
+                    f'responses ({self.compressed.total_bytes} bytes of compressed '
+                    f'responses cached)')
+
+    @staticmethod
+    def build_head(status: str, mime_type: str, length: int) -> bytes:
+        '''Format the status line and content headers of a response.'''
+        return (f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: {mime_type}\r\n'
+                f'Content-Length: {length}\r\n').encode()
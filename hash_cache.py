@@ -0,0 +1,271 @@
+#! /usr/bin/env python3
+
+'''
+COMP3331/9331 Computer Networks and Applications
+Programming Tutorial
+
+Usage:      python3 hash_cache.py [--cache-dir DIR] <wordlist> ...
+Example:    python3 hash_cache.py rockyou.txt
+
+A persistent cache of the SHA-1 digests of the passwords in a wordlist, so
+that a client trialling the same wordlist against many usernames hashes each
+password once rather than once per run.
+
+Each wordlist has its own cache file in the cache directory, named after the
+wordlist's absolute path.  The cache file consists of a header and the raw
+20-byte digest of each line of the wordlist, in order:
+
+    header:  magic, count, covered bytes, source size, source mtime (ns),
+             fingerprint
+    digests: <digest: 20 bytes> ... (count of them)
+
+The digests cover the first "covered bytes" of the wordlist, which always end
+at a newline.  Any line after them, such as a final line without a newline, is
+hashed as it is read.  When the size or modification time of the wordlist no
+longer match the header, the fingerprint of the covered bytes (a BLAKE2b hash
+of all of them) tells whether the wordlist has only been appended to.  If so,
+only the new lines are hashed; otherwise the cache is rebuilt.  Hashing the
+whole prefix costs a read of it, but BLAKE2b runs far faster than hashing its
+lines one by one, and an edit anywhere in the prefix is caught.  A new cache
+file is always swapped in atomically, so clients reading the old one are not
+disturbed.  Running this module brings the caches of the given wordlists up
+to date ahead of time.
+'''
+
+import argparse
+import hashlib
+import mmap
+import os
+from pathlib import Path
+import shutil
+import struct
+import time
+
+MAGIC = b'SHA1CAC2'
+HEADER = struct.Struct('<8sQQQQ32s')
+DIGEST_SIZE = 20
+CHUNK_BYTES = 1 << 20 # Roughly how much of the wordlist to read at once.
+
+def main():
+    '''Update the caches of wordlists from the command line.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('wordlists', nargs='+', help='wordlist files')
+    parser.add_argument('--cache-dir', help=f'cache directory (default: {default_cache_dir()})')
+    args = parser.parse_args()
+
+    for wordlist in args.wordlists:
+        cache = HashCache(wordlist, args.cache_dir)
+        start = time.perf_counter()
+        hashed = cache.update()
+        print(f'{wordlist}: hashed {hashed} new passwords in {time.perf_counter() - start:.1f}s, '
+              f'{cache.count} cached: {cache.cache_file}')
+
+def default_cache_dir() -> Path:
+    '''Return where caches are kept by default.'''
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'comp3331-hashes'
+
+def password_digest(line: bytes) -> bytes:
+    '''Return the SHA-1 digest of the password on a line of a wordlist,
+    stripped of surrounding whitespace as the client does.'''
+    return hashlib.sha1(line.decode('utf-8').strip().encode()).digest()
+
+def fingerprint(source, covered: int):
+    '''Hash the first covered bytes of a file.
+
+    Args:
+        source (BinaryIO): The file, open for reading.
+        covered (int): The number of bytes at the start of the file to
+          fingerprint.
+
+    Returns:
+        hashlib.blake2b: The hash, whose 32-byte digest is the fingerprint,
+            and which can be updated with the bytes that follow them.
+    '''
+    fp = hashlib.blake2b(digest_size=32)
+    source.seek(0)
+
+    while covered > 0:
+        data = source.read(min(covered, CHUNK_BYTES))
+
+        if not data:
+            break
+
+        fp.update(data)
+        covered -= len(data)
+
+    return fp
+
+class HashCache:
+    '''The cache of the password digests of one wordlist.'''
+
+    def __init__(self, wordlist, cache_dir=None):
+        '''Initialise the cache.  Nothing is read until update() is called.
+
+        Args:
+            wordlist (Union[str, Path]): Path to the wordlist file.
+            cache_dir (Union[str, Path]): The cache directory (default:
+              default_cache_dir()).
+        '''
+        self.wordlist = Path(wordlist)
+        key = hashlib.sha1(str(self.wordlist.resolve()).encode()).hexdigest()[:16]
+        self.cache_file = Path(cache_dir or default_cache_dir()) / f'{key}.sha1'
+        self.count = 0
+        self.covered = 0
+        self.mm = None
+
+    def read_header(self):
+        '''Return the fields of the cache file's header, or None if there is
+        no valid cache file.'''
+        try:
+            with self.cache_file.open('rb') as f:
+                header = f.read(HEADER.size)
+                size = os.fstat(f.fileno()).st_size
+        except OSError:
+            return None
+
+        if len(header) < HEADER.size:
+            return None
+
+        magic, count, covered, source_size, source_mtime_ns, source_fingerprint = \
+            HEADER.unpack(header)
+
+        if magic != MAGIC or size != HEADER.size + DIGEST_SIZE * count:
+            return None
+
+        return count, covered, source_size, source_mtime_ns, source_fingerprint
+
+    def update(self) -> int:
+        '''Bring the cache up to date with the wordlist and map it into
+        memory, hashing only the lines that are not already cached.
+
+        Returns:
+            int: The number of passwords hashed.
+        '''
+        # Stat before reading, so that a change made while we read shows up
+        # as a stale cache the next time.
+        source_stat = self.wordlist.stat()
+        header = self.read_header()
+        hashed = 0
+
+        if header is None or (header[2], header[3]) \
+                != (source_stat.st_size, source_stat.st_mtime_ns):
+            hashed = self.rebuild(source_stat, header)
+
+        with self.cache_file.open('rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        _, self.count, self.covered, *_ = HEADER.unpack_from(self.mm, 0)
+
+        return hashed
+
+    def rebuild(self, source_stat: os.stat_result, header) -> int:
+        '''Write a new cache file, reusing the digests of the old one if the
+        wordlist has only been appended to since.
+
+        Args:
+            source_stat (os.stat_result): The wordlist's current status.
+            header (Optional[tuple]): The fields of the old cache file's header.
+
+        Returns:
+            int: The number of passwords hashed.
+        '''
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_name(f'{self.cache_file.name}.{os.getpid()}.tmp')
+
+        with self.wordlist.open('rb') as source:
+            count = covered = 0
+            fp = None
+
+            if header is not None:
+                old_count, old_covered, _, _, old_fingerprint = header
+
+                if source_stat.st_size >= old_covered:
+                    fp = fingerprint(source, old_covered)
+
+                    if fp.digest() == old_fingerprint:
+                        count, covered = old_count, old_covered
+
+            if not count:
+                fp = hashlib.blake2b(digest_size=32)
+
+            if count:
+                shutil.copyfile(self.cache_file, tmp_file)
+            else:
+                tmp_file.write_bytes(HEADER.pack(MAGIC, 0, 0, 0, 0, bytes(32)))
+
+            with tmp_file.open('r+b') as cache:
+                cache.seek(HEADER.size + DIGEST_SIZE * count)
+                source.seek(covered)
+                hashed = 0
+
+                while True:
+                    lines = source.readlines(CHUNK_BYTES)
+
+                    # Only complete lines are cached, since a final line
+                    # without a newline may yet be appended to.
+                    if lines and not lines[-1].endswith(b'\n'):
+                        lines.pop()
+
+                    if not lines:
+                        break
+
+                    cache.write(b''.join(password_digest(line) for line in lines))
+                    fp.update(b''.join(lines))
+                    hashed += len(lines)
+                    covered += sum(len(line) for line in lines)
+
+                count += hashed
+                cache.seek(0)
+                cache.write(HEADER.pack(MAGIC, count, covered, source_stat.st_size,
+                                        source_stat.st_mtime_ns, fp.digest()))
+
+        os.replace(tmp_file, self.cache_file)
+
+        return hashed
+
+    def chunks(self):
+        '''Read the wordlist a chunk at a time with the digests of its
+        passwords, taken from the cache where possible.  Call update() first.
+
+        Yields:
+            Tuple[List[str], List[str]]: The passwords of each chunk, in
+                order, and their SHA-1 hex digests.
+        '''
+        index = 0
+
+        with self.wordlist.open('rb') as source:
+            while True:
+                lines = source.readlines(CHUNK_BYTES)
+
+                if not lines:
+                    return
+
+                passwords = [line.decode('utf-8').strip() for line in lines]
+                cached = max(0, min(len(lines), self.count - index))
+                start = HEADER.size + DIGEST_SIZE * index
+                digests = self.mm[start:start + DIGEST_SIZE * cached]
+                password_hashes = [digests[i:i + DIGEST_SIZE].hex()
+                                   for i in range(0, len(digests), DIGEST_SIZE)]
+                password_hashes += [hashlib.sha1(password.encode()).hexdigest()
+                                    for password in passwords[cached:]]
+                index += len(lines)
+
+                yield passwords, password_hashes
+
+    def pairs(self):
+        '''Read the wordlist one password at a time, as chunks() does.
+
+        Yields:
+            Tuple[str, str]: Each password and its SHA-1 hex digest.
+        '''
+        for passwords, password_hashes in self.chunks():
+            yield from zip(passwords, password_hashes)
+
+    def close(self) -> None:
+        '''Unmap the cache file.'''
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+'''
+COMP3331/9331 Computer Networks and Applications
+Programming Tutorial
+
+Incremental HTTP/1.1 request parsing, shared by the web servers.
+
+Feed a connection's RequestParser whatever recv() returns, and it returns
+every request completed so far, in order, keeping a partial request buffered
+until the rest of it arrives.  So a request's headers may span any number of
+reads, and any number of pipelined requests may arrive in one read.  Request
+bodies announced with Content-Length are read past and discarded, so that
+the request after one is found.
+
+The parser enforces the connection's limits as well:
+
+- A request line and headers longer than MAX_HEADER_BYTES in total are
+  rejected with 431 Request Header Fields Too Large (414 URI Too Long if the
+  request line alone is), and bodies longer than MAX_BODY_BYTES with 413
+  Content Too Large.  Malformed requests are rejected with 400 Bad Request,
+  chunked request bodies with 501 Not Implemented, and versions other than
+  HTTP/1.x with 505 HTTP Version Not Supported.
+- Once max_requests requests have been parsed, the last of them is marked
+  not to be kept alive.
+
+Either way, the request that ends the connection is the last one returned,
+and any input after it is ignored, so the server only has to answer each
+request and close the connection after one with keep_alive False.
+'''
+
+import re
+from urllib.parse import unquote
+
+MAX_HEADER_BYTES = 8192 # Longest request line and headers accepted.
+MAX_HEADERS = 100 # Most header fields accepted in one request.
+MAX_BODY_BYTES = 1 << 20 # Longest request body accepted (and discarded).
+
+HEADER_END = re.compile(rb'\r?\n\r?\n')
+REQUEST_LINE = re.compile(r'([!#$%&\'*+.^_`|~0-9A-Za-z-]+) +(\S+) +HTTP/(\d)\.(\d)')
+
+class HTTPRequest:
+    '''A parsed HTTP request, or the error that a request is to be rejected with.'''
+
+    def __init__(self, method: str = None, target: str = None, version: str = 'HTTP/1.1',
+                 headers: dict = None, error: str = None):
+        '''Initialise the request.
+
+        Args:
+            method (str): The method, such as 'GET'.
+            target (str): The request target, such as '/index.html?x=1'.
+            version (str): The HTTP version, such as 'HTTP/1.1'.
+            headers (Dict[str, str]): The header fields, with lowercase names.
+              Repeated fields are joined with commas.
+            error (str): For a request to be rejected, the status code and
+              reason phrase to reject it with, such as '400 Bad Request'.
+        '''
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers or {}
+        self.error = error
+        self.number = 0 # Position of the request on its connection, from 1.
+        self.remaining = None # Requests still allowed on the connection after this one.
+        self.is_last = error is not None
+
+    @property
+    def path(self) -> str:
+        '''The path of the file requested, without its leading slash, query
+        or percent-encoding.'''
+        path = self.target.split('?', 1)[0].split('#', 1)[0]
+        return unquote(path[1:] if path.startswith('/') else path)
+
+    @property
+    def keep_alive(self) -> bool:
+        '''Whether the connection is to be kept open after this request.'''
+        if self.is_last:
+            return False
+
+        tokens = {token.strip().lower() for token in self.headers.get('connection', '').split(',')}
+
+        if self.version == 'HTTP/1.0':
+            return 'keep-alive' in tokens
+
+        return 'close' not in tokens
+
+class RequestParser:
+    '''
+    Incrementally parses the requests on one connection.  Feed it whatever
+    recv() returns, and it returns every request completed so far, keeping any
+    partial request buffered until the rest of it arrives.
+    '''
+
+    def __init__(self, max_requests: int = None):
+        '''Initialise an empty parser.
+
+        Args:
+            max_requests (int): The most requests to accept on the
+              connection, or None for no limit.
+        '''
+        self.max_requests = max_requests
+        self.buffer = bytearray()
+        self.scanned = 0 # How far the buffer has been searched for the end of the headers.
+        self.body_left = 0 # Bytes of a request body still to be discarded.
+        self.count = 0 # Requests parsed so far.
+        self.done = False # Whether the connection's last request has been parsed.
+
+    def feed(self, data: bytes) -> list:
+        '''Add received bytes to the buffer and parse any complete requests.
+
+        Args:
+            data (bytes): The bytes received from the client.
+
+        Returns:
+            List[HTTPRequest]: The requests completed by this data, in order.
+        '''
+        if self.done:
+            return []
+
+        self.buffer += data
+        requests = []
+
+        while not self.done:
+            if self.body_left:
+                skipped = min(self.body_left, len(self.buffer))
+                del self.buffer[:skipped]
+                self.body_left -= skipped
+
+                if self.body_left:
+                    break
+
+            # Blank lines before a request line are allowed, and ignored.
+            blank = len(self.buffer) - len(self.buffer.lstrip(b'\r\n'))
+
+            if blank:
+                del self.buffer[:blank]
+                self.scanned = 0
+
+            match = HEADER_END.search(self.buffer, max(0, self.scanned - 3))
+
+            if match is None:
+                self.scanned = len(self.buffer)
+
+                if len(self.buffer) > MAX_HEADER_BYTES:
+                    # Don't let a client fill our memory with headers that
+                    # never end.
+                    line_end = self.buffer.find(b'\n')
+                    too_long = ('414 URI Too Long' if line_end < 0 or line_end > MAX_HEADER_BYTES
+                                else '431 Request Header Fields Too Large')
+                    requests.append(self.add(HTTPRequest(error=too_long)))
+
+                break
+
+            head = bytes(self.buffer[:match.start()])
+            del self.buffer[:match.end()]
+            self.scanned = 0
+
+            if len(head) > MAX_HEADER_BYTES:
+                requests.append(self.add(HTTPRequest(error='431 Request Header Fields Too Large')))
+            else:
+                requests.append(self.add(self.parse_head(head)))
+
+        return requests
+
+    def parse_head(self, head: bytes) -> HTTPRequest:
+        '''Parse the request line and headers of a request, noting the length
+        of any body that follows.
+
+        Args:
+            head (bytes): The request line and headers, without the blank line
+              that ends them.
+
+        Returns:
+            HTTPRequest: The request, or the error to reject it with.
+        '''
+        # Latin-1 decodes any bytes, so odd bytes in a header can't fail the
+        # request, and str.splitlines() would split on some of them too.
+        lines = [line.removesuffix('\r') for line in head.decode('iso-8859-1').split('\n')]
+
+        match = REQUEST_LINE.fullmatch(lines[0])
+
+        if match is None:
+            return HTTPRequest(error='400 Bad Request')
+
+        method, target, major, minor = match.groups()
+
+        if major != '1':
+            return HTTPRequest(error='505 HTTP Version Not Supported')
+
+        if len(lines) - 1 > MAX_HEADERS:
+            return HTTPRequest(error='431 Request Header Fields Too Large')
+
+        headers = {}
+
+        for line in lines[1:]:
+            name, colon, value = line.partition(':')
+            name = name.lower()
+
+            if not colon or not name or name != name.strip() or line[0] in ' \t':
+                # Obsolete line folding, and whitespace before the colon, are
+                # both rejected, as RFC 9112 requires.
+                return HTTPRequest(error='400 Bad Request')
+
+            value = value.strip(' \t')
+            headers[name] = f'{headers[name]}, {value}' if name in headers else value
+
+        if 'transfer-encoding' in headers:
+            return HTTPRequest(error='501 Not Implemented')
+
+        length = headers.get('content-length', '0')
+
+        # Only ASCII digits: isdigit() also passes the likes of '²', which
+        # int() then rejects.
+        if not re.fullmatch(r'[0-9]+', length):
+            return HTTPRequest(error='400 Bad Request')
+
+        if int(length) > MAX_BODY_BYTES:
+            return HTTPRequest(error='413 Content Too Large')
+
+        self.body_left = int(length)
+
+        return HTTPRequest(method, target, f'HTTP/1.{minor}', headers)
+
+    def add(self, request: HTTPRequest) -> HTTPRequest:
+        '''Number a parsed request, and mark it as the last if it ends the
+        connection.'''
+        self.count += 1
+        request.number = self.count
+
+        if self.max_requests is not None:
+            request.remaining = max(0, self.max_requests - self.count)
+
+            if request.remaining == 0:
+                request.is_last = True
+
+        if request.is_last or not request.keep_alive:
+            request.is_last = True
+            self.done = True
+            self.buffer.clear()
+
+        return request
@@ -0,0 +1,283 @@
+'''
+COMP3331/9331 Computer Networks and Applications
+Programming Tutorial
+
+Thread-safe counters and fixed-memory latency histograms, and two ways of
+watching them while a server runs: a local admin port that answers every
+connection with the current figures, and a periodic dump to a stream.
+
+A Metrics object keeps all of its values in one flat array of 64-bit integers,
+which may be shared memory.  Each process only ever updates its own Metrics,
+so a supervisor can read those of its worker processes without any locking and
+combine them.
+'''
+
+from array import array
+import math
+import multiprocessing
+import socket
+import sys
+import threading
+import time
+
+class LatencyHistogram:
+    '''
+    A histogram of durations with log-scale buckets, from MIN_SECONDS up to
+    MIN_SECONDS * 2 ** DOUBLINGS, with SUB_BUCKETS buckets per doubling.
+    Memory is fixed however many values are recorded, and percentiles are
+    accurate to within half a bucket, about 2%.
+    '''
+    MIN_SECONDS = 1e-6
+    SUB_BUCKETS = 16
+    DOUBLINGS = 28 # Up to about 268 seconds.
+    NUM_BUCKETS = SUB_BUCKETS * DOUBLINGS + 2 # Plus underflow and overflow.
+    FIELDS = 4 # count, sum, min and max, in nanoseconds.
+    SIZE = FIELDS + NUM_BUCKETS
+
+    def __init__(self, values=None, offset: int = 0):
+        '''Initialise an empty histogram.
+
+        Args:
+            values (MutableSequence[int]): Storage for the histogram, of at
+              least offset + SIZE integers (default: a new array).
+            offset (int): Where the histogram starts in values.
+        '''
+        self.values = values if values is not None else array('q', bytes(8 * self.SIZE))
+        self.offset = offset
+        self.reset()
+
+    def reset(self) -> None:
+        '''Forget every recorded value.'''
+        for i in range(self.SIZE):
+            self.values[self.offset + i] = 0
+
+        self.values[self.offset + 2] = -1 # No minimum yet.
+
+    @classmethod
+    def bucket(cls, seconds: float) -> int:
+        '''Return the index of the bucket a duration falls in.'''
+        if seconds < cls.MIN_SECONDS:
+            return 0
+
+        return min(cls.NUM_BUCKETS - 1,
+                   int(math.log2(seconds / cls.MIN_SECONDS) * cls.SUB_BUCKETS) + 1)
+
+    @classmethod
+    def bucket_value(cls, index: int) -> float:
+        '''Return the duration in the middle of a bucket.'''
+        if index == 0:
+            return cls.MIN_SECONDS / 2
+
+        return cls.MIN_SECONDS * 2 ** ((index - 0.5) / cls.SUB_BUCKETS)
+
+    def record(self, seconds: float) -> None:
+        '''Record a duration.  Not thread-safe; see Metrics.observe_latency().'''
+        values, offset = self.values, self.offset
+        nanoseconds = max(0, int(seconds * 1e9))
+        values[offset] += 1
+        values[offset + 1] += nanoseconds
+
+        if values[offset + 2] < 0 or nanoseconds < values[offset + 2]:
+            values[offset + 2] = nanoseconds
+
+        if nanoseconds > values[offset + 3]:
+            values[offset + 3] = nanoseconds
+
+        values[offset + self.FIELDS + self.bucket(seconds)] += 1
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        '''Add every value recorded by another histogram to this one.'''
+        values, offset = self.values, self.offset
+        values[offset] += other.count
+        values[offset + 1] += other.values[other.offset + 1]
+
+        if other.count:
+            if values[offset + 2] < 0 or other.min_nanoseconds < values[offset + 2]:
+                values[offset + 2] = other.min_nanoseconds
+
+            values[offset + 3] = max(values[offset + 3], other.values[other.offset + 3])
+
+        for i in range(self.FIELDS, self.SIZE):
+            values[offset + i] += other.values[other.offset + i]
+
+    @property
+    def count(self) -> int:
+        '''The number of values recorded.'''
+        return self.values[self.offset]
+
+    @property
+    def min_nanoseconds(self) -> int:
+        return self.values[self.offset + 2]
+
+    @property
+    def mean(self) -> float:
+        '''The mean of the values recorded, in seconds.'''
+        return self.values[self.offset + 1] / self.count / 1e9 if self.count else 0.0
+
+    @property
+    def min(self) -> float:
+        '''The smallest value recorded, in seconds.'''
+        return self.min_nanoseconds / 1e9 if self.count else 0.0
+
+    @property
+    def max(self) -> float:
+        '''The largest value recorded, in seconds.'''
+        return self.values[self.offset + 3] / 1e9
+
+    def percentile(self, pct: float) -> float:
+        '''Return an estimate of a percentile of the values recorded.
+
+        Args:
+            pct (float): The percentile, from 0 to 100.
+
+        Returns:
+            float: The estimated value in seconds, or 0 if nothing is recorded.
+        '''
+        count = self.count
+
+        if not count:
+            return 0.0
+
+        rank = max(1, math.ceil(pct / 100 * count))
+        seen = 0
+        start = self.offset + self.FIELDS
+
+        for index in range(self.NUM_BUCKETS):
+            seen += self.values[start + index]
+
+            if seen >= rank:
+                return min(self.max, max(self.min, self.bucket_value(index)))
+
+        return self.max
+
+class Metrics:
+    '''Thread-safe counters and a request latency histogram.'''
+    COUNTERS = ('connections accepted', 'connections active', 'requests', 'authorised',
+                'not authorised', 'bad request', 'rate limited', 'bytes in', 'bytes out')
+    SIZE = len(COUNTERS) + LatencyHistogram.SIZE
+
+    def __init__(self, values=None):
+        '''Initialise the metrics, all zero.
+
+        Args:
+            values (MutableSequence[int]): Storage of SIZE integers (default: a
+              new array).
+        '''
+        self.values = values if values is not None else array('q', bytes(8 * self.SIZE))
+        self.latency = LatencyHistogram(self.values, len(self.COUNTERS))
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> 'Metrics':
+        '''Create metrics in shared memory, for a process that will be forked,
+        so that the parent process can read them.'''
+        return cls(multiprocessing.RawArray('q', cls.SIZE))
+
+    @classmethod
+    def combine(cls, metrics: list) -> 'Metrics':
+        '''Add up the metrics of several processes.
+
+        Args:
+            metrics (List[Metrics]): The metrics to combine.
+
+        Returns:
+            Metrics: New metrics holding the totals.
+        '''
+        total = cls()
+
+        for m in metrics:
+            for i in range(len(cls.COUNTERS)):
+                total.values[i] += m.values[i]
+
+            total.latency.merge(m.latency)
+
+        return total
+
+    def add(self, counter: str, amount: int = 1) -> None:
+        '''Add to one of the counters.
+
+        Args:
+            counter (str): The name of the counter, from COUNTERS.
+            amount (int): The amount to add, which may be negative.
+        '''
+        index = self.COUNTERS.index(counter)
+
+        with self.lock:
+            self.values[index] += amount
+
+    def get(self, counter: str) -> int:
+        '''Return the value of one of the counters.'''
+        return self.values[self.COUNTERS.index(counter)]
+
+    def observe_latency(self, seconds: float) -> None:
+        '''Record the time taken to answer a request.'''
+        with self.lock:
+            self.latency.record(seconds)
+
+    def format(self) -> str:
+        '''Return the metrics as "name: value" lines, with latencies in ms.'''
+        lines = [f'{name}: {self.values[i]}' for i, name in enumerate(self.COUNTERS)]
+        latency = self.latency
+        lines.append(f'latency ms: count {latency.count} mean {latency.mean * 1000:.3f} '
+                     f'p50 {latency.percentile(50) * 1000:.3f} '
+                     f'p90 {latency.percentile(90) * 1000:.3f} '
+                     f'p99 {latency.percentile(99) * 1000:.3f} '
+                     f'max {latency.max * 1000:.3f}')
+        return '\n'.join(lines) + '\n'
+
+def start_stats_server(port: int, report) -> threading.Thread:
+    '''Serve the current metrics on a local TCP port.  Every connection is
+    sent the output of report().format() and then closed, so the metrics can
+    be read with e.g. `nc localhost <port>`.
+
+    Args:
+        port (int): The TCP port to listen on, on localhost only.
+        report (Callable[[], Metrics]): Returns the metrics to serve.
+
+    Returns:
+        threading.Thread: The daemon thread serving the metrics.
+    '''
+    admin_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    admin_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    admin_socket.bind(('localhost', port))
+    admin_socket.listen()
+
+    def serve():
+        with admin_socket:
+            while True:
+                connection_socket, _ = admin_socket.accept()
+
+                with connection_socket:
+                    try:
+                        connection_socket.sendall(report().format().encode())
+                    except OSError:
+                        pass
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+
+    return thread
+
+def start_stats_dump(interval: float, report, stream=None) -> threading.Thread:
+    '''Write the current metrics to a stream periodically.
+
+    Args:
+        interval (float): Seconds between dumps.
+        report (Callable[[], Metrics]): Returns the metrics to write.
+        stream (TextIO): Where to write them (default: sys.stderr).
+
+    Returns:
+        threading.Thread: The daemon thread writing the metrics.
+    '''
+    def dump():
+        while True:
+            time.sleep(interval)
+            output = stream or sys.stderr
+            output.write(f'--- stats {time.strftime("%Y-%m-%d %H:%M:%S")} ---\n'
+                         + report().format())
+            output.flush()
+
+    thread = threading.Thread(target=dump, daemon=True)
+    thread.start()
+
+    return thread
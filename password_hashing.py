@@ -0,0 +1,224 @@
+#! /usr/bin/env python3
+
+'''
+COMP3331/9331 Computer Networks and Applications
+Programming Tutorial
+
+Usage:      python3 password_hashing.py [--scheme {pbkdf2_sha256,scrypt}]
+                                        <accounts_file> <output_file>
+Example:    python3 password_hashing.py accounts.tsv accounts-salted.tsv
+
+Salted, deliberately slow password hashes for the accounts file, and a bounded
+pool for checking them off the server's connection handling path.
+
+Clients send the SHA-1 hex digest of the password, and that digest is what is
+stored in a plain accounts file.  Instead, an account's stored value may be a
+salted, slow hash of that digest, in one of these formats:
+
+    pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>
+    scrypt$<n>$<r>$<p>$<salt hex>$<hash hex>
+
+Any other stored value is treated as a plain digest.  Every comparison is made
+in constant time.  A server whose accounts have slow hashes checks the
+passwords of unknown usernames against a dummy_hash() with the same scheme
+and cost as theirs, so that they take as long to reject as those of real
+accounts, and don't reveal which usernames exist.
+
+Running this module rewrites the plain digests in an accounts file as slow
+hashes, leaving any existing slow hashes as they are.
+
+hashlib releases the GIL while it derives a key, so a pool of threads is
+enough to check several slow hashes in parallel.
+'''
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import hmac
+import os
+import threading
+
+PBKDF2_ITERATIONS = 100000
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+SCHEMES = ('pbkdf2_sha256', 'scrypt')
+
+def main():
+    '''Rewrite the plain digests in an accounts file as slow hashes.'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('accounts_file', help='tab separated file containing account information')
+    parser.add_argument('output_file', help='accounts file to write')
+    parser.add_argument('--scheme', choices=SCHEMES, default='pbkdf2_sha256',
+                        help='hash scheme to use (default: pbkdf2_sha256)')
+    args = parser.parse_args()
+
+    with open(args.accounts_file, encoding='utf-8') as accounts, \
+            open(args.output_file, 'w', encoding='utf-8') as output:
+        for line in accounts:
+            split_line = line.split()
+
+            if len(split_line) != 2:
+                continue
+
+            username, stored_hash = split_line
+
+            if not is_slow_hash(stored_hash):
+                stored_hash = hash_password(stored_hash, args.scheme)
+
+            output.write(f'{username}\t{stored_hash}\n')
+
+def hash_password(password_hash: str, scheme: str = 'pbkdf2_sha256') -> str:
+    '''Hash a password digest, as sent by the client, with a new random salt.
+
+    Args:
+        password_hash (str): The SHA-1 hex digest of the password.
+        scheme (str): One of SCHEMES.
+
+    Returns:
+        str: The value to store in the accounts file.
+    '''
+    salt = os.urandom(SALT_BYTES)
+
+    if scheme == 'pbkdf2_sha256':
+        derived = pbkdf2(password_hash, salt, PBKDF2_ITERATIONS)
+        return f'pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${derived.hex()}'
+
+    if scheme == 'scrypt':
+        derived = scrypt(password_hash, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${derived.hex()}'
+
+    raise ValueError(f'Unknown hash scheme: {scheme}')
+
+def pbkdf2(password_hash: str, salt: bytes, iterations: int) -> bytes:
+    '''Derive a PBKDF2-HMAC-SHA256 key from a password digest.'''
+    return hashlib.pbkdf2_hmac('sha256', password_hash.encode(), salt, iterations)
+
+def scrypt(password_hash: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    '''Derive an scrypt key from a password digest.'''
+    return hashlib.scrypt(password_hash.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * r * (n + p + 2) + 1024 * 1024)
+
+def is_slow_hash(stored_hash: str) -> bool:
+    '''Whether a stored value is a slow hash, rather than a plain digest.'''
+    return stored_hash.split('$', 1)[0] in SCHEMES
+
+def dummy_hash(stored_hash: str) -> str:
+    '''Make a slow hash with the same scheme and cost as a stored one, but
+    with a random salt and hash, to check the passwords of unknown usernames
+    against.  Checking a password against it takes as long as against the
+    stored hash, and never matches.
+
+    Args:
+        stored_hash (str): A slow hash stored for an account.
+
+    Returns:
+        str: The dummy hash, or the stored value itself if it is malformed,
+            since that is as quick to reject either way.
+    '''
+    fields = stored_hash.split('$')
+
+    if (fields[0], len(fields)) not in (('pbkdf2_sha256', 4), ('scrypt', 6)):
+        return stored_hash
+
+    fields[-2] = os.urandom(len(fields[-2]) // 2).hex()
+    fields[-1] = os.urandom(len(fields[-1]) // 2).hex()
+
+    return '$'.join(fields)
+
+def verify(stored_hash: str, password_hash: str) -> bool:
+    '''Check a password digest sent by a client against an account's stored
+    value, in constant time.
+
+    Args:
+        stored_hash (str): The value stored for the account.
+        password_hash (str): The SHA-1 hex digest sent by the client.
+
+    Returns:
+        bool: True if the password digest matches.  A malformed stored value
+            never matches.
+    '''
+    fields = stored_hash.split('$')
+
+    try:
+        if fields[0] == 'pbkdf2_sha256' and len(fields) == 4:
+            derived = pbkdf2(password_hash, bytes.fromhex(fields[2]), int(fields[1]))
+            return hmac.compare_digest(derived, bytes.fromhex(fields[3]))
+
+        if fields[0] == 'scrypt' and len(fields) == 6:
+            derived = scrypt(password_hash, bytes.fromhex(fields[4]), int(fields[1]),
+                             int(fields[2]), int(fields[3]))
+            return hmac.compare_digest(derived, bytes.fromhex(fields[5]))
+    except ValueError:
+        return False
+
+    if fields[0] in SCHEMES:
+        return False
+
+    return hmac.compare_digest(stored_hash.encode(), password_hash.encode())
+
+class VerifierPool:
+    '''
+    A pool of threads for slow password checks, which accepts only a bounded
+    number of password hashes at once, so a flood of requests can't queue up
+    unbounded work.  Each job is charged for the hashes it checks, so a batch
+    request takes as much room as the same checks sent one at a time.
+    '''
+
+    def __init__(self, num_threads: int, max_pending: int):
+        '''Start the pool.
+
+        Args:
+            num_threads (int): The number of threads checking passwords.
+            max_pending (int): The most password hashes being checked or
+              queued at once.
+        '''
+        self.executor = ThreadPoolExecutor(num_threads, thread_name_prefix='verifier')
+        self.max_pending = max_pending
+        self.pending = 0
+        self.room = threading.Condition()
+
+    def submit(self, fn, *args, cost: int = 1, block: bool = True):
+        '''Queue a job, waiting for room in the pool if it is full.
+
+        Args:
+            fn (Callable): The job to run.
+            *args: The arguments to pass to the job.
+            cost (int): The number of password hashes the job checks.  A job
+              costing more than the whole pool waits for the pool to be
+              empty, and then fills it.
+            block (bool): Whether to wait for room if the pool is full.
+
+        Returns:
+            Optional[concurrent.futures.Future]: The future of the job, or None
+                if the pool is full and block is False.
+        '''
+        cost = max(1, min(cost, self.max_pending))
+
+        with self.room:
+            while self.pending + cost > self.max_pending:
+                if not block:
+                    return None
+
+                self.room.wait()
+
+            self.pending += cost
+
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self.release(cost))
+
+        return future
+
+    def release(self, cost: int) -> None:
+        '''Give back the room taken by a finished job.'''
+        with self.room:
+            self.pending -= cost
+            self.room.notify_all()
+
+    def shutdown(self) -> None:
+        '''Stop the pool, abandoning any queued jobs.'''
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+if __name__ == '__main__':
+    main()
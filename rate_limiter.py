@@ -0,0 +1,125 @@
+'''
+COMP3331/9331 Computer Networks and Applications
+Programming Tutorial
+
+A token bucket rate limiter keyed by client, used by the authentication server
+to throttle password guessing per source IP address.
+
+Each client has a bucket holding up to `burst` tokens, refilled at `rate`
+tokens per second, and every password checked costs one token.  A client that
+stays within its rate never waits, and a client that has been quiet can burst
+up to `burst` requests without delay.
+
+Buckets only need to be remembered while they are not full, since a full
+bucket is the same as a client we have never seen.  Buckets are kept in least
+recently used order, and full buckets at the old end are evicted as the limiter
+is used, so memory is proportional to the number of recently active clients.
+The total number of buckets is also capped, in which case the least recently
+used clients are forgotten even if their buckets are not yet full.
+'''
+
+from collections import OrderedDict
+import threading
+import time
+
+class TokenBucketLimiter:
+    '''A thread-safe, per-client token bucket rate limiter.'''
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 100000, clock=time.monotonic):
+        '''Initialise the limiter.
+
+        Args:
+            rate (float): Tokens added to each bucket per second.
+            burst (float): The capacity of each bucket.
+            max_clients (int): The most buckets to remember at once.
+            clock (Callable[[], float]): Returns the current time in seconds.
+        '''
+        if rate <= 0 or burst < 1:
+            raise ValueError('rate must be positive and burst at least 1')
+
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.clock = clock
+        self.buckets = OrderedDict() # key -> [tokens, time of last update]
+        self.lock = threading.Lock()
+
+    def reserve(self, key, cost: float = 1) -> float:
+        '''Take tokens from a client's bucket, going into debt if it has too
+        few, and return when the request may go ahead.
+
+        Requests reserved back to back are given increasing times, so a client
+        that sends faster than its rate has its requests spaced out in order.
+
+        Args:
+            key (Hashable): Identifies the client, e.g. its IP address.
+            cost (float): The number of tokens the request costs.
+
+        Returns:
+            float: The clock time at which the request may be processed, which
+                is the current time if the client is within its limit.
+        '''
+        with self.lock:
+            now = self.clock()
+            tokens = self.take(key, cost, now)
+
+            return now if tokens >= 0 else now - tokens / self.rate
+
+    def try_acquire(self, key, cost: float = 1) -> bool:
+        '''Take tokens from a client's bucket only if it has enough.
+
+        Args:
+            key (Hashable): Identifies the client, e.g. its IP address.
+            cost (float): The number of tokens the request costs.
+
+        Returns:
+            bool: True if the request is within the limit, False if it should
+                be rejected.  A request costing more than the burst size could
+                never fit in the bucket, so it is let through when the bucket
+                is full instead, and leaves the bucket in debt for the rest of
+                its cost.
+        '''
+        with self.lock:
+            now = self.clock()
+
+            if self.tokens(key, now) < min(cost, self.burst):
+                return False
+
+            self.take(key, cost, now)
+
+            return True
+
+    def tokens(self, key, now: float) -> float:
+        '''Return the tokens currently in a client's bucket.  Call with the lock held.'''
+        bucket = self.buckets.get(key)
+
+        if bucket is None:
+            return self.burst
+
+        return min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+
+    def take(self, key, cost: float, now: float) -> float:
+        '''Remove tokens from a client's bucket and return how many are left,
+        which may be negative.  Call with the lock held.'''
+        tokens = self.tokens(key, now) - cost
+        self.buckets[key] = [tokens, now]
+        self.buckets.move_to_end(key)
+        self.evict(now)
+
+        return tokens
+
+    def evict(self, now: float) -> None:
+        '''Forget least recently used buckets that have refilled, and any
+        beyond the size cap.  Call with the lock held.'''
+        while self.buckets:
+            key, (tokens, updated) = next(iter(self.buckets.items()))
+
+            if len(self.buckets) <= self.max_clients \
+                    and tokens + (now - updated) * self.rate < self.burst:
+                break
+
+            del self.buckets[key]
+
+    def __len__(self) -> int:
+        '''The number of clients currently remembered.'''
+        return len(self.buckets)
@@ -4,8 +4,15 @@
 COMP3331/9331 Computer Networks and Applications
 Programming Tutorial
 
-Usage:      python3 server.py <server_port> <accounts_file>
+Usage:      python3 server.py [--mode {threaded,event}] [--workers N] [--rate R] [--burst B]
+                              [--over-limit {defer,reject}] [--accounts-index]
+                              [--verify-threads N] [--verify-queue N]
+                              [--log-level LEVEL] [--log-sample RATE] [--log-buffer N]
+                              [--stats-port PORT] [--stats-interval SECONDS]
+                              <server_port> <accounts_file>
 Example:    python3 server.py 54321 accounts.tsv
+            python3 server.py --mode event 54321 accounts.tsv
+            python3 server.py --mode event --workers 4 54321 accounts.tsv
 
 The server is expected to be running on the same machine as the client, and the
 server should be started before the client is run.
@@ -16,50 +23,213 @@ robustness and efficiency of the server, and to add additional features.  This
 solution is designed to be simple and easy to understand, and to demonstrate the
 basic concepts of a server that handles multiple clients concurrently.
 
+Requests are framed by newlines, so clients may pipeline any number of
+requests, or send many password hashes at once in a batch request.  See
+auth_protocol.py for the message formats.
+
+The server can run in one of two modes:
+
+- threaded (default): one thread per client connection, as described above.
+- event: a single thread multiplexes every connection with a selector, only
+  touching a socket when the OS reports it as readable or writable.  Idle
+  clients cost a file descriptor and a few hundred bytes rather than a thread.
+
+Each client IP address may check --rate passwords per second, with bursts of
+up to --burst, enforced by a token bucket (see rate_limiter.py).  Requests over
+the limit are either deferred until the client is back within it, or answered
+immediately with "rate limited".  Deferring never blocks other clients.  With
+--workers, each worker enforces the limit separately.
+
+With --accounts-index, the accounts are served from a memory-mapped index of
+the accounts file rather than a dict (see accounts_index.py).  This starts
+almost instantly however large the accounts file is, and the accounts are
+reloaded without a restart whenever the file changes.  With --workers, the
+supervisor rebuilds the index and the workers map each new one once it's built.
+
+An account's stored password hash may also be a salted, deliberately slow
+PBKDF2 or scrypt hash (see password_hashing.py).  These are checked on a
+bounded pool of threads, so a slow check never holds up other clients.  When
+the pool is full, the event loop stops reading from a client until there is
+room, and a client thread waits for room.  --verify-queue bounds the password
+hashes in the pool, so a batch request takes as much room as its hashes would
+one at a time.  While any account has a slow hash, the passwords of unknown
+usernames are checked against a dummy slow hash, so that the time taken to
+answer doesn't reveal which usernames exist.
+
+Requests are logged as "<host>:<port>: recv: <username> <hash>" and
+"<host>:<port>: send: <response>" lines by a background writer (see
+async_log.py), so logging never blocks a client.  --log-level and --log-sample
+cut down the log under heavy load, and if the log falls behind by more than
+--log-buffer records, records are dropped and counted.
+
+Either mode only ever uses one core.  With --workers N, a supervisor process
+loads the accounts and forks N workers, each running the chosen mode on its own
+socket bound to the same port with SO_REUSEPORT.  The kernel balances new
+connections across the workers.
+
+The server counts connections, requests and their outcomes, and bytes in and
+out, and keeps a histogram of the time from receiving each request to building
+its response (see metrics.py).  --stats-port serves the current figures to
+anything connecting to that port on localhost, e.g. `nc localhost 9000`, and
+--stats-interval writes them to stderr every so many seconds.  With --workers,
+each worker keeps its own figures in shared memory and the supervisor reports
+their totals.
+
 Standard libraries included below that you may find helpful to complete the task:
 [socket]: https://docs.python.org/3/library/socket.html
 [threading]: https://docs.python.org/3/library/threading.html
+[selectors]: https://docs.python.org/3/library/selectors.html
+[multiprocessing]: https://docs.python.org/3/library/multiprocessing.html
 [time]: https://docs.python.org/3/library/time.html
 '''
 
 import argparse
+from collections import deque
+from concurrent.futures import Future
+import heapq
+import multiprocessing
+import os
 from pathlib import Path
+import select
+import selectors
+import signal
 import socket
 import sys
 import threading
 import time
 
+from accounts_index import AccountsStore
+from async_log import LEVELS, AsyncLogger
+from auth_protocol import (AUTHORISED, BAD_REQUEST, NOT_AUTHORISED, RATE_LIMITED, AuthRequest,
+                           RequestParser, encode_batch_response, encode_response)
+from metrics import Metrics, start_stats_dump, start_stats_server
+from password_hashing import VerifierPool, dummy_hash, is_slow_hash, verify
+from rate_limiter import TokenBucketLimiter
+
 def main():
     '''The main function that initialises the server and starts it running.'''
     parser = argparse.ArgumentParser()
     parser.add_argument('server_port', type=int, help='TCP port of the server')
     parser.add_argument('accounts_file', help='tab separated file containing account information')
+    parser.add_argument('--mode', choices=('threaded', 'event'), default='threaded',
+                        help='thread per client, or a single-threaded event loop (default: threaded)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes sharing the port (default: 1)')
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='password checks per second allowed for each client IP (default: 10)')
+    parser.add_argument('--burst', type=float, default=10.0,
+                        help='password checks a client IP may make at once (default: 10)')
+    parser.add_argument('--over-limit', choices=('defer', 'reject'), default='defer',
+                        help='delay or reject requests over the rate limit (default: defer)')
+    parser.add_argument('--accounts-index', action='store_true',
+                        help='serve accounts from a memory-mapped index, reloaded on change')
+    parser.add_argument('--verify-threads', type=int, default=os.cpu_count() or 1,
+                        help='threads checking slow password hashes (default: one per core)')
+    parser.add_argument('--verify-queue', type=int, default=64,
+                        help='most slow password hashes being checked or queued at once (default: 64)')
+    parser.add_argument('--log-level', choices=tuple(LEVELS), default='info',
+                        help='least severe request log records to write (default: info)')
+    parser.add_argument('--log-sample', type=float, default=1.0,
+                        help='fraction of requests to log at info level (default: 1)')
+    parser.add_argument('--log-buffer', type=int, default=65536,
+                        help='log records to buffer before dropping them (default: 65536)')
+    parser.add_argument('--stats-port', type=int,
+                        help='local TCP port serving the current metrics (default: none)')
+    parser.add_argument('--stats-interval', type=float,
+                        help='seconds between writing the metrics to stderr (default: never)')
     args = parser.parse_args()
 
-    server = Server(args.server_port, args.accounts_file)
-    server.run()
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    if args.rate <= 0 or args.burst < 1:
+        parser.error('--rate must be positive and --burst at least 1')
+
+    if args.verify_threads < 1 or args.verify_queue < 1:
+        parser.error('--verify-threads and --verify-queue must be at least 1')
+
+    if not 0 <= args.log_sample <= 1 or args.log_buffer < 1:
+        parser.error('--log-sample must be between 0 and 1, and --log-buffer at least 1')
+
+    if args.stats_interval is not None and args.stats_interval <= 0:
+        parser.error('--stats-interval must be positive')
+
+    log = AsyncLogger(level=LEVELS[args.log_level], sample_rate=args.log_sample,
+                      capacity=args.log_buffer)
+    server = Server(args.server_port, args.accounts_file, args.rate, args.burst,
+                    args.over_limit, args.accounts_index, args.verify_threads, args.verify_queue,
+                    log, args.stats_port, args.stats_interval)
+
+    if args.workers > 1:
+        server.run_workers(args.workers, args.mode)
+    elif args.mode == 'event':
+        server.run_event_loop()
+    else:
+        server.run()
 
 class Server:
     '''
     The server class that listens for TCP connection requests, and for each, 
-    spawns a thread to receive and respond to authentication requests.
+    spawns a thread to receive and respond to authentication requests.  The
+    same requests can instead be served from a single-threaded event loop.
     '''
-    RATE_LIMIT = 0.1 # Rate limit for each client in seconds.
-    BUFFER_SIZE = 1024 # Size of the buffer for receiving messages.
+    POLL_INTERVAL = 0.1 # How often client threads check if the server is alive, in seconds.
+    BUFFER_SIZE = 65536 # Size of the buffer for receiving messages.
 
-    def __init__(self, server_port: int, accounts_file: str):
+    def __init__(self, server_port: int, accounts_file: str, rate: float = 10.0,
+                 burst: float = 10.0, over_limit: str = 'defer', accounts_index: bool = False,
+                 verify_threads: int = 1, verify_queue: int = 64, log: AsyncLogger = None,
+                 stats_port: int = None, stats_interval: float = None):
         '''Initialise the server with the specified port and accounts file.
 
         Args:
             server_port (int): The TCP port to listen on.
             accounts_file (str): Path to tab-separated file of username-hashed  
               password pairs.
+            rate (float): Password checks allowed per second for each client IP.
+            burst (float): Password checks a client IP may make at once.
+            over_limit (str): Whether to 'defer' or 'reject' requests over the
+              rate limit.
+            accounts_index (bool): Whether to serve the accounts from a
+              memory-mapped index rather than loading them into a dict.
+            verify_threads (int): The number of threads checking slow
+              password hashes.
+            verify_queue (int): The most slow password hashes being checked
+              or queued at once.
+            log (AsyncLogger): Where to log requests (default: every request
+              to stdout).
+            stats_port (int): Local TCP port to serve the metrics on, if any.
+            stats_interval (float): Seconds between dumps of the metrics to
+              stderr, if any.
         '''
         self.server_port = server_port
+        self.rate_limiter = TokenBucketLimiter(rate, burst)
+        self.over_limit = over_limit
         self.accounts = {}
-        self.load_accounts(accounts_file)
+        self.accounts_slow_hash = None # A stored slow hash, if any account has one.
+        self.dummy = (None, None) # (stored slow hash, dummy hash made from it)
+
+        if accounts_index:
+            self.load_accounts_index(accounts_file)
+        else:
+            self.load_accounts(accounts_file)
+
         self.is_alive = False
-        self.num_active_clients = 0
+
+        # Counters and request latencies, which the client threads update
+        # concurrently.  Worker processes are given shared metrics that the
+        # supervisor reads, see run_workers().
+        self.metrics = Metrics()
+        self.stats_port = stats_port
+        self.stats_interval = stats_interval
+        self.is_worker = False
+
+        # Slow password hashes are checked on a pool of threads, which is only
+        # started once the server is running, in the process that serves.
+        self.verify_threads = verify_threads
+        self.verify_queue = verify_queue
+        self.verifier = None
+        self.log = log or AsyncLogger()
 
     def load_accounts(self, accounts_file: str) -> None:
         '''Load the account information from the specified file.
@@ -83,6 +253,43 @@ class Server:
                 username, password_hash = split_line
                 self.accounts[username] = password_hash
 
+        self.accounts_slow_hash = next(filter(is_slow_hash, self.accounts.values()), None)
+
+    def load_accounts_index(self, accounts_file: str) -> None:
+        '''Open the memory-mapped index of the specified accounts file,
+        building it first if it is missing or out of date.
+
+        Args:
+            accounts_file (str): Path to tab-separated file of username-hashed  
+              password pairs.
+        '''
+        if not Path(accounts_file).is_file():
+            sys.exit(f'Error: {accounts_file} does not exist.')
+
+        self.accounts = AccountsStore(accounts_file)
+
+    def start_helper_threads(self) -> None:
+        '''Start the threads the serving process needs besides its own: the
+        pool for slow password checks, the log writer, and the accounts
+        reloader if the accounts are served from an index.  Unless this is a
+        worker, whose supervisor reports for it, also start reporting the
+        metrics.'''
+        self.verifier = VerifierPool(self.verify_threads, self.verify_queue)
+        self.log.start()
+
+        if isinstance(self.accounts, AccountsStore):
+            self.accounts.start_watching()
+
+        if not self.is_worker:
+            self.start_stats(lambda: self.metrics)
+
+    def stop_helper_threads(self) -> None:
+        '''Stop the verifier pool, and write out any buffered log records.'''
+        if self.verifier is not None:
+            self.verifier.shutdown()
+
+        self.log.close()
+
     def is_authorised(self, username: str, password_hash: str) -> bool:
         '''Check if the specified username and password hash are authorised.
 
@@ -94,19 +301,192 @@ class Server:
             bool: True if the username and password hash are authorised, False 
                 otherwise.
         '''
-        return username in self.accounts and self.accounts[username] == password_hash
+        stored_hash = self.accounts.get(username)
+
+        if stored_hash is None:
+            # Take as long to reject an unknown username as a real account.
+            unknown_hash = self.unknown_user_hash()
+
+            if unknown_hash is not None:
+                verify(unknown_hash, password_hash)
+
+            return False
+
+        return verify(stored_hash, password_hash)
+
+    def unknown_user_hash(self):
+        '''Return the dummy hash to check the passwords of unknown usernames
+        against, with the scheme and cost of the accounts' slow hashes, or
+        None if no account has a slow hash.  It is made again only when the
+        accounts are reloaded with different slow hashes.'''
+        if isinstance(self.accounts, AccountsStore):
+            slow_hash = self.accounts.slow_hash
+        else:
+            slow_hash = self.accounts_slow_hash
+
+        if slow_hash is None:
+            return None
+
+        source, dummy = self.dummy
+
+        if source != slow_hash:
+            dummy = dummy_hash(slow_hash)
+            self.dummy = (slow_hash, dummy)
+
+        return dummy
+
+    def needs_verifier(self, request: AuthRequest) -> bool:
+        '''Whether checking a request means computing a slow password hash,
+        which must be done on the verifier pool rather than inline.'''
+        if request.is_bad:
+            return False
+
+        stored_hash = self.accounts.get(request.username)
+
+        if stored_hash is None:
+            return self.unknown_user_hash() is not None
+
+        return is_slow_hash(stored_hash)
+
+    def check_passwords(self, request: AuthRequest) -> list:
+        '''Check every password hash in a request.
+
+        Args:
+            request (AuthRequest): The parsed request.
+
+        Returns:
+            List[bool]: Whether each password hash is authorised.
+        '''
+        return [self.is_authorised(request.username, password_hash)
+                for password_hash in request.password_hashes]
+
+    def create_welcome_socket(self) -> socket.socket:
+        '''Create the listening TCP socket and bind it to the server port.
+
+        Returns:
+            socket.socket: The bound, but not yet listening, socket.
+        '''
+        welcome_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+        if self.is_worker:
+            # Every worker process binds its own socket to the same port, and
+            # the kernel spreads incoming connections between them.
+            welcome_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        welcome_socket.bind(('localhost', self.server_port))
+
+        return welcome_socket
+
+    def count(self, counter: str, amount: int = 1) -> None:
+        '''Add to one of the server's counters.
+
+        Args:
+            counter (str): The name of the counter, from Metrics.COUNTERS.
+            amount (int): The amount to add.
+        '''
+        self.metrics.add(counter, amount)
+
+    def start_stats(self, report) -> None:
+        '''Start serving or dumping the metrics, as configured.
+
+        Args:
+            report (Callable[[], Metrics]): Returns the metrics to report.
+        '''
+        if self.stats_port is not None:
+            start_stats_server(self.stats_port, report)
+            print(f'Metrics available on port {self.stats_port}')
+
+        if self.stats_interval is not None:
+            start_stats_dump(self.stats_interval, report)
+
+    def run_workers(self, num_workers: int, mode: str) -> None:
+        '''Run as a supervisor of several worker processes, each serving
+        clients on the same port, so requests are handled on every core.
+
+        The workers are forked after the accounts have been loaded, so they
+        all share the parent's copy of the accounts table.
+
+        Args:
+            num_workers (int): The number of worker processes to start.
+            mode (str): The server mode each worker runs, 'threaded' or 'event'.
+        '''
+        context = multiprocessing.get_context('fork')
+        workers = []
+
+        print(f'Supervisor {os.getpid()} starting {num_workers} workers '
+              f'on port {self.server_port}...')
+
+        try:
+            for _ in range(num_workers):
+                # Each worker gets its own metrics, so they never contend on
+                # a lock with each other.
+                metrics = Metrics.shared()
+                worker = context.Process(target=self.worker_main, args=(mode, metrics))
+                worker.start()
+                workers.append((worker, metrics))
+
+            self.start_stats(lambda: Metrics.combine([metrics for _, metrics in workers]))
+
+            # Only the supervisor rebuilds the accounts index when the accounts
+            # file changes, and the workers map the new index once it's built.
+            # This must wait until the workers are forked, or they would
+            # inherit a watcher that isn't running in them.
+            if isinstance(self.accounts, AccountsStore):
+                self.accounts.start_watching()
+
+            for worker, _ in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            print('Supervisor stopping workers...')
+
+            # A Ctrl+C in the terminal reaches the workers directly, but pass
+            # the signal on in case only the supervisor was interrupted.
+            for worker, _ in workers:
+                if worker.is_alive():
+                    try:
+                        os.kill(worker.pid, signal.SIGINT)
+                    except ProcessLookupError:
+                        pass
+
+            for worker, _ in workers:
+                worker.join()
+
+        totals = Metrics.combine([metrics for _, metrics in workers])
+        print(f'Supervisor shutdown complete. Totals for {len(workers)} workers:')
+        print(totals.format(), end='')
+
+    def worker_main(self, mode: str, metrics: Metrics) -> None:
+        '''The entry point of a worker process started by run_workers().
+
+        Args:
+            mode (str): The server mode to run, 'threaded' or 'event'.
+            metrics (Metrics): This worker's metrics, in shared memory.
+        '''
+        self.is_worker = True
+        self.metrics = metrics
+
+        if isinstance(self.accounts, AccountsStore):
+            self.accounts.rebuild = False
+
+        try:
+            if mode == 'event':
+                self.run_event_loop()
+            else:
+                self.run()
+        except KeyboardInterrupt:
+            # Interrupted before the server loop was running.
+            pass
 
     def run(self):
         '''The main server loop, where the server listens for incoming requests.'''
 
         try:
             # Create a TCP socket and bind it to the specified port.
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as welcome_socket:
-                welcome_socket.bind(('localhost', self.server_port))
-
+            with self.create_welcome_socket() as welcome_socket:
                 # Listen for incoming connections.
                 welcome_socket.listen()
                 self.is_alive = True
+                self.start_helper_threads()
 
                 print(f'Server running on port {self.server_port}...')
                 print('Press Ctrl+C to exit.')
@@ -116,11 +496,12 @@ class Server:
                     # is received.
                     connection_socket, client_addr = welcome_socket.accept()
 
-                    # We'll increment this count with each new client connection, and
-                    # decrement it when a client thread finishes.  This will allow us
-                    # shut down more gracefully, by waiting for all client threads to
-                    # finish before exiting.
-                    self.num_active_clients += 1
+                    # We'll increment the active count with each new client
+                    # connection, and decrement it when a client thread finishes.
+                    # This will allow us shut down more gracefully, by waiting for
+                    # all client threads to finish before exiting.
+                    self.count('connections accepted')
+                    self.count('connections active')
 
                     # Spawn a new thread to handle the client connection, then
                     # loop back to accept the next connection.
@@ -133,10 +514,446 @@ class Server:
             # Flag the client threads to exit and wait for them to finish.
             self.is_alive = False
 
-            while self.num_active_clients > 0:
-                time.sleep(self.RATE_LIMIT)
+            while self.metrics.get('connections active') > 0:
+                time.sleep(self.POLL_INTERVAL)
+
+            self.stop_helper_threads()
+
+            print('Server shutdown complete.')
+
+    def run_event_loop(self):
+        '''An alternative server loop that serves every client from a single
+        thread, using a selector to wait until a socket is ready for I/O.'''
+        selector = selectors.DefaultSelector()
+
+        # Connections whose next request has been deferred by the rate
+        # limiter.  They are unregistered from the selector until their time
+        # is up, so the loop is never woken by them.  Kept as a heap of
+        # (resume_time, id, connection).
+        paused = []
+
+        # The verifier pool's threads wake the loop when a check finishes by
+        # writing to this socket pair.
+        wake_socket, self.wake_writer = socket.socketpair()
+        self.wake_writer.setblocking(False)
+        self.connections = set()
+        self.completed = deque() # Connections with a finished check.
+        self.pool_waiters = deque() # Connections waiting for room in the pool.
+
+        try:
+            with self.create_welcome_socket() as welcome_socket, wake_socket, self.wake_writer:
+                welcome_socket.listen()
+                welcome_socket.setblocking(False)
+                wake_socket.setblocking(False)
+
+                # The welcome and wake sockets are the only registered sockets
+                # without any connection state attached.
+                selector.register(welcome_socket, selectors.EVENT_READ)
+                selector.register(wake_socket, selectors.EVENT_READ)
+                self.is_alive = True
+                self.start_helper_threads()
+
+                print(f'Server running on port {self.server_port} (event loop)...')
+                print('Press Ctrl+C to exit.')
+
+                while True:
+                    timeout = None
+                    if paused:
+                        timeout = max(0, paused[0][0] - time.monotonic())
+
+                    for key, mask in selector.select(timeout):
+                        if key.fileobj is welcome_socket:
+                            self.accept_connection(selector, welcome_socket)
+                        elif key.fileobj is wake_socket:
+                            self.finish_checks(selector, wake_socket, paused)
+                        else:
+                            self.service_connection(selector, key.data, mask, paused)
+
+                    now = time.monotonic()
+                    while paused and paused[0][0] <= now:
+                        _, _, connection = heapq.heappop(paused)
+                        connection.resume_time = None
+                        self.service_connection(selector, connection, 0, paused)
+        except KeyboardInterrupt:
+            print('Cleaning up...')
+            self.is_alive = False
+
+            # Every client is owned by this thread, so there is nothing to wait
+            # for; just close the connections.
+            for connection in list(self.connections):
+                self.close_connection(selector, connection)
+
+            self.stop_helper_threads()
 
             print('Server shutdown complete.')
+        finally:
+            selector.close()
+
+    def finish_checks(self, selector, wake_socket, paused) -> None:
+        '''Send the responses for slow password checks that have finished, and
+        let connections waiting for room in the verifier pool try again.
+
+        Args:
+            selector (selectors.BaseSelector): The event loop's selector.
+            wake_socket (socket.socket): The socket the pool threads write to.
+            paused (list): Heap of connections waiting out the rate limit.
+        '''
+        try:
+            while wake_socket.recv(self.BUFFER_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+
+        while self.completed:
+            self.service_connection(selector, self.completed.popleft(), 0, paused)
+
+        for _ in range(len(self.pool_waiters)):
+            connection = self.pool_waiters.popleft()
+            connection.waiting_for_pool = False
+            self.service_connection(selector, connection, 0, paused)
+
+    def check_finished(self, connection) -> None:
+        '''Called on a verifier pool thread when a check for a connection
+        finishes, to wake the event loop.
+
+        Args:
+            connection (EventConnection): The client connection.
+        '''
+        self.completed.append(connection)
+
+        try:
+            self.wake_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Either the loop already has a wake up pending, or it has exited.
+            pass
+
+    def accept_connection(self, selector, welcome_socket) -> None:
+        '''Accept every pending connection on the welcome socket and register
+        them with the selector.
+
+        Args:
+            selector (selectors.BaseSelector): The event loop's selector.
+            welcome_socket (socket.socket): The listening socket.
+        '''
+        while True:
+            try:
+                connection_socket, client_addr = welcome_socket.accept()
+            except BlockingIOError:
+                return
+
+            connection_socket.setblocking(False)
+            self.count('connections accepted')
+            self.count('connections active')
+            connection = EventConnection(connection_socket, client_addr)
+            selector.register(connection_socket, selectors.EVENT_READ, connection)
+            self.connections.add(connection)
+
+    def service_connection(self, selector, connection, mask, paused) -> None:
+        '''Handle a readiness event for a client connection in the event loop,
+        or the end of its rate limit delay.
+
+        Args:
+            selector (selectors.BaseSelector): The event loop's selector.
+            connection (EventConnection): The client connection that is ready.
+            mask (int): The selector events the connection is ready for.
+            paused (list): Heap of connections waiting out the rate limit.
+        '''
+        if connection.closed:
+            return
+
+        connection_socket = connection.socket
+
+        if mask & selectors.EVENT_READ:
+            try:
+                request = connection_socket.recv(self.BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            except ConnectionResetError:
+                request = b''
+
+            if not request:
+                self.close_connection(selector, connection)
+                return
+
+            self.count('bytes in', len(request))
+
+            for parsed_request in connection.parser.feed(request):
+                ready_time = self.schedule(parsed_request, connection.client_ip)
+                connection.pending.append((ready_time, parsed_request))
+
+        self.start_checks(connection)
+
+        # Answer, in order, every request whose check has finished.
+        while connection.checks:
+            parsed_request, rate_limited, results = connection.checks[0]
+
+            if isinstance(results, Future):
+                if not results.done():
+                    break
+
+                results = results.result()
+
+            connection.checks.popleft()
+            connection.outgoing += self.build_response(parsed_request, results,
+                                                       connection.client_addr, rate_limited)
+
+        if connection.outgoing:
+            try:
+                bytes_sent = connection_socket.send(connection.outgoing)
+            except BlockingIOError:
+                bytes_sent = 0
+            except (ConnectionResetError, BrokenPipeError):
+                self.close_connection(selector, connection)
+                return
+
+            del connection.outgoing[:bytes_sent]
+            self.count('bytes out', bytes_sent)
+
+        if connection.outgoing:
+            # The socket's send buffer is full, so wait until it is writable
+            # rather than reading any more requests.
+            self.set_events(selector, connection, selectors.EVENT_WRITE)
+        elif connection.checks or connection.waiting_for_pool:
+            # Waiting on the verifier pool, which will wake us when it's done.
+            self.set_events(selector, connection, 0)
+        elif connection.pending:
+            # The next request has been deferred.  Stop reading until it is
+            # due, without holding up any other client.
+            self.set_events(selector, connection, 0)
+
+            if connection.resume_time != connection.pending[0][0]:
+                connection.resume_time = connection.pending[0][0]
+                heapq.heappush(paused, (connection.resume_time, id(connection), connection))
+        else:
+            self.set_events(selector, connection, selectors.EVENT_READ)
+
+    def start_checks(self, connection) -> None:
+        '''Start checking, in order, every pending request on a connection that
+        the rate limiter lets through now.  Plain password hashes are checked
+        immediately, and slow ones are handed to the verifier pool.
+
+        Args:
+            connection (EventConnection): The client connection.
+        '''
+        now = time.monotonic()
+
+        while connection.pending and not connection.waiting_for_pool:
+            ready_time, request = connection.pending[0]
+
+            if ready_time is not None and ready_time > now:
+                break
+
+            rate_limited = ready_time is None
+
+            if not rate_limited and self.needs_verifier(request):
+                results = self.verifier.submit(self.check_passwords, request,
+                                               cost=len(request.password_hashes), block=False)
+
+                if results is None:
+                    # The pool is full.  Leave the request pending, and stop
+                    # reading from this client until there is room.
+                    connection.waiting_for_pool = True
+                    self.pool_waiters.append(connection)
+                    break
+
+                results.add_done_callback(lambda _, c=connection: self.check_finished(c))
+            else:
+                results = [] if rate_limited else self.check_passwords(request)
+
+            connection.pending.popleft()
+            connection.checks.append((request, rate_limited, results))
+
+    def set_events(self, selector, connection, events: int) -> None:
+        '''Change the events the selector watches for on a connection.
+
+        Args:
+            selector (selectors.BaseSelector): The event loop's selector.
+            connection (EventConnection): The client connection.
+            events (int): The selector events to watch for, or 0 for none.
+        '''
+        if events == connection.events:
+            return
+
+        if connection.events == 0:
+            selector.register(connection.socket, events, connection)
+        elif events == 0:
+            selector.unregister(connection.socket)
+        else:
+            selector.modify(connection.socket, events, connection)
+
+        connection.events = events
+
+    def close_connection(self, selector, connection) -> None:
+        '''Stop watching a connection in the event loop and close it.
+
+        Args:
+            selector (selectors.BaseSelector): The event loop's selector.
+            connection (EventConnection): The client connection.
+        '''
+        self.set_events(selector, connection, 0)
+        self.connections.discard(connection)
+        self.count('connections active', -1)
+        connection.close()
+
+    def schedule(self, request: AuthRequest, client_ip: str):
+        '''Charge a request to its client's rate limit.
+
+        Every password hash checked costs one token, so batch and pipelined
+        requests are limited the same as requests sent one at a time.
+
+        Args:
+            request (AuthRequest): The parsed request.
+            client_ip (str): The IP address of the client.
+
+        Returns:
+            Optional[float]: The monotonic time at which the request may be
+                processed, or None if it is rejected for exceeding the limit.
+        '''
+        cost = max(1, len(request.password_hashes))
+
+        if self.over_limit == 'reject':
+            return time.monotonic() if self.rate_limiter.try_acquire(client_ip, cost) else None
+
+        return self.rate_limiter.reserve(client_ip, cost)
+
+    def handle_request(self, request: AuthRequest, client_addr: str,
+                       rate_limited: bool = False) -> bytes:
+        '''Process a single or batch authentication request and build the
+        response, waiting for the verifier pool if the account has a slow hash.
+
+        Args:
+            request (AuthRequest): The parsed request.
+            client_addr (str): The "host:port" of the client, for logging.
+            rate_limited (bool): Whether the request was rejected by the rate
+              limiter, and should be answered without being checked.
+
+        Returns:
+            bytes: The encoded response to send back to the client.
+        '''
+        if rate_limited:
+            results = []
+        elif self.needs_verifier(request):
+            results = self.verifier.submit(self.check_passwords, request,
+                                           cost=len(request.password_hashes)).result()
+        else:
+            results = self.check_passwords(request)
+
+        return self.build_response(request, results, client_addr, rate_limited)
+
+    def build_response(self, request: AuthRequest, results: list, client_addr: str,
+                       rate_limited: bool = False) -> bytes:
+        '''Build the response to a checked request.
+
+        Args:
+            request (AuthRequest): The parsed request.
+            results (List[bool]): Whether each of its password hashes is authorised.
+            client_addr (str): The "host:port" of the client, for logging.
+            rate_limited (bool): Whether the request was rejected by the rate
+              limiter.
+
+        Returns:
+            bytes: The encoded response to send back to the client.
+        '''
+        self.metrics.observe_latency(time.monotonic() - request.received_time)
+
+        # Either all of a request's log records are written, or none.
+        log_request = self.log.sample()
+
+        if rate_limited:
+            self.count(RATE_LIMITED)
+
+            if log_request:
+                self.log.info(f'{client_addr}: send: {RATE_LIMITED}')
+
+            return encode_response(RATE_LIMITED)
+
+        if request.is_bad:
+            self.log.warning(f'{client_addr}: recv: {repr(request.raw)}')
+            self.count('requests')
+            self.count(BAD_REQUEST)
+            self.log.warning(f'{client_addr}: send: {BAD_REQUEST}')
+            return encode_response(BAD_REQUEST)
+
+        for password_hash, authorised in zip(request.password_hashes, results):
+            if log_request:
+                self.log.info(f'{client_addr}: recv: {request.username} {password_hash}')
+
+            self.count('requests')
+            self.count(AUTHORISED if authorised else NOT_AUTHORISED)
+
+        if request.is_batch:
+            if log_request:
+                self.log.info(f'{client_addr}: send: results for {len(results)} '
+                              f'({results.count(True)} authorised)')
+
+            return encode_batch_response(results)
+
+        response = AUTHORISED if results[0] else NOT_AUTHORISED
+
+        if log_request:
+            self.log.info(f'{client_addr}: send: {response}')
+
+        return encode_response(response)
+
+    def send_response(self, connection_socket, encoded_response: bytes) -> bool:
+        '''Send a response in full on a non-blocking socket, waiting for the
+        socket to become writable whenever its send buffer is full.
+
+        Args:
+            connection_socket (socket.socket): The socket for the client connection.
+            encoded_response (bytes): The bytes to send.
+
+        Returns:
+            bool: True if everything was sent, False if the connection failed
+                or the server is shutting down.
+        '''
+        outgoing = memoryview(encoded_response)
+
+        while outgoing:
+            if not self.is_alive:
+                return False
+
+            try:
+                bytes_sent = connection_socket.send(outgoing)
+            except BlockingIOError:
+                select.select([], [connection_socket], [], self.POLL_INTERVAL)
+            except (ConnectionResetError, BrokenPipeError):
+                return False
+            else:
+                outgoing = outgoing[bytes_sent:]
+                self.count('bytes out', bytes_sent)
+
+        return True
+
+    def serve_requests(self, connection_socket, requests: list, client_ip: str,
+                       client_addr: str) -> bool:
+        '''Answer requests in order from a client thread, waiting out any
+        delay imposed by the rate limiter.
+
+        Args:
+            connection_socket (socket.socket): The socket for the client connection.
+            requests (List[AuthRequest]): The parsed requests.
+            client_ip (str): The IP address of the client.
+            client_addr (str): The "host:port" of the client, for logging.
+
+        Returns:
+            bool: True if every response was sent, False if the connection
+                should be closed.
+        '''
+        for request in requests:
+            ready_time = self.schedule(request, client_ip)
+
+            # Deferred requests only hold up this client's thread.
+            while ready_time is not None and self.is_alive and time.monotonic() < ready_time:
+                time.sleep(min(self.POLL_INTERVAL, ready_time - time.monotonic()))
+
+            encoded_response = self.handle_request(request, client_addr,
+                                                   rate_limited=ready_time is None)
+
+            if not self.send_response(connection_socket, encoded_response):
+                return False
+
+        return True
 
     def client_thread_handler(self, connection_socket, client_addr) -> None:
         '''The handler for each client connection, which processes requests.
@@ -151,8 +968,13 @@ class Server:
         connection_socket.setblocking(False)
 
         # Convert the client address to a string for logging. (not terribly important)
+        client_ip = client_addr[0]
         client_addr = f'{client_addr[0]}:{client_addr[1]}'
 
+        # Requests may arrive split across several reads, or several at once,
+        # so each connection needs its own parser to buffer them.
+        parser = RequestParser()
+
         with connection_socket:
             while self.is_alive:
                 try:
@@ -160,7 +982,7 @@ class Server:
                 except BlockingIOError:
                     # No data available to read, so we'll just wait a bit and
                     # try again.
-                    time.sleep(self.RATE_LIMIT)
+                    time.sleep(self.POLL_INTERVAL)
                     continue
                 except ConnectionResetError:
                     # Client is probably misbehaving (e.g. has forcibly closed
@@ -173,36 +995,43 @@ class Server:
                 if not request:
                     break
 
-                request = request.decode()
-                lines = request.split('\n')
+                self.count('bytes in', len(request))
 
-                # Just to add a bit of robustness to the request handling.
-                lines = [line.strip() for line in lines if len(line.strip()) > 0]
+                if not self.serve_requests(connection_socket, parser.feed(request),
+                                           client_ip, client_addr):
+                    break
 
-                if len(lines) == 2:
-                    username, password_hash = lines
-                    print(f'{client_addr}: recv: {username} {password_hash}')
+        # Decrement this count before the thread finishes, so the server knows
+        # when all client threads have finished and it can exit.
+        self.count('connections active', -1)
 
-                    response = 'authorised' if self.is_authorised(username, password_hash) \
-                        else 'not authorised'
-                else:
-                    print(f'{client_addr}: recv: {repr(request)}')
-                    response = 'bad request'
 
-                print(f'{client_addr}: send: {response}')
+class EventConnection:
+    '''The state the event loop keeps for each client connection.'''
 
-                encoded_response = response.encode()
-                bytes_sent = connection_socket.send(encoded_response)
+    def __init__(self, connection_socket, client_addr):
+        '''Initialise the connection state.
 
-                if bytes_sent != len(encoded_response):
-                    # We should really do something smarter than this!
-                    break
-
-                time.sleep(self.RATE_LIMIT)
+        Args:
+            connection_socket (socket.socket): The socket for the client connection.
+            client_addr (Tuple[str, int]): The (host, port) of the client.
+        '''
+        self.socket = connection_socket
+        self.client_ip = client_addr[0]
+        self.client_addr = f'{client_addr[0]}:{client_addr[1]}'
+        self.parser = RequestParser()
+        self.pending = deque() # (ready time, request) waiting on the rate limiter.
+        self.checks = deque() # (request, rate limited, results or future) being checked.
+        self.waiting_for_pool = False
+        self.resume_time = None # When the connection is due off the rate limit heap.
+        self.outgoing = bytearray()
+        self.events = selectors.EVENT_READ # Events registered with the selector.
+        self.closed = False
 
-        # Decrement this count before the thread finishes, so the server knows
-        # when all client threads have finished and it can exit.
-        self.num_active_clients -= 1
+    def close(self) -> None:
+        '''Close the client connection.'''
+        self.closed = True
+        self.socket.close()
 
 
 if __name__ == '__main__':
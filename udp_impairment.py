@@ -0,0 +1,189 @@
+'''
+COMP3331/9331 Computer Networks and Applications
+Programming Tutorial
+
+Simulated network impairments for UDPServer.py, so that PingClient.py can be
+tried against loss, delay and reordering on a single machine.
+
+Every reply the server would send is passed to an Impairment, which decides
+its fate, in this order:
+
+- rate:       replies beyond `rate` per second, with bursts of up to `burst`,
+              are dropped, as by a policer on a slow link.
+- loss:       each reply is dropped with probability `loss`.
+- duplicate:  each reply is sent twice with probability `duplicate`.  The
+              copies are delayed independently.
+- delay:      each copy is held for `delay` seconds plus a random jitter drawn
+              from the `distribution`, never less than zero.  With jitter
+              larger than the gap between replies, replies overtake each other
+              as they would on a real path.
+- reorder:    each copy is held back a further `reorder_delay` seconds with
+              probability `reorder`, so that replies sent after it overtake it.
+
+Held replies wait on a heap of timers, ordered by the time they are due, so
+any number can be in flight at once without a thread or a sleep each.  The
+server sends whatever due() returns and sleeps until next_time().  At most
+`queue_limit` replies are held at once; beyond that they are dropped.
+
+All the random choices come from one random.Random, so a run given a seed,
+and the same datagrams in the same order, makes the same choices every time.
+'''
+
+import heapq
+import itertools
+import random
+import time
+
+from rate_limiter import TokenBucketLimiter
+
+DISTRIBUTIONS = ('uniform', 'normal', 'exponential', 'pareto')
+COUNTERS = ('rate limited', 'lost', 'duplicated', 'reordered', 'queue full', 'delayed')
+
+class Impairment:
+    '''Decides the fate of each datagram, and holds the delayed ones until due.'''
+
+    def __init__(self, loss: float = 0.0, delay: float = 0.0, jitter: float = 0.0,
+                 distribution: str = 'uniform', reorder: float = 0.0, reorder_delay: float = None,
+                 duplicate: float = 0.0, rate: float = None, burst: float = None,
+                 queue_limit: int = 100000, seed: int = None, clock=time.monotonic):
+        '''Initialise the impairment.
+
+        Args:
+            loss (float): The probability of dropping a datagram.
+            delay (float): The fixed delay added to every datagram, in seconds.
+            jitter (float): The scale of the random variation in the delay, in
+              seconds: the half-width of a uniform distribution, the standard
+              deviation of a normal one, or the mean of an exponential or
+              Pareto one.
+            distribution (str): One of DISTRIBUTIONS.  Uniform and normal
+              jitter is centred on the delay, while exponential and Pareto
+              jitter only ever adds to it, the Pareto with a long tail.
+            reorder (float): The probability of holding a datagram back so
+              that later ones overtake it.
+            reorder_delay (float): How long to hold it back, in seconds
+              (default: twice the delay plus jitter, and at least 10 ms).
+            duplicate (float): The probability of sending a datagram twice.
+            rate (float): The most datagrams sent per second, or None for no
+              limit.
+            burst (float): The most datagrams sent at once without regard to
+              the rate (default: a tenth of a second's worth, at least 1).
+            queue_limit (int): The most datagrams held at once.
+            seed (int): Seeds the random choices, for a reproducible run.
+            clock (Callable[[], float]): Returns the current time in seconds.
+        '''
+        for name, probability in (('loss', loss), ('reorder', reorder), ('duplicate', duplicate)):
+            if not 0 <= probability <= 1:
+                raise ValueError(f'{name} must be a probability from 0 to 1')
+
+        if delay < 0 or jitter < 0:
+            raise ValueError('delay and jitter must not be negative')
+
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f'distribution must be one of {", ".join(DISTRIBUTIONS)}')
+
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.distribution = distribution
+        self.reorder = reorder
+        self.reorder_delay = (reorder_delay if reorder_delay is not None
+                              else max(0.01, 2 * (delay + jitter)))
+        self.duplicate = duplicate
+        self.limiter = (TokenBucketLimiter(rate, burst or max(1.0, rate / 10), clock=clock)
+                        if rate else None)
+        self.queue_limit = queue_limit
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.heap = [] # (due time, arrival order, data, address)
+        self.order = itertools.count() # Keeps datagrams due at the same time in order.
+        self.counts = dict.fromkeys(COUNTERS, 0)
+
+    @property
+    def active(self) -> bool:
+        '''Whether the impairment does anything at all.'''
+        return bool(self.loss or self.delay or self.jitter or self.reorder or self.duplicate
+                    or self.limiter is not None)
+
+    def submit(self, data: bytes, address, now: float = None) -> list:
+        '''Pass a datagram through the impairment.
+
+        Args:
+            data (bytes): The datagram.
+            address (Tuple[str, int]): Where it is to be sent.
+            now (float): The current time, if already known.
+
+        Returns:
+            List[bytes]: The copies of the datagram to send straight away.
+                Any others are held until due() returns them.
+        '''
+        now = self.clock() if now is None else now
+
+        if self.limiter is not None and not self.limiter.try_acquire(None):
+            self.counts['rate limited'] += 1
+            return []
+
+        if self.loss and self.random.random() < self.loss:
+            self.counts['lost'] += 1
+            return []
+
+        copies = 1
+
+        if self.duplicate and self.random.random() < self.duplicate:
+            self.counts['duplicated'] += 1
+            copies = 2
+
+        now_copies = []
+
+        for _ in range(copies):
+            hold = self.sample_delay()
+
+            if self.reorder and self.random.random() < self.reorder:
+                self.counts['reordered'] += 1
+                hold += self.reorder_delay
+
+            if hold <= 0:
+                now_copies.append(data)
+            elif len(self.heap) >= self.queue_limit:
+                self.counts['queue full'] += 1
+            else:
+                self.counts['delayed'] += 1
+                heapq.heappush(self.heap, (now + hold, next(self.order), data, address))
+
+        return now_copies
+
+    def sample_delay(self) -> float:
+        '''Draw the delay of one datagram, in seconds.'''
+        if not self.jitter:
+            return self.delay
+
+        if self.distribution == 'uniform':
+            jitter = self.random.uniform(-self.jitter, self.jitter)
+        elif self.distribution == 'normal':
+            jitter = self.random.gauss(0, self.jitter)
+        elif self.distribution == 'exponential':
+            jitter = self.random.expovariate(1 / self.jitter)
+        else:
+            # A Pareto distribution with shape 3 has a mean of 1.5, so scale
+            # it to a mean of `jitter` from a minimum of 0.
+            jitter = (self.random.paretovariate(3) - 1) * 2 * self.jitter
+
+        return max(0.0, self.delay + jitter)
+
+    def due(self, now: float = None) -> list:
+        '''Remove and return the held datagrams that are now due, in order.
+
+        Returns:
+            List[Tuple[bytes, Tuple[str, int]]]: Each datagram and its address.
+        '''
+        now = self.clock() if now is None else now
+        ready = []
+
+        while self.heap and self.heap[0][0] <= now:
+            _, _, data, address = heapq.heappop(self.heap)
+            ready.append((data, address))
+
+        return ready
+
+    def next_time(self):
+        '''Return when the next held datagram is due, or None if none are held.'''
+        return self.heap[0][0] if self.heap else None
@@ -2,8 +2,9 @@
 import select
 import sys
 import socket
-import re
-from pathlib import Path
+
+from file_cache import FileCache, send_response
+from http_parser import RequestParser
 
 if len(sys.argv) != 2:
     print("Usage: web_server.py PORT")
@@ -12,55 +13,85 @@ if len(sys.argv) != 2:
 host = '127.0.0.1'
 port = int(sys.argv[1])
 KEEP_ALIVE_TIMEOUT = 20  # seconds
+MAX_REQUESTS = 100  # requests answered on a connection before closing it
+# Prebuilt responses for the files served, revalidated against the disk with a stat
+file_cache = FileCache(not_found_body=b"Page Not Found!")
 
 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
     s.bind((host, port))
     s.listen()
-    while True:
-        conn, addr = s.accept()
-        conn.setblocking(0)
-        with conn:
-            print(f"Connected by {addr}")
-            alive = True
-            while alive:
-                # Use select to check if data is ready to be received
-                ready = select.select([conn], [], [], KEEP_ALIVE_TIMEOUT)
-                if ready[0]:
-                    data = conn.recv(1024)
-                else:
-                    break
+    try:
+        while True:
+            conn, addr = s.accept()
+            # A timeout rather than a non-blocking socket, so that large files
+            # can be streamed to it with sendfile
+            conn.settimeout(KEEP_ALIVE_TIMEOUT)
+            with conn:
+                print(f"Connected by {addr}")
+                # Requests can arrive split over several reads, or several in one
+                # read (pipelined), so they're parsed from a buffer kept for the
+                # whole connection, and answered in the order they arrive
+                parser = RequestParser(max_requests=MAX_REQUESTS)
+                alive = True
+                while alive:
+                    # Use select to check if data is ready to be received
+                    ready = select.select([conn], [], [], KEEP_ALIVE_TIMEOUT)
+                    if not ready[0]:
+                        print("Connection idle - closing connection.")
+                        break
+                    try:
+                        data = conn.recv(65536)
+                    except OSError as e:
+                        print(f"Error receiving: {e}")
+                        break
 
-                if not data:
-                    print("Received empty packet - closing connection.")
-                    break
+                    if not data:
+                        print("Received empty packet - closing connection.")
+                        break
 
-                print(f"Received: {data[:20]}")
-                if not re.match(b'GET .* HTTP/1.1', data):
-                    print("Not a GET request.")
-                    break
-                file = re.findall(b'GET (.*) HTTP/1.1', data)[0][1:].decode()
-                if file == '':
-                    file = 'index.html'
-                if not Path(file).exists():
-                    # Error 404
-                    print(f"File {file} not found.")
-                    status = b"404 Not Found"
-                    content = b"Page Not Found!"
-                else:
-                    status = b"200 OK"
-                    with open(file, 'rb') as f:
-                        content = f.read()
-                # Create Header
-                header = b"HTTP/1.1 " + status + b"\r\n"
-                header += b"Content-Length: " + str(len(content)).encode() + b"\r\n"
-                header += b"Connection: keep-alive\r\n"
-                header += b"Keep-Alive: timeout=" + str(KEEP_ALIVE_TIMEOUT).encode() + b", max=100\r\n"
-                header += b"\r\n"
-                # Create Message
-                msg = header + content
-                # Send response
-                conn.sendall(msg)
-                # Determine if connection should be closed
-                if re.search(b'Connection: close', data):
-                    alive = False
-                    print("Client requested connection close.")
+                    print(f"Received: {data[:20]}")
+                    for request in parser.feed(data):
+                        alive = request.keep_alive
+                        if request.error or request.method != "GET":
+                            # The parser ignores anything after a bad request
+                            error = request.error or "501 Not Implemented"
+                            print(f"Bad request: {error}")
+                            body = error.encode()
+                            try:
+                                conn.sendall(b"HTTP/1.1 " + body + b"\r\nContent-Type: text/html\r\nContent-Length: "
+                                             + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+                            except OSError:
+                                pass
+                            alive = False
+                            break
+                        file = request.path
+                        if file == '':
+                            file = 'index.html'
+                        # Text goes gzipped to clients that accept it
+                        cached = file_cache.get(file, request.headers)
+                        if cached.status == 404:
+                            # Error 404
+                            print(f"File {file} not found.")
+                        # Create Header (the status line and content headers come prebuilt)
+                        if alive:
+                            header = b"Connection: keep-alive\r\n"
+                            header += b"Keep-Alive: timeout=" + str(KEEP_ALIVE_TIMEOUT).encode() + b", max=" + str(request.remaining).encode() + b"\r\n"
+                        else:
+                            # The client asked to close, or this was the last request we allow
+                            header = b"Connection: close\r\n"
+                            print(f"Closing connection after request {request.number}.")
+                        # Send response (or just the byte ranges asked for), streaming large files from disk
+                        # (or a bodyless 304 if the client's copy is still current)
+                        try:
+                            if not send_response(conn, cached, header, request.headers):
+                                print(f"File {file} shrank while sending - closing connection.")
+                                alive = False
+                                break
+                        except OSError as e:
+                            print(f"Error sending {file}: {e}")
+                            alive = False
+                            break
+    except KeyboardInterrupt:
+        # Report how much gzip saved once, at shutdown, rather than per response
+        print("Shutting down...")
+        print(file_cache.compression_report())
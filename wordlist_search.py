@@ -0,0 +1,385 @@
+'''
+COMP3331/9331 Computer Networks and Applications
+Programming Tutorial
+
+A parallel engine for trialling a large wordlist against the authentication
+server, used by client-2.py.
+
+The wordlist is read in large chunks, which a pool of processes hash in
+parallel while earlier chunks are being sent, unless the hashes are read from
+the wordlist's hash cache (see hash_cache.py).  The hashed passwords are split
+into requests and shared out between several connections to the server, each
+of which keeps several requests in flight at once, so that no connection sits
+idle waiting for a round trip.  As soon as any connection gets an authorised
+result, every connection stops.  Progress is reported at most once every
+PROGRESS_INTERVAL seconds, rather than once per password.
+'''
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+
+from auth_protocol import (AUTHORISED, NOT_AUTHORISED, RATE_LIMITED, ResponseReader,
+                           encode_batch_request, encode_request, parse_batch_response)
+from hash_cache import HashCache
+
+BUFFER_SIZE = 65536
+RETRY_DELAY = 0.5 # Seconds to wait before first retrying a rate limited request.
+MAX_RETRY_DELAY = 8.0 # Longest wait between retries, which double each time.
+MAX_RETRIES = 10 # Retries of a rate limited request before giving up.
+CHUNK_BYTES = 1 << 20 # Roughly how much of the wordlist to read and hash at once.
+PROGRESS_INTERVAL = 1.0 # Seconds between progress reports.
+
+def hash_passwords(passwords: list) -> list:
+    '''Return the SHA-1 hex digests of a list of passwords.
+
+    Args:
+        passwords (List[str]): The passwords to hash.
+
+    Returns:
+        List[str]: The digest of each password, in order.
+    '''
+    return [hashlib.sha1(password.encode()).hexdigest() for password in passwords]
+
+class WordlistSearch:
+    '''A search of a wordlist for the password of one account.'''
+
+    def __init__(self, server_port: int, username: str, connections: int = 4,
+                 pipeline: int = 4, batch_size: int = 1000, hash_processes: int = None,
+                 hash_cache: HashCache = None):
+        '''Initialise the search.
+
+        Args:
+            server_port (int): The TCP port of the server.
+            username (str): The username of the account to authenticate.
+            connections (int): The number of connections to the server.
+            pipeline (int): The most requests in flight on each connection.
+            batch_size (int): The number of passwords to try in each request.
+              With 1, plain requests are sent rather than batch requests.
+            hash_processes (int): The number of processes hashing the wordlist,
+              or 0 to hash in this process (default: one per core).
+            hash_cache (HashCache): The up to date hash cache of the wordlist,
+              to read the hashes from rather than hashing the wordlist.
+        '''
+        self.server_port = server_port
+        self.username = username
+        self.connections = connections
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.hash_processes = hash_processes if hash_processes is not None else os.cpu_count() or 1
+        self.hash_cache = hash_cache
+
+        # Batches of (passwords, hashes) waiting for a connection, with a None
+        # for each connection once the wordlist is exhausted.
+        self.batches = queue.Queue(connections * pipeline * 2)
+        self.stop = threading.Event()
+        self.sockets = set() # The open connections, to shut down when the search stops.
+        self.lock = threading.Lock()
+        self.password = None
+        self.error = None
+        self.tried = 0
+        self.start_time = None
+        self.last_report = 0.0
+
+    def run(self, wordlist: str):
+        '''Trial every password in the wordlist, stopping at the first one
+        that is authorised.
+
+        Args:
+            wordlist (str): The path to the wordlist file.
+
+        Returns:
+            Optional[str]: The authorised password, or None if there isn't one.
+
+        Raises:
+            ConnectionError: If a connection to the server failed, or the
+              server sent an unexpected response.
+        '''
+        self.start_time = time.monotonic()
+        pool = None
+
+        if self.hash_cache is None and self.hash_processes > 0:
+            # Spawn rather than fork the hashing processes, since the
+            # connection threads are already running by the time they start.
+            pool = ProcessPoolExecutor(self.hash_processes,
+                                       mp_context=multiprocessing.get_context('spawn'))
+
+        threads = [threading.Thread(target=self.connection_worker, daemon=True)
+                   for _ in range(self.connections)]
+
+        if self.hash_cache is not None:
+            chunks = self.hash_cache.chunks()
+        else:
+            chunks = self.hashed_chunks(wordlist, pool)
+
+        try:
+            for thread in threads:
+                thread.start()
+
+            for passwords, password_hashes in chunks:
+                if self.stop.is_set():
+                    break
+
+                for i in range(0, len(passwords), self.batch_size):
+                    self.put((passwords[i:i + self.batch_size],
+                              password_hashes[i:i + self.batch_size]))
+
+            for _ in threads:
+                self.put(None)
+
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(PROGRESS_INTERVAL)
+                    self.report_progress()
+        finally:
+            self.stop.set()
+
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        self.report_progress(final=True)
+
+        if self.error is not None and self.password is None:
+            raise ConnectionError(self.error)
+
+        return self.password
+
+    def hashed_chunks(self, wordlist: str, pool):
+        '''Read and hash the wordlist a chunk at a time, keeping the hashing
+        processes busy with the chunks ahead of the one being sent.
+
+        Args:
+            wordlist (str): The path to the wordlist file.
+            pool (Optional[ProcessPoolExecutor]): The hashing processes, or
+              None to hash in this process.
+
+        Yields:
+            Tuple[List[str], List[str]]: The passwords of each chunk, in
+                order, and their hashes.
+        '''
+        pending = deque()
+
+        with open(wordlist, 'r', encoding='utf-8') as file:
+            while not self.stop.is_set():
+                while len(pending) < 2 * max(1, self.hash_processes):
+                    passwords = [line.strip() for line in file.readlines(CHUNK_BYTES)]
+
+                    if not passwords:
+                        break
+
+                    if pool is None:
+                        pending.append((passwords, hash_passwords(passwords)))
+                    else:
+                        pending.append((passwords, pool.submit(hash_passwords, passwords)))
+
+                if not pending:
+                    return
+
+                passwords, password_hashes = pending.popleft()
+
+                if pool is not None:
+                    password_hashes = password_hashes.result()
+
+                yield passwords, password_hashes
+
+    def put(self, batch) -> None:
+        '''Queue a batch for the connections, reporting progress while the
+        queue is full.  Gives up once the search has stopped.'''
+        while not self.stop.is_set():
+            try:
+                self.batches.put(batch, timeout=PROGRESS_INTERVAL)
+                return
+            except queue.Full:
+                pass
+            finally:
+                self.report_progress()
+
+    def connection_worker(self) -> None:
+        '''The body of each connection thread, which sends batches from the
+        queue, keeping up to pipeline requests in flight, and checks the
+        responses as they come back in order.'''
+        try:
+            with socket.create_connection(('localhost', self.server_port)) as client_socket:
+                with self.lock:
+                    self.sockets.add(client_socket)
+
+                try:
+                    reader = ResponseReader(client_socket, BUFFER_SIZE)
+                    self.pipeline_requests(client_socket, reader)
+                finally:
+                    with self.lock:
+                        self.sockets.discard(client_socket)
+        except OSError as e:
+            # Once the search has stopped, errors from the sockets it shut
+            # down are expected.
+            if not self.stop.is_set():
+                self.fail(f'Connection error: {e}')
+
+    def pipeline_requests(self, client_socket, reader: ResponseReader) -> None:
+        '''Send batches on a connection and check their responses until the
+        wordlist is exhausted or the search stops.
+
+        Args:
+            client_socket (socket.socket): The socket connected to the server.
+            reader (ResponseReader): The reader for the server's responses.
+        '''
+        in_flight = deque() # (passwords, request, retries so far) awaiting a response.
+        retrying = [] # Heap of (retry time, order, passwords, request, retries so far).
+        order = itertools.count()
+        exhausted = False
+
+        while not self.stop.is_set():
+            now = time.monotonic()
+
+            while retrying and retrying[0][0] <= now and len(in_flight) < self.pipeline:
+                _, _, passwords, request, retries = heapq.heappop(retrying)
+                client_socket.sendall(request)
+                in_flight.append((passwords, request, retries))
+
+            # While the server is rate limiting us, new batches would only be
+            # rejected too, so hold them back until the retries are through.
+            while not exhausted and not retrying and len(in_flight) < self.pipeline:
+                try:
+                    # Only wait for a batch if there are no responses to read.
+                    batch = self.batches.get(timeout=PROGRESS_INTERVAL) if not in_flight \
+                        else self.batches.get_nowait()
+                except queue.Empty:
+                    break
+
+                if batch is None:
+                    exhausted = True
+                    break
+
+                passwords, password_hashes = batch
+                request = self.encode(password_hashes)
+                client_socket.sendall(request)
+                in_flight.append((passwords, request, 0))
+
+            if not in_flight:
+                if retrying:
+                    self.stop.wait(retrying[0][0] - now)
+                elif exhausted:
+                    return
+
+                continue
+
+            response = reader.read_response()
+
+            if self.stop.is_set():
+                # Another connection finished the search, and shut this one
+                # down, so whatever was in flight no longer matters.
+                return
+
+            passwords, request, retries = in_flight.popleft()
+
+            if response == RATE_LIMITED:
+                # The server didn't check these, so send them again later,
+                # while reading the responses to the requests still in flight.
+                if retries >= MAX_RETRIES:
+                    self.fail(f'Still rate limited after {MAX_RETRIES} retries.')
+                    return
+
+                delay = min(RETRY_DELAY * 2 ** retries, MAX_RETRY_DELAY)
+                heapq.heappush(retrying, (time.monotonic() + delay, next(order), passwords,
+                                          request, retries + 1))
+                continue
+
+            results = self.parse(response)
+
+            if results is None or len(results) != len(passwords):
+                self.fail('Server closed the connection.' if response is None
+                          else f'Unexpected response: {response}')
+                return
+
+            with self.lock:
+                self.tried += len(passwords)
+
+            if True in results:
+                self.succeed(passwords[results.index(True)])
+                return
+
+    def encode(self, password_hashes: list) -> bytes:
+        '''Encode the request for a batch of password hashes.'''
+        if self.batch_size == 1:
+            return encode_request(self.username, password_hashes[0])
+
+        return encode_batch_request(self.username, password_hashes)
+
+    def parse(self, response: str):
+        '''Parse the response to a request made by encode().
+
+        Returns:
+            Optional[List[bool]]: Whether each password was authorised, or None
+                if the response is not valid.
+        '''
+        if response is None:
+            return None
+
+        if self.batch_size == 1:
+            if response not in (AUTHORISED, NOT_AUTHORISED):
+                return None
+
+            return [response == AUTHORISED]
+
+        return parse_batch_response(response)
+
+    def succeed(self, password: str) -> None:
+        '''Record the authorised password, and stop every connection.'''
+        with self.lock:
+            if self.password is None:
+                self.password = password
+
+        self.stop_connections()
+
+    def fail(self, error: str) -> None:
+        '''Record why a connection failed, and stop every connection, since
+        its batches were never checked.'''
+        with self.lock:
+            if self.error is None:
+                self.error = error
+
+        self.stop_connections()
+
+    def stop_connections(self) -> None:
+        '''Stop the search, and shut down every connection so that threads
+        waiting for responses, which may be deferred by the server's rate
+        limit for a long time, return at once.'''
+        self.stop.set()
+
+        # Make room for a batch the reader may be blocked putting, so that it
+        # notices the search has stopped.
+        try:
+            while True:
+                self.batches.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            sockets = list(self.sockets)
+
+        for client_socket in sockets:
+            try:
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass # Already closed.
+
+    def report_progress(self, final: bool = False) -> None:
+        '''Print the number of passwords tried so far, at most once every
+        PROGRESS_INTERVAL seconds unless this is the final report.'''
+        now = time.monotonic()
+
+        if not final and now - self.last_report < PROGRESS_INTERVAL:
+            return
+
+        self.last_report = now
+        elapsed = max(now - self.start_time, 1e-9)
+        print(f'Tried {self.tried} passwords ({self.tried / elapsed:.0f}/s)',
+              end='\n' if final else '\r', flush=True)